@@ -1,12 +1,49 @@
 """База данных для клиентов"""
+from pathlib import Path
+from pydantic import BaseSettings
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
-SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./clients.db"
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+class DBSettings(BaseSettings):
+    """Настройки подключения к SQLite (переопределяются переменными окружения AUTH_DB_*)"""
+    #Файл рядом с пакетом, а не в текущем каталоге: сервис запускается из корня репозитория
+    url: str = f"sqlite+aiosqlite:///{Path(__file__).with_name('clients.db')}"
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout: int = 5000
+    mmap_size: int = 268435456
+    cache_size: int = -16000
+    pool_size: int = 5
+    max_overflow: int = 10
 
-async_session = async_sessionmaker(engine)
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "AUTH_DB_"
+
+settings = DBSettings()
+SQLALCHEMY_DATABASE_URL = settings.url
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False},
+                             pool_size = settings.pool_size, max_overflow = settings.max_overflow)
+
+async_session = async_sessionmaker(engine, expire_on_commit = False)
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """Настройка каждого нового соединения с SQLite"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.busy_timeout}")
+    cursor.execute(f"PRAGMA mmap_size={settings.mmap_size}")
+    cursor.execute(f"PRAGMA cache_size={settings.cache_size}")
+    cursor.close()
 
 class Base(DeclarativeBase):
     """Основа для базы данных"""
-    pass
\ No newline at end of file
+    pass
+
+async def init_db():
+    """Создание или проверка схемы (один раз при запуске)"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
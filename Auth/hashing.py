@@ -0,0 +1,94 @@
+"""Хэширование и проверка паролей в ограниченном пуле потоков или процессов"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import bcrypt
+from pydantic import BaseSettings
+
+class HashSettings(BaseSettings):
+    """Настройки хэширования (переменные окружения AUTH_HASH_*)"""
+    #Сложность bcrypt; при её смене пароли перехэшируются при входе
+    rounds: int = 12
+    workers: int = os.cpu_count() or 1
+    #thread или process
+    executor: str = "thread"
+    #Сколько запросов может ждать свободного исполнителя, прежде чем отвечать 503
+    max_queue: int = 64
+    retry_after: int = 1
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "AUTH_HASH_"
+
+class HasherBusy(Exception):
+    """Очередь на хэширование переполнена"""
+
+def hash_password(password: str, rounds: int):
+    """Хэш пароля (выполняется в пуле)"""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode()
+
+def check_password(password: str, hashed):
+    """Проверка пароля (выполняется в пуле)"""
+    if isinstance(hashed, str):
+        hashed = hashed.encode()
+    return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+def hash_rounds(hashed):
+    """Сложность, с которой был получен хэш ($2b$12$...)"""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode()
+    return int(hashed.split("$")[2])
+
+class PasswordHasher:
+    """Пул для bcrypt; лишние запросы сверх workers + max_queue сразу отклоняются"""
+
+    def __init__(self, settings: HashSettings):
+        self.settings = settings
+        self.executor = None
+        self.pending = 0
+        self.rejected = 0
+
+    def start(self):
+        """Создание пула"""
+        if self.settings.executor == "process":
+            self.executor = ProcessPoolExecutor(max_workers = self.settings.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers = self.settings.workers, thread_name_prefix="bcrypt")
+
+    def shutdown(self):
+        """Остановка пула"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def queue_depth(self):
+        """Сколько запросов ждёт исполнителя"""
+        return max(0, self.pending - self.settings.workers)
+
+    async def run(self, func, *args):
+        """Выполнение в пуле с ограничением очереди"""
+        if self.pending >= self.settings.workers + self.settings.max_queue:
+            self.rejected += 1
+            raise HasherBusy()
+        if self.executor is None:
+            self.start()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        """Хэш пароля с текущей сложностью"""
+        return await self.run(hash_password, password, self.settings.rounds)
+
+    async def verify(self, password: str, hashed):
+        """Совпадает ли пароль с хэшем"""
+        return await self.run(check_password, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """Хэш получен с другой сложностью"""
+        return hash_rounds(hashed) != self.settings.rounds
+
+settings = HashSettings()
+hasher = PasswordHasher(settings)
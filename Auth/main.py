@@ -1,19 +1,27 @@
 """Регистрация и авторизация"""
 import re
-import bcrypt
-from fastapi import FastAPI, HTTPException, Depends
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse
 from fastapi_jwt_auth import AuthJWT
+from common.jwt import Claims, configure as configure_jwt, current_user, refresh_user, verifier
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from email_validator import validate_email, EmailNotValidError
-from database import Base, engine, async_session
-from models import Client
+from .database import engine, async_session, init_db
+from .migrations import migrate
+from .models import Client, RevokedToken
+from .hashing import hasher, HasherBusy
+from common.metrics import Registry, install as install_metrics
+from common.admission import admission, install as install_admission
 
 #Пароль должен содержать от 6 до 20 символов, хотя бы одну заглавную букву,
 #а также цифру и спец. символ
 REG = "^(?=.*[a-z])(?=.*[A-Z])(?=.*\\d)(?=.*[@$!%*#?&])[A-Za-z\\d@$!#%*?&]{6,20}$"
-app = FastAPI()
 
 class ClientMod(BaseModel):
     """Класс клиента"""
@@ -21,16 +29,37 @@ class ClientMod(BaseModel):
     password: str
     role: str = "user"
 
-class Settings(BaseModel):
-    """Настройки для JWT токена"""
-    authjwt_secret_key: str = "secret"
-    authjwt_token_location: set = {"cookies"}
-    authjwt_cookie_csrf_protect: bool = False
+async def init_schema():
+    """Таблицы и миграции (повторный вызов ничего не меняет)"""
+    await init_db()
+    await asyncio.to_thread(migrate, engine.url.database)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создание схемы при запуске и закрытие пула соединений при остановке"""
+    await init_schema()
+    await verifier.start()
+    await admission.start()
+    hasher.start()
+    yield
+    hasher.shutdown()
+    await admission.stop()
+    await verifier.stop()
+    await engine.dispose()
+
+#Метрики сервиса с меткой service="auth"
+registry = Registry("auth")
+app = FastAPI(lifespan = lifespan)
+#Прослойка метрик снаружи: отклонённые запросы тоже учитываются
+install_admission(app, {"/register": "auth", "/login": "auth"})
+install_metrics(app, engine, registry)
+configure_jwt()
+registry.callback("bcrypt_pool_in_flight", "Hash/verify calls running or queued", lambda: hasher.pending)
+registry.callback("bcrypt_pool_queue_depth", "Hash/verify calls waiting for a worker", hasher.queue_depth)
+registry.callback("bcrypt_pool_rejected_total", "Calls rejected with 503", lambda: hasher.rejected, "counter")
 
 async def get_db():
     """Использование базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
     db = async_session()
     try:
         yield db
@@ -40,8 +69,7 @@ async def get_db():
 async def create_client(client: ClientMod, db: AsyncSession):
     """Создание нового клиента"""
     client.email = client.email.strip()
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(bytes(client.password, 'utf-8'), salt)
+    hashed_password = await hasher.hash(client.password)
     client_db = Client(email = client.email, password = hashed_password, role = client.role)
     db.add(client_db)
     await db.commit()
@@ -69,10 +97,11 @@ async def password_validator(password):
         return True
     return False
 
-@AuthJWT.load_config
-def get_config():
-    """Установка настроек токена"""
-    return Settings()
+@app.exception_handler(HasherBusy)
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    """Пул хэширования перегружен"""
+    return JSONResponse(status_code=503, content={"detail":"Too many requests, try again later"},
+                        headers={"Retry-After": str(hasher.settings.retry_after)})
 
 @app.post("/register")
 async def signup(client: ClientMod, db: AsyncSession = Depends(get_db), authorize: AuthJWT = Depends()):
@@ -93,15 +122,64 @@ async def login(client: ClientMod, db: AsyncSession = Depends(get_db), authorize
     client_from_db = await get_client_by_email(client.email, db)
     if not client_from_db:
         raise HTTPException(status_code=404,detail="Email not found")
+    if not await hasher.verify(client.password, client_from_db.password):
+        raise HTTPException(status_code=401,detail="Bad email or password")
+    if hasher.needs_rehash(client_from_db.password):
+        client_from_db.password = await hasher.hash(client.password)
+        await db.commit()
     access_token = authorize.create_access_token(subject=client_from_db.email, user_claims={"role": client_from_db.role})
     refresh_token = authorize.create_refresh_token(subject=client_from_db.email, user_claims={"role": client_from_db.role})
     authorize.set_access_cookies(access_token)
     authorize.set_refresh_cookies(refresh_token)
     return {"msg":"Successfully login"}
 
+async def revoke_tokens(tokens: list, db: AsyncSession):
+    """Запись отозванных токенов и удаление строк истёкших; в этом процессе отзыв действует сразу"""
+    now = time.time()
+    await db.execute(insert(RevokedToken).on_conflict_do_nothing(index_elements=[RevokedToken.jti]),
+                     [{"jti": claims.jti, "expires_at": claims.expires_at, "revoked_at": now} for claims in tokens])
+    await db.execute(delete(RevokedToken).where(RevokedToken.expires_at < now)
+                     .execution_options(synchronize_session = False))
+    await db.commit()
+    for claims in tokens:
+        verifier.revoke(claims.jti, claims.expires_at)
+
 @app.delete("/logout")
-async def logout(authorize: AuthJWT = Depends()):
-    """Выход из аккаунта"""
-    authorize.jwt_required()
+async def logout(request: Request, db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user),
+                 authorize: AuthJWT = Depends()):
+    """Выход из аккаунта: access- и refresh-токены отзываются"""
+    tokens = [user]
+    try:
+        tokens.append(verifier.verify(verifier.token(request, "refresh"), "refresh"))
+    except HTTPException:
+        pass
+    await revoke_tokens(tokens, db)
     authorize.unset_jwt_cookies()
     return {"msg":"Successfully logout"}
+
+@app.post("/refresh")
+async def refresh(db: AsyncSession = Depends(get_db), user: Claims = Depends(refresh_user),
+                  authorize: AuthJWT = Depends()):
+    """Новая пара токенов по refresh-токену; старый refresh-токен отзывается"""
+    client_from_db = await get_client_by_email(user.subject, db)
+    if not client_from_db:
+        raise HTTPException(status_code=401,detail="Email not found")
+    await revoke_tokens([user], db)
+    access_token = authorize.create_access_token(subject=client_from_db.email, user_claims={"role": client_from_db.role})
+    refresh_token = authorize.create_refresh_token(subject=client_from_db.email, user_claims={"role": client_from_db.role})
+    authorize.set_access_cookies(access_token)
+    authorize.set_refresh_cookies(refresh_token)
+    return {"msg":"Successfully refreshed"}
+
+@app.get("/revoked")
+async def revoked_feed(after: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000),
+                       db: AsyncSession = Depends(get_db)):
+    """Отозванные токены с id больше after: сервисы забирают только новые строки"""
+    rows = (await db.execute(select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+                             .where(RevokedToken.id > after).order_by(RevokedToken.id).limit(limit))).all()
+    return {"items": [row._asdict() for row in rows], "last_id": rows[-1].id if rows else after}
+
+@app.get("/tokens/stats")
+async def token_stats():
+    """Кэш проверенных токенов и список отзыва этого процесса"""
+    return verifier.stats()
@@ -0,0 +1,31 @@
+"""Миграции схемы clients.db
+
+Запуск вручную из корня репозитория:
+    python -m Auth.migrations [путь к БД] [--status | --check]
+"""
+import sys
+from common.migrations import Migration, migrate as run, main as run_main
+
+MIGRATIONS = [
+    Migration(1, "Исходная схема: вход по email идёт по уникальному индексу", [],
+              [("SELECT * FROM client WHERE email = ?", ("user@mail.ru",), ("sqlite_autoindex_client_1",))]),
+    Migration(2, "Список отозванных токенов",
+              [
+                  "CREATE TABLE IF NOT EXISTS revoked_tokens (id INTEGER NOT NULL PRIMARY KEY, jti VARCHAR NOT NULL, "
+                  "expires_at FLOAT NOT NULL, revoked_at FLOAT NOT NULL)",
+                  "CREATE UNIQUE INDEX IF NOT EXISTS uq_revoked_tokens_jti ON revoked_tokens (jti)",
+                  "CREATE INDEX IF NOT EXISTS ix_revoked_tokens_expires_at ON revoked_tokens (expires_at)",
+              ],
+              [
+                  ("SELECT id FROM revoked_tokens WHERE jti = ?", ("x",), ("uq_revoked_tokens_jti",)),
+                  ("SELECT id FROM revoked_tokens WHERE expires_at < ?", (0,), ("ix_revoked_tokens_expires_at",)),
+              ]),
+]
+
+def migrate(path: str):
+    """Применение новых миграций clients.db"""
+    return run(path, MIGRATIONS)
+
+if __name__ == "__main__":
+    from .database import engine
+    run_main(sys.argv[1:], MIGRATIONS, engine.url.database)
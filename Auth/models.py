@@ -1,6 +1,7 @@
 """Модель пользователя"""
+from sqlalchemy import Index
 from sqlalchemy.orm import  Mapped, mapped_column
-from database import Base
+from .database import Base
 
 class Client(Base):
     """Пользователь"""
@@ -8,4 +9,18 @@ class Client(Base):
     id: Mapped[int] = mapped_column(primary_key=True,index=True)
     email: Mapped[str] = mapped_column(unique=True)
     password: Mapped[str] = mapped_column()
-    role: Mapped[str] = mapped_column()
\ No newline at end of file
+    role: Mapped[str] = mapped_column()
+
+class RevokedToken(Base):
+    """Отозванный токен; id растёт, по нему сервисы забирают новые строки"""
+    __tablename__ = "revoked_tokens"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    jti: Mapped[str] = mapped_column()
+    expires_at: Mapped[float] = mapped_column()
+    revoked_at: Mapped[float] = mapped_column()
+
+    __table_args__ = (
+        Index("uq_revoked_tokens_jti", "jti", unique=True),
+        #Удаление строк истёкших токенов
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
@@ -0,0 +1 @@
+"""Сервис Basket"""
@@ -0,0 +1,44 @@
+"""Очереди Basket: заказы и события каталога от Catal, оформление корзины в Catal"""
+from pydantic import BaseSettings
+from common.broker import Publisher, PublisherSettings, memory_broker, consumer_transport as transport
+
+class BrokerSettings(BaseSettings):
+    """Настройки получателя (переменные окружения BASKET_BROKER_*)"""
+    #rabbitmq или memory (очереди в памяти процесса, для тестов и замеров)
+    backend: str = "rabbitmq"
+    host: str = "localhost"
+    port: int = 5672
+    queue: str = "comics"
+    #События каталога (цены и остатки) и отказы в оформлении от Catal
+    catalog_queue: str = "catalog"
+    #Корзины на оформление в Catal
+    checkout_queue: str = "checkout"
+    #Заказы, которые не удалось сохранить: разбираются вручную, а не теряются
+    dead_letter_queue: str = "comics.dead"
+    #Запускать получателя вместе с приложением (иначе - отдельным процессом python -m Basket.consumer)
+    run_in_app: bool = True
+    #Сколько неподтверждённых сообщений брокер отдаёт одному соединению
+    prefetch: int = 200
+    #Сколько соединений получают параллельно
+    concurrency: int = 1
+    #Сколько сообщений сохранять одной транзакцией
+    batch_size: int = 100
+    #Сколько ждать добора пачки, с
+    batch_linger: float = 0.05
+    poll_timeout: float = 1.0
+    lag_interval: float = 5.0
+    reconnect_delay: float = 0.2
+    reconnect_max_delay: float = 5.0
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "BASKET_BROKER_"
+
+settings = BrokerSettings()
+
+def consumer_transport(queue: str | None = None, fanout: bool = False, on_connect = None):
+    """Новый транспорт получателя согласно настройкам; по умолчанию - очередь заказов"""
+    return transport(settings, queue, fanout, on_connect)
+
+publisher = Publisher(PublisherSettings(backend = settings.backend, host = settings.host, port = settings.port,
+                                        queue = settings.checkout_queue), memory_broker)
@@ -0,0 +1,258 @@
+"""Корзины клиентов: LRU в памяти с TTL поверх таблицы carts
+
+Чтение идёт из памяти и сверяется с версией строки в basket.db не чаще check_interval,
+поэтому изменения из других процессов видны с этой задержкой. Запись - оптимистическая:
+UPDATE ... WHERE version = прочитанной; при конфликте корзина перечитывается и изменение
+применяется заново.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from fastapi import HTTPException
+from pydantic import BaseModel, BaseSettings, conint
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import async_session
+from .models import Cart, Checkout
+from .prices import PriceSnapshot
+
+class CartSettings(BaseSettings):
+    """Настройки корзин (переменные окружения BASKET_CART_*)"""
+    #Через сколько секунд без изменений корзина истекает
+    ttl: float = 7 * 24 * 3600.0
+    #Сколько корзин держать в памяти процесса
+    max_entries: int = 10000
+    #Как часто сверять корзину в памяти с БД, с
+    check_interval: float = 1.0
+    max_lines: int = 100
+    max_qty: int = 100
+    #Сколько раз повторять изменение при конфликте версий
+    retries: int = 5
+    #Как часто удалять истёкшие корзины из БД, с
+    prune_interval: float = 600.0
+    prune_chunk: int = 1000
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "BASKET_CART_"
+
+class CartItemMod(BaseModel):
+    """Добавление комикса в корзину по id или названию"""
+    comic_id: int | None = None
+    title: str | None = None
+    qty: conint(gt=0) = 1
+
+class CartQtyMod(BaseModel):
+    """Новое количество; 0 - убрать из корзины"""
+    qty: conint(ge=0)
+
+class CartEntry:
+    """Корзина в памяти: {comic_id: qty} и версия строки (0 - строки нет)"""
+    __slots__ = ("items", "version", "checked_at", "used_at")
+
+    def __init__(self, items: dict, version: int, now: float):
+        self.items = items
+        self.version = version
+        self.checked_at = now
+        self.used_at = now
+
+class CartStore:
+    """LRU корзин с TTL; источник истины - таблица carts"""
+
+    def __init__(self, settings: CartSettings, session_factory):
+        self.settings = settings
+        self.session_factory = session_factory
+        self.entries = OrderedDict()
+        self.task = None
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.evictions = 0
+        self.pruned = 0
+
+    async def read(self, client: str, db: AsyncSession):
+        """Корзина из БД; истёкшая читается пустой, но с версией строки"""
+        row = (await db.execute(select(Cart.items, Cart.version, Cart.updated_at).where(Cart.client == client))).first()
+        if row is None:
+            return {}, 0, None
+        if row.updated_at < time.time() - self.settings.ttl:
+            return {}, row.version, row.updated_at
+        return {int(comic_id): qty for comic_id, qty in json.loads(row.items).items()}, row.version, row.updated_at
+
+    def remember(self, client: str, items: dict, version: int, now: float):
+        """Запись в LRU с вытеснением самых давних"""
+        self.entries[client] = CartEntry(items, version, now)
+        self.entries.move_to_end(client)
+        while len(self.entries) > self.settings.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, client: str, db: AsyncSession, fresh: bool = False):
+        """Корзина клиента (items, version); fresh - сверка с БД без ожидания check_interval"""
+        now = time.monotonic()
+        entry = self.entries.get(client)
+        if entry is not None and now - entry.used_at >= self.settings.ttl:
+            entry = None
+        if entry is not None:
+            self.entries.move_to_end(client)
+            entry.used_at = now
+            if not fresh and now - entry.checked_at < self.settings.check_interval:
+                self.hits += 1
+                return dict(entry.items), entry.version
+            version = (await db.execute(select(Cart.version).where(Cart.client == client))).scalar()
+            if (version or 0) == entry.version:
+                self.hits += 1
+                entry.checked_at = now
+                return dict(entry.items), entry.version
+        self.misses += 1
+        items, version, _ = await self.read(client, db)
+        self.remember(client, items, version, now)
+        return dict(items), version
+
+    async def current(self, client: str, db: AsyncSession):
+        """Корзина прямо из БД для оформления: (items, version, updated_at)"""
+        items, version, updated_at = await self.read(client, db)
+        self.remember(client, items, version, time.monotonic())
+        return dict(items), version, updated_at
+
+    async def write(self, client: str, items: dict, version: int, db: AsyncSession):
+        """Запись новой версии; False, если корзину уже изменили"""
+        values = {"items": json.dumps({str(comic_id): qty for comic_id, qty in items.items()}),
+                  "version": version + 1, "updated_at": time.time()}
+        if version == 0:
+            try:
+                await db.execute(insert(Cart).values(client = client, **values))
+            except IntegrityError:
+                #Строку успел создать другой запрос
+                await db.rollback()
+                return False
+        else:
+            result = await db.execute(update(Cart).where(Cart.client == client, Cart.version == version).values(**values))
+            if result.rowcount == 0:
+                await db.rollback()
+                return False
+        await db.commit()
+        return True
+
+    async def change(self, client: str, db: AsyncSession, apply):
+        """apply(items) меняет копию корзины; при конфликте версий - заново по свежей корзине"""
+        fresh = False
+        for _ in range(self.settings.retries):
+            items, version = await self.get(client, db, fresh)
+            apply(items)
+            self.check_limits(items)
+            if await self.write(client, items, version, db):
+                self.remember(client, items, version + 1, time.monotonic())
+                return items, version + 1
+            self.conflicts += 1
+            fresh = True
+        raise HTTPException(status_code=409,detail="Cart is being changed concurrently")
+
+    def check_limits(self, items: dict):
+        """Ограничения размера корзины"""
+        if len(items) > self.settings.max_lines:
+            raise HTTPException(status_code=400,detail=f"Cart can hold at most {self.settings.max_lines} comics")
+        if any(qty > self.settings.max_qty for qty in items.values()):
+            raise HTTPException(status_code=400,detail=f"At most {self.settings.max_qty} of one comic")
+
+    def forget(self, client: str):
+        """Корзину изменили в обход хранилища (оформлена): следующее чтение - из БД"""
+        self.entries.pop(client, None)
+
+    async def prune(self):
+        """Удаление истёкших корзин порциями по индексу updated_at"""
+        cutoff = time.time() - self.settings.ttl
+        async with self.session_factory() as db:
+            while True:
+                clients = select(Cart.client).where(Cart.updated_at < cutoff).limit(self.settings.prune_chunk)
+                result = await db.execute(delete(Cart).where(Cart.client.in_(clients.scalar_subquery())))
+                await db.commit()
+                self.pruned += result.rowcount
+                if result.rowcount < self.settings.prune_chunk:
+                    return
+
+    async def run(self):
+        """Периодическая очистка"""
+        while True:
+            try:
+                await self.prune()
+            except SQLAlchemyError:
+                pass
+            await asyncio.sleep(self.settings.prune_interval)
+
+    async def start(self):
+        """Запуск очистки"""
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка очистки"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self):
+        """Счётчики хранилища"""
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "conflicts": self.conflicts, "evictions": self.evictions, "pruned": self.pruned}
+
+def resolve(item: CartItemMod, snapshot: PriceSnapshot):
+    """Комикс из снимка по id или названию"""
+    if item.comic_id is None and not item.title:
+        raise HTTPException(status_code=400,detail="comic_id or title required")
+    price = snapshot.find(item.comic_id, item.title)
+    if price is None:
+        raise HTTPException(status_code=404,detail="Comic not found")
+    return price
+
+def price_cart(items: dict, version: int, snapshot: PriceSnapshot):
+    """Строки корзины по ценам и остаткам снимка; пропавшие из каталога комиксы помечены"""
+    lines, total = [], 0
+    for comic_id, qty in items.items():
+        price = snapshot.prices.get(comic_id)
+        if price is None:
+            lines.append({"comic_id": comic_id, "title": None, "qty": qty, "price": None, "available": False})
+            continue
+        lines.append({"comic_id": comic_id, "title": price.title, "qty": qty, "price": price.price,
+                      "available": price.amount >= qty})
+        total += price.price * qty
+    return {"version": version, "items": lines, "total": total, "catalog_version": snapshot.version}
+
+def checkout_id(client: str, version: int, updated_at: float):
+    """id сообщения оформления: одна версия корзины - одно сообщение
+
+    Время изменения отличает корзины с той же версией после удаления истёкшей строки.
+    """
+    return hashlib.sha1(f"{client}\n{version}\n{updated_at!r}".encode()).hexdigest()[:32]
+
+def shortages(priced: dict):
+    """Нехватка по снимку в формате отказа Catal"""
+    return [{"comic_id": line["comic_id"], "title": line["title"], "requested": line["qty"],
+             "reason": "not_found" if line["price"] is None else "insufficient"}
+            for line in priced["items"] if not line["available"]]
+
+async def complete_checkouts(message_ids: list, db: AsyncSession):
+    """Заказы пришли: оформления завершены, корзины той же версии очищены; без фиксации. Возвращает клиентов"""
+    if not message_ids:
+        return []
+    rows = (await db.execute(update(Checkout).where(Checkout.message_id.in_(message_ids), Checkout.status != "completed")
+                             .values(status = "completed", detail = None)
+                             .returning(Checkout.client, Checkout.cart_version))).all()
+    now = time.time()
+    for client, version in rows:
+        #Корзину изменили после оформления - она остаётся
+        await db.execute(update(Cart).where(Cart.client == client, Cart.version == version)
+                         .values(items = "{}", version = version + 1, updated_at = now))
+    return [client for client, _ in rows]
+
+async def reject_checkouts(events: list, db: AsyncSession):
+    """Отказы Catal: ожидающие оформления отмечаются отклонёнными; без фиксации"""
+    for event in events:
+        await db.execute(update(Checkout).where(Checkout.message_id == event["checkout_id"], Checkout.status == "pending")
+                         .values(status = "rejected", detail = json.dumps(event.get("shortages"))))
+
+settings = CartSettings()
+cart_store = CartStore(settings, async_session)
@@ -0,0 +1,99 @@
+"""Повторная отправка оформлений корзин: таблица checkouts служит outbox Basket
+
+Оформление фиксируется вместе с телом сообщения и sent_at = NULL, затем отправляется
+сразу. Если процесс упал или брокер недоступен между фиксацией и отправкой, фоновая
+задача найдёт ожидающее оформление без sent_at и отправит его снова. Catal не спишет
+товар дважды по тому же id сообщения, поэтому повтор безопасен.
+"""
+import asyncio
+import time
+from pydantic import BaseSettings
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import SQLAlchemyError
+from common.broker import BrokerUnavailable
+from .broker import publisher
+from .database import async_session
+from .models import Checkout
+
+class CheckoutSettings(BaseSettings):
+    """Повторная отправка оформлений (переменные окружения BASKET_CHECKOUT_*)"""
+    #Как часто искать неотправленные оформления, с
+    sweep_interval: float = 5.0
+    #Сколько оформление может ждать отправки из запроса, прежде чем его отправит задача, с
+    resend_after: float = 10.0
+    batch_size: int = 100
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "BASKET_CHECKOUT_"
+
+class CheckoutRelay:
+    """Отправка оформления из запроса и фоновый повтор неотправленных"""
+
+    def __init__(self, settings: CheckoutSettings, publisher, session_factory):
+        self.settings = settings
+        self.publisher = publisher
+        self.session_factory = session_factory
+        self.task = None
+        self.sent = 0
+        self.resent = 0
+        self.failed = 0
+
+    async def send(self, message_id: str, body: str):
+        """Отправка и отметка sent_at; False, если брокер недоступен (отправит фоновая задача)"""
+        try:
+            await self.publisher.publish(body.encode(), message_id = message_id)
+        except BrokerUnavailable:
+            self.failed += 1
+            return False
+        async with self.session_factory() as db:
+            await db.execute(update(Checkout).where(Checkout.message_id == message_id).values(sent_at = time.time()))
+            await db.commit()
+        self.sent += 1
+        return True
+
+    async def sweep(self):
+        """Повтор ожидающих оформлений без sent_at старше resend_after; возвращает число отправленных"""
+        cutoff = time.time() - self.settings.resend_after
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(Checkout.message_id, Checkout.body)
+                .where(Checkout.sent_at.is_(None), Checkout.status == "pending", Checkout.created_at < cutoff)
+                .order_by(Checkout.created_at).limit(self.settings.batch_size))).all()
+        sent = 0
+        for message_id, body in rows:
+            if not await self.send(message_id, body):
+                break
+            sent += 1
+        self.resent += sent
+        return sent
+
+    async def run(self):
+        """Периодический повтор"""
+        while True:
+            try:
+                await self.sweep()
+            except SQLAlchemyError:
+                pass
+            await asyncio.sleep(self.settings.sweep_interval)
+
+    async def start(self):
+        """Запуск повтора"""
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка повтора; неотправленное останется в таблице до следующего запуска"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def stats(self):
+        """Счётчики и число ожидающих отправки"""
+        async with self.session_factory() as db:
+            unsent = (await db.execute(select(func.count())
+                                       .where(Checkout.sent_at.is_(None), Checkout.status == "pending"))).scalar()
+        return {"sent": self.sent, "resent": self.resent, "failed": self.failed, "unsent": unsent}
+
+settings = CheckoutSettings()
+checkout_relay = CheckoutRelay(settings, publisher, async_session)
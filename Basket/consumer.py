@@ -0,0 +1,15 @@
+"""Получатель заказов отдельным процессом, без HTTP: python -m Basket.consumer"""
+import asyncio
+
+async def serve():
+    """Получатель заказов до остановки процесса"""
+    from .main import init_schema, order_consumer
+    await init_schema()
+    await order_consumer.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await order_consumer.stop()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,65 @@
+"""История заказов клиента (keyset по времени покупки) и продажи комиксов по строкам заказов"""
+from fastapi import HTTPException
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from common.pagination import encode_cursor, decode_cursor
+from .models import Order, OrderLine
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+#Сортировки сводки продаж
+SALES_SORTS = ("sold", "revenue", "orders")
+
+LINE_COLUMNS = (OrderLine.order_id, OrderLine.comic_id, OrderLine.title, OrderLine.qty, OrderLine.price)
+
+async def attach_lines(orders: list, db: AsyncSession):
+    """Строки заказов одним запросом по первичному ключу order_lines"""
+    if not orders:
+        return orders
+    by_id = {order["id"]: order for order in orders}
+    for order in orders:
+        order["items"] = []
+    rows = await db.execute(select(*LINE_COLUMNS).where(OrderLine.order_id.in_(list(by_id)))
+                            .order_by(OrderLine.order_id, OrderLine.line_no))
+    for order_id, comic_id, title, qty, price in rows:
+        by_id[order_id]["items"].append({"comic_id": comic_id, "title": title, "qty": qty, "price": price})
+    return orders
+
+async def order_page(client: str, limit: int | None, cursor: str | None, db: AsyncSession):
+    """Заказы клиента от новых к старым по индексу (client, created_at, id); limit=None - все"""
+    stmt = (select(Order.id, Order.price, Order.created_at, Order.message_id).where(Order.client == client)
+            .order_by(Order.created_at.desc(), Order.id.desc()))
+    if cursor:
+        created_at, order_id = decode_cursor(cursor, 2)
+        stmt = stmt.where(tuple_(Order.created_at, Order.id) < tuple_(created_at, order_id))
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    orders = [row._asdict() for row in await db.execute(stmt)]
+    next_cursor = None
+    if limit is not None and len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor([orders[-1]["created_at"], orders[-1]["id"]])
+    return {"items": await attach_lines(orders, db), "next_cursor": next_cursor}
+
+def sales_columns():
+    """Число строк, проданное количество и выручка"""
+    return (func.count().label("orders"), func.sum(OrderLine.qty).label("sold"),
+            func.sum(OrderLine.qty * OrderLine.price).label("revenue"))
+
+async def comic_sales(comic_id: int, db: AsyncSession):
+    """Продажи одного комикса по покрывающему индексу (comic_id, qty, price)"""
+    row = (await db.execute(select(*sales_columns()).where(OrderLine.comic_id == comic_id))).one()
+    return {"comic_id": comic_id, "orders": row.orders, "sold": row.sold or 0, "revenue": row.revenue or 0}
+
+async def top_sales(limit: int, sort: str, since: float | None, db: AsyncSession):
+    """Сводка продаж по комиксам; since - только заказы не раньше этого времени"""
+    if sort not in SALES_SORTS:
+        raise HTTPException(status_code=400,detail="Bad sort")
+    columns = sales_columns()
+    stmt = (select(OrderLine.comic_id, func.max(OrderLine.title).label("title"), *columns)
+            .where(OrderLine.comic_id.is_not(None)).group_by(OrderLine.comic_id))
+    if since is not None:
+        stmt = stmt.join(Order, Order.id == OrderLine.order_id).where(Order.created_at >= since)
+    column = {column.name: column for column in columns}[sort]
+    rows = await db.execute(stmt.order_by(column.desc(), OrderLine.comic_id).limit(limit))
+    return [row._asdict() for row in rows]
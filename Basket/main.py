@@ -1,72 +1,321 @@
-"""Добавление заказа"""
-from pika import ConnectionParameters, BlockingConnection
-from fastapi import FastAPI, HTTPException, Depends, Cookie
+"""Заказы, корзина и её оформление"""
+import json
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Cookie, Query
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi_jwt_auth import AuthJWT
-from database import engine, Base, async_session
-from models import Order
-CONNECTION_PARAMS = ConnectionParameters(host="localhost")
-app = FastAPI()
+from common.jwt import Claims, configure as configure_jwt, current_user, verifier
+from .database import engine, async_session, init_db
+from .migrations import migrate
+from .models import Order, OrderLine, Checkout
+from .broker import settings as broker_settings, consumer_transport, publisher
+from .prices import snapshot
+from .checkout import checkout_relay
+from .cart import (CartItemMod, CartQtyMod, cart_store, resolve, price_cart, shortages, checkout_id,
+                   complete_checkouts, reject_checkouts)
+from common.consumer import BatchConsumer
+from .history import DEFAULT_LIMIT, MAX_LIMIT, order_page, comic_sales, top_sales
+from common.metrics import Registry, install as install_metrics
+from common.admission import admission, require_admin, install as install_admission
 
-class Settings(BaseModel):
-    """Настройки для проверки JWT токена"""
-    authjwt_secret_key: str = "secret"
-    authjwt_token_location: set = {"cookies"}
-    authjwt_cookie_csrf_protect: bool = False
+class LineMod(BaseModel):
+    """Строка заказа"""
+    comic_id: int | None = None
+    title: str = ""
+    qty: int
+    price: int
 
 class OrderMod(BaseModel):
-    """Класс комикса"""
+    """Класс заказа"""
     email: str = None
     price: int
-    items: str
+    items: list[LineMod]
+    message_id: str | None = None
+    created_at: float | None = None
+
+async def init_schema():
+    """Таблицы и миграции (повторный вызов ничего не меняет)"""
+    await init_db()
+    await asyncio.to_thread(migrate, engine.url.database)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создание схемы, снимок цен и запуск получателей; остановка при завершении"""
+    await init_schema()
+    await verifier.start()
+    await admission.start()
+    await publisher.start()
+    await snapshot.start()
+    #События каталога нужны каждому процессу: снимок цен у каждого свой
+    await catalog_consumer.start()
+    await cart_store.start()
+    await checkout_relay.start()
+    if broker_settings.run_in_app:
+        await order_consumer.start()
+    yield
+    await order_consumer.stop()
+    await checkout_relay.stop()
+    await cart_store.stop()
+    await catalog_consumer.stop()
+    await snapshot.stop()
+    await publisher.stop()
+    await admission.stop()
+    await verifier.stop()
+    await engine.dispose()
+
+#Метрики сервиса с меткой service="basket"
+registry = Registry("basket")
+app = FastAPI(lifespan = lifespan)
+#Прослойка метрик снаружи: отклонённые запросы тоже учитываются
+install_admission(app, {"/cart/checkout": "buy"})
+install_metrics(app, engine, registry)
+configure_jwt()
 
 async def get_db():
     """Использование базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
     db = async_session()
     try:
         yield db
     finally:
         await db.close()
 
-async def create_order(order: OrderMod, db: AsyncSession):
+def insert_orders():
+    """INSERT, который пропускает уже сохранённые message_id (повторная доставка)"""
+    return insert(Order).on_conflict_do_nothing(index_elements = [Order.message_id])
+
+def order_values(order: OrderMod):
+    """Столбцы заказа; без message_id заказ получает новый"""
+    return {"client": order.email, "price": order.price, "created_at": order.created_at or time.time(),
+            "message_id": order.message_id or uuid.uuid4().hex}
+
+async def store_orders(orders: list, db: AsyncSession):
+    """Заказы и их строки без фиксации; строки пишутся только для действительно вставленных заказов"""
+    values, lines = {}, {}
+    for order in orders:
+        value = order_values(order)
+        #Повтор сообщения в той же пачке: первый экземпляр
+        values.setdefault(value["message_id"], value)
+        lines.setdefault(value["message_id"], order.items)
+    rows = await db.execute(insert_orders().returning(Order.id, Order.message_id), list(values.values()))
+    inserted = [{"order_id": order_id, "line_no": number, **line.dict()} for order_id, message_id in rows
+                for number, line in enumerate(lines.get(message_id, ()))]
+    if inserted:
+        await db.execute(insert(OrderLine), inserted)
+
+async def create_order(order: OrderMod, db: AsyncSession, commit: bool = True):
     """Создание заказа"""
-    order_db = Order(client = order.email, price = order.price, items = order.items)
-    db.add(order_db)
-    await db.commit()
+    await store_orders([order], db)
+    if commit:
+        await db.commit()
     return {"msg":"Successfully created order"}
-def callback(ch, method, properties, body):
-    print(body.decode())
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-async def consumer():
-    with BlockingConnection(CONNECTION_PARAMS) as conn:
-        with conn.channel() as ch:
-            ch.queue_declare(queue="comics")
-            ch.basic_consume(
-                queue = "comics",
-                on_message_callback = callback
-            )
-            ch.start_consuming()
-
-@AuthJWT.load_config
-def get_config():
-    """Установка настроек токена"""
-    return Settings()
+
+def decode_order(body: bytes, message_id: str | None):
+    """Заказ из сообщения очереди (JSON с email, price, items)"""
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Order must be a JSON object")
+    #Старые отправители кладут строки заказа JSON-строкой
+    if isinstance(data.get("items"), str):
+        data["items"] = json.loads(data["items"])
+    #id из свойств сообщения важнее, чем в теле
+    if message_id:
+        data["message_id"] = message_id
+    order = OrderMod(**data)
+    if not order.email:
+        raise ValueError("Email not found")
+    return order
+
+async def save_orders(orders: list):
+    """Сохранение пачки заказов одной транзакцией; дубликаты по message_id пропускаются"""
+    async with async_session() as db:
+        await store_orders(orders, db)
+        #Заказы из оформленных корзин завершают оформление и очищают корзину
+        clients = await complete_checkouts([order.message_id for order in orders if order.message_id], db)
+        await db.commit()
+    for client in clients:
+        cart_store.forget(client)
+
+def decode_event(body: bytes, message_id: str | None):
+    """Событие каталога: изменение комикса или отказ в оформлении корзины"""
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Event must be a JSON object")
+    if data.get("type") == "comic" and all(key in data for key in ("epoch", "version", "id")):
+        return data
+    if data.get("type") == "checkout_rejected" and data.get("checkout_id"):
+        return data
+    raise ValueError("Unknown event")
+
+async def apply_events(events: list):
+    """Изменения комиксов - в снимок цен, отказы - в оформления"""
+    rejected = []
+    for event in events:
+        if event["type"] == "comic":
+            snapshot.apply(event)
+        else:
+            rejected.append(event)
+    if rejected:
+        async with async_session() as db:
+            await reject_checkouts(rejected, db)
+            await db.commit()
+
+order_consumer = BatchConsumer(broker_settings, decode_order, save_orders, consumer_transport)
+#Одно соединение: каждое получает все события, и после каждой подписки снимок загружается заново
+catalog_settings = broker_settings.copy(update = {"concurrency": 1,
+                                                 "dead_letter_queue": f"{broker_settings.catalog_queue}.dead"})
+catalog_consumer = BatchConsumer(catalog_settings, decode_event, apply_events,
+                                 lambda: consumer_transport(catalog_settings.catalog_queue, True, snapshot.resync_threadsafe))
+registry.callback("broker_consumed_total", "Messages received", lambda: order_consumer.consumed, "counter")
+registry.callback("broker_persisted_total", "Orders committed and acked", lambda: order_consumer.persisted, "counter")
+registry.callback("broker_rejected_total", "Messages rejected", lambda: order_consumer.rejected, "counter")
+registry.callback("broker_requeued_total", "Messages requeued", lambda: order_consumer.requeued, "counter")
+registry.callback("broker_dead_lettered_total", "Orders moved to the dead letter queue",
+                  lambda: order_consumer.dead_lettered, "counter")
+registry.callback("broker_consumer_lag", "Messages waiting in the queue", lambda: order_consumer.lag)
+registry.callback("broker_persisted_per_second", "Orders persisted per second", lambda: order_consumer.rate)
+registry.callback("checkout_resent_total", "Checkouts sent again by the background sweep",
+                  lambda: checkout_relay.resent, "counter")
 
 #async def get_jwt_token_role(access_token_cookie: str | None = Cookie(default=None), authorize: AuthJWT = Depends()):
-    """Роль пользователя"""
+    #"""Роль пользователя"""
     #return authorize.get_raw_jwt(access_token_cookie)["role"]
 
 @app.get("/order")
-async def new_comic():
-    """Создание заказа"""
-    await consumer()
-    """order.email = authorize.get_raw_jwt(access_token_cookie)["sub"]
-    if not order.email:
-        return HTTPException(status_code=404,detail="Email not found")
-    return await create_order(order,db)"""
+async def view_orders(db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Все заказы текущего пользователя со строками, от новых к старым"""
+    return (await order_page(user.subject, None, None, db))["items"]
+
+@app.get("/orders")
+async def view_order_page(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                          db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Страница истории заказов текущего пользователя; next_cursor - для следующей"""
+    return await order_page(user.subject, limit, cursor, db)
+
+@app.get("/sales/comics")
+async def view_sales(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), sort: str = "sold",
+                     since: float | None = None, db: AsyncSession = Depends(get_db),
+                     user: Claims = Depends(require_admin)):
+    """Самые продаваемые комиксы: по количеству (sold), выручке (revenue) или числу заказов (orders)"""
+    return await top_sales(limit, sort, since, db)
+
+@app.get("/sales/comics/{comic_id}")
+async def view_comic_sales(comic_id: int, db: AsyncSession = Depends(get_db), user: Claims = Depends(require_admin)):
+    """Продажи одного комикса"""
+    return await comic_sales(comic_id, db)
+
+@app.get("/consumer/stats")
+async def consumer_stats():
+    """Счётчики получателя заказов: обработано, отклонено, отставание, скорость"""
+    return order_consumer.stats()
+
+def priced_cart(items: dict, version: int):
+    """Корзина по снимку цен; пока снимок загружается - 503"""
+    if not snapshot.ready:
+        raise HTTPException(status_code=503,detail="Price snapshot is loading")
+    return price_cart(items, version, snapshot)
+
+@app.get("/cart")
+async def view_cart(db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Корзина текущего пользователя с ценами и наличием"""
+    return priced_cart(*await cart_store.get(user.subject, db))
+
+@app.post("/cart/items")
+async def add_to_cart(item: CartItemMod, db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Добавление комикса по id или названию; количество складывается"""
+    if not snapshot.ready:
+        raise HTTPException(status_code=503,detail="Price snapshot is loading")
+    comic_id = resolve(item, snapshot).id
+    def apply(items: dict):
+        items[comic_id] = items.get(comic_id, 0) + item.qty
+    return priced_cart(*await cart_store.change(user.subject, db, apply))
+
+@app.put("/cart/items/{comic_id}")
+async def set_cart_qty(comic_id: int, data: CartQtyMod, db: AsyncSession = Depends(get_db),
+                       user: Claims = Depends(current_user)):
+    """Новое количество комикса в корзине; 0 - убрать"""
+    if data.qty and snapshot.ready and snapshot.find(comic_id) is None:
+        raise HTTPException(status_code=404,detail="Comic not found")
+    def apply(items: dict):
+        if data.qty:
+            items[comic_id] = data.qty
+        else:
+            items.pop(comic_id, None)
+    return priced_cart(*await cart_store.change(user.subject, db, apply))
+
+@app.delete("/cart/items/{comic_id}")
+async def remove_from_cart(comic_id: int, db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Удаление комикса из корзины"""
+    def apply(items: dict):
+        if items.pop(comic_id, None) is None:
+            raise HTTPException(status_code=404,detail="Comic not in cart")
+    return priced_cart(*await cart_store.change(user.subject, db, apply))
+
+@app.delete("/cart")
+async def clear_cart(db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Очистка корзины"""
+    items, version = await cart_store.change(user.subject, db, dict.clear)
+    return {"msg":"Successfully cleared cart", "version": version}
+
+def checkout_view(checkout: Checkout):
+    """Оформление для ответа"""
+    return {"checkout_id": checkout.message_id, "status": checkout.status, "cart_version": checkout.cart_version,
+            "created_at": checkout.created_at, "shortages": json.loads(checkout.detail) if checkout.detail else None}
+
+@app.post("/cart/checkout", status_code=202)
+async def checkout_cart(db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Вся корзина одним сообщением в Catal; заказ появится в /orders, итог - в /cart/checkouts/{id}"""
+    items, version, updated_at = await cart_store.current(user.subject, db)
+    if not items:
+        raise HTTPException(status_code=400,detail="Cart is empty")
+    priced = priced_cart(items, version)
+    missing = shortages(priced)
+    if missing:
+        #Заведомо не хватит: без сообщения в Catal
+        raise HTTPException(status_code=409,detail={"msg": "Not enough comics", "shortages": missing})
+    message_id = checkout_id(user.subject, version, updated_at)
+    checkout = await db.get(Checkout, message_id)
+    if checkout is not None and checkout.status == "completed":
+        return checkout_view(checkout)
+    body = {"message_id": message_id, "email": user.subject, "total": priced["total"],
+            "items": [{key: line[key] for key in ("comic_id", "title", "qty", "price")} for line in priced["items"]]}
+    if checkout is None:
+        checkout = Checkout(message_id = message_id, client = user.subject, cart_version = version,
+                            status = "pending", created_at = time.time())
+        db.add(checkout)
+    else:
+        #Повтор после отказа; Catal не спишет товар дважды по тому же id
+        checkout.status, checkout.detail = "pending", None
+    #Сообщение фиксируется вместе с оформлением: если отправка ниже не удастся, его повторит checkout_relay
+    checkout.body, checkout.sent_at = json.dumps(body), None
+    await db.commit()
+    await checkout_relay.send(message_id, checkout.body)
+    return {**checkout_view(checkout), "total": priced["total"], "items": body["items"]}
+
+@app.get("/cart/checkouts/{message_id}")
+async def view_checkout(message_id: str, db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Итог оформления: pending, completed или rejected с нехваткой"""
+    checkout = await db.get(Checkout, message_id)
+    if checkout is None or checkout.client != user.subject:
+        raise HTTPException(status_code=404,detail="Checkout not found")
+    return checkout_view(checkout)
+
+@app.get("/cart/stats")
+async def cart_stats():
+    """Счётчики корзин в памяти процесса"""
+    return cart_store.stats()
+
+@app.get("/checkout/stats")
+async def checkout_stats():
+    """Счётчики отправки оформлений и число неотправленных"""
+    return await checkout_relay.stats()
 
-#order: OrderMod, db: AsyncSession = Depends(get_db), access_token_cookie: str = Cookie(), authorize: AuthJWT = Depends()
\ No newline at end of file
+@app.get("/prices/stats")
+async def prices_stats():
+    """Состояние снимка цен и получателя событий каталога"""
+    return {**snapshot.stats(), "consumer": catalog_consumer.stats()}
@@ -0,0 +1,81 @@
+"""Миграции схемы basket.db
+
+Запуск вручную из корня репозитория:
+    python -m Basket.migrations [путь к БД] [--status | --check]
+"""
+import sys
+from common.migrations import Migration, add_column, migrate as run, main as run_main
+
+#items старого заказа, если это JSON-массив, иначе NULL (json_each(NULL) не даёт строк)
+ITEMS_ARRAY = "CASE WHEN json_valid(items) THEN CASE WHEN json_type(items) = 'array' THEN items END END"
+
+def split_items(conn):
+    """Пересборка orders без UNIQUE(client) и перенос items в order_lines (на новой БД уже сделано create_all)"""
+    if "items" not in [row[1] for row in conn.execute("PRAGMA table_info(orders)")]:
+        return
+    for statement in [
+        "CREATE TABLE IF NOT EXISTS order_lines (order_id INTEGER NOT NULL REFERENCES orders (id) ON DELETE CASCADE, "
+        "line_no INTEGER NOT NULL, comic_id INTEGER, title VARCHAR NOT NULL, qty INTEGER NOT NULL, "
+        "price INTEGER NOT NULL, PRIMARY KEY (order_id, line_no))",
+        "DROP TABLE IF EXISTS orders_new",
+        "CREATE TABLE orders_new (id INTEGER NOT NULL PRIMARY KEY, client VARCHAR NOT NULL, "
+        "price INTEGER NOT NULL, created_at FLOAT NOT NULL, message_id VARCHAR)",
+        "INSERT INTO orders_new (id, client, price, created_at, message_id) "
+        "SELECT id, client, price, 0, message_id FROM orders",
+        "INSERT INTO order_lines (order_id, line_no, comic_id, title, qty, price) "
+        "SELECT orders.id, line.key, json_extract(line.value, '$.comic_id'), "
+        "coalesce(json_extract(line.value, '$.title'), ''), coalesce(json_extract(line.value, '$.qty'), 1), "
+        f"coalesce(json_extract(line.value, '$.price'), 0) FROM orders, json_each({ITEMS_ARRAY}) AS line",
+        #Свободный текст остаётся одной строкой без comic_id
+        "INSERT INTO order_lines (order_id, line_no, comic_id, title, qty, price) "
+        f"SELECT id, 0, NULL, items, 1, price FROM orders WHERE ({ITEMS_ARRAY}) IS NULL",
+        "DROP TABLE orders",
+        "ALTER TABLE orders_new RENAME TO orders",
+    ]:
+        conn.execute(statement)
+
+MIGRATIONS = [
+    #Проверка поиска по client перенесена в миграцию 3: уникальный индекс client там удаляется
+    Migration(1, "Исходная схема", [], []),
+    Migration(2, "id сообщения у заказа для идемпотентного сохранения",
+              [add_column("orders", "message_id", "VARCHAR"),
+               "CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_message_id ON orders (message_id)"],
+              [("SELECT id FROM orders WHERE message_id = ?", ("m",), ("uq_orders_message_id",))]),
+    Migration(3, "Несколько заказов у клиента, строки заказа в order_lines",
+              [split_items,
+               "CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_message_id ON orders (message_id)",
+               "CREATE INDEX IF NOT EXISTS ix_orders_client_created ON orders (client, created_at, id)",
+               "CREATE INDEX IF NOT EXISTS ix_order_lines_comic ON order_lines (comic_id, qty, price)"],
+              [("SELECT id FROM orders WHERE client = ? ORDER BY created_at DESC, id DESC LIMIT ?", ("u", 20),
+                ("ix_orders_client_created",)),
+               ("SELECT id FROM orders WHERE client = ? AND (created_at, id) < (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?", ("u", 1.0, 1, 20), ("ix_orders_client_created",)),
+               ("SELECT count(*), sum(qty) FROM order_lines WHERE comic_id = ?", (1,), ("ix_order_lines_comic",))]),
+    Migration(4, "Корзины и их оформление",
+              ["CREATE TABLE IF NOT EXISTS carts (client VARCHAR NOT NULL PRIMARY KEY, items VARCHAR NOT NULL, "
+               "version INTEGER NOT NULL, updated_at FLOAT NOT NULL)",
+               "CREATE TABLE IF NOT EXISTS checkouts (message_id VARCHAR NOT NULL PRIMARY KEY, client VARCHAR NOT NULL, "
+               "cart_version INTEGER NOT NULL, status VARCHAR NOT NULL, detail VARCHAR, created_at FLOAT NOT NULL)",
+               "CREATE INDEX IF NOT EXISTS ix_carts_updated ON carts (updated_at)",
+               "CREATE INDEX IF NOT EXISTS ix_checkouts_client ON checkouts (client, created_at)"],
+              [("SELECT client FROM carts WHERE updated_at < ? LIMIT ?", (1.0, 1000), ("ix_carts_updated",)),
+               ("SELECT message_id FROM checkouts WHERE client = ? ORDER BY created_at DESC LIMIT ?", ("u", 20),
+                ("ix_checkouts_client",))]),
+    Migration(5, "Тело и время отправки оформления для повтора",
+              [add_column("checkouts", "body", "VARCHAR"),
+               add_column("checkouts", "sent_at", "FLOAT"),
+               #Прежние оформления без тела повторить нельзя: считаются отправленными
+               "UPDATE checkouts SET sent_at = created_at WHERE sent_at IS NULL AND body IS NULL",
+               "CREATE INDEX IF NOT EXISTS ix_checkouts_unsent ON checkouts (created_at) "
+               "WHERE sent_at IS NULL AND status = 'pending'"],
+              [("SELECT message_id, body FROM checkouts WHERE sent_at IS NULL AND status = 'pending' "
+                "AND created_at < ? ORDER BY created_at LIMIT ?", (1.0, 100), ("ix_checkouts_unsent",))]),
+]
+
+def migrate(path: str):
+    """Применение новых миграций basket.db"""
+    return run(path, MIGRATIONS)
+
+if __name__ == "__main__":
+    from .database import engine
+    run_main(sys.argv[1:], MIGRATIONS, engine.url.database)
@@ -1,12 +1,68 @@
-"""Модель заказа"""
+"""Модели заказа, корзины и оформления корзины"""
+from sqlalchemy import Index, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column
-from database import Base
+from .database import Base
 
 class Order(Base):
     """Класс заказа"""
     __tablename__ = "orders"
 
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    client: Mapped[str] = mapped_column(unique=True)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    client: Mapped[str] = mapped_column()
     price: Mapped[int] = mapped_column()
-    items: Mapped[str] = mapped_column()
\ No newline at end of file
+    #Время покупки (unix); у заказов, перенесённых из старой схемы, - 0
+    created_at: Mapped[float] = mapped_column()
+    #id сообщения из outbox Catal: повторная доставка не создаёт второй заказ
+    message_id: Mapped[str | None] = mapped_column(nullable=True)
+
+class OrderLine(Base):
+    """Строка заказа: комикс, количество и цена за штуку на момент покупки"""
+    __tablename__ = "order_lines"
+
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True)
+    line_no: Mapped[int] = mapped_column(primary_key=True)
+    #Нет у строк, перенесённых из заказов со свободным текстом
+    comic_id: Mapped[int | None] = mapped_column(nullable=True)
+    title: Mapped[str] = mapped_column()
+    qty: Mapped[int] = mapped_column()
+    price: Mapped[int] = mapped_column()
+
+class Cart(Base):
+    """Корзина клиента; version растёт с каждым изменением (оптимистическая блокировка)"""
+    __tablename__ = "carts"
+
+    client: Mapped[str] = mapped_column(primary_key=True)
+    #JSON-объект {comic_id: qty}
+    items: Mapped[str] = mapped_column()
+    version: Mapped[int] = mapped_column()
+    #Время последнего изменения (unix): по нему корзины истекают
+    updated_at: Mapped[float] = mapped_column()
+
+class Checkout(Base):
+    """Оформление корзины: id сообщения в Catal и его итог"""
+    __tablename__ = "checkouts"
+
+    #Из клиента и версии корзины: повторное оформление той же корзины - то же сообщение
+    message_id: Mapped[str] = mapped_column(primary_key=True)
+    client: Mapped[str] = mapped_column()
+    cart_version: Mapped[int] = mapped_column()
+    #pending, completed или rejected
+    status: Mapped[str] = mapped_column()
+    #JSON с нехваткой товара при отказе
+    detail: Mapped[str | None] = mapped_column(nullable=True)
+    created_at: Mapped[float] = mapped_column()
+    #Тело сообщения в Catal и время его отправки: без sent_at оформление отправит повтор (checkout.py)
+    body: Mapped[str | None] = mapped_column(nullable=True)
+    sent_at: Mapped[float | None] = mapped_column(nullable=True)
+
+Index("uq_orders_message_id", Order.message_id, unique=True)
+#История клиента от новых к старым
+Index("ix_orders_client_created", Order.client, Order.created_at, Order.id)
+#Продажи комикса: покрывающий индекс, таблица строк не читается
+Index("ix_order_lines_comic", OrderLine.comic_id, OrderLine.qty, OrderLine.price)
+#Очистка истёкших корзин
+Index("ix_carts_updated", Cart.updated_at)
+Index("ix_checkouts_client", Checkout.client, Checkout.created_at)
+#Неотправленные оформления для повтора
+Index("ix_checkouts_unsent", Checkout.created_at,
+      sqlite_where=(Checkout.sent_at.is_(None)) & (Checkout.status == "pending"))
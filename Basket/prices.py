@@ -0,0 +1,213 @@
+"""Снимок цен и остатков каталога в памяти Basket
+
+Снимок загружается целиком из catal.db (только чтение) или NDJSON-выгрузкой Catal,
+а затем обновляется событиями каталога из очереди. У каждого комикса хранится
+версия каталога, с которой он известен: устаревшие и повторные события пропускаются.
+
+Чтение файла catal.db (по умолчанию) возможно, только если у Basket и Catal общая
+файловая система: один хост или общий том, как в combined.py и bench. Если Catal
+работает на другом хосте, нужно задать BASKET_CATALOG_URL - иначе снимок не загрузится
+и Basket будет повторять попытки с предупреждением в логе.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+import httpx
+from pydantic import BaseSettings
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger("basket.prices")
+
+class CatalogSettings(BaseSettings):
+    """Откуда загружать снимок (переменные окружения BASKET_CATALOG_*)"""
+    #Файл catal.db; по умолчанию как у Catal (CATAL_DB_URL или рядом с пакетом). Только при общей файловой системе
+    db: str | None = None
+    #Адрес Catal, например http://127.0.0.1:8000/catal; если задан, снимок берётся по HTTP (Catal на другом хосте)
+    url: str | None = None
+    retry_delay: float = 1.0
+    #Сколько событий держать, пока снимок загружается
+    max_buffered: int = 100000
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "BASKET_CATALOG_"
+
+def default_catalog_db():
+    """Файл catal.db: из CATAL_DB_URL, иначе рядом с пакетом Catal"""
+    url = os.environ.get("CATAL_DB_URL")
+    if url:
+        return make_url(url).database
+    return str(Path(__file__).resolve().parent.parent / "Catal" / "catal.db")
+
+class Price:
+    """Цена и остаток комикса в снимке"""
+    __slots__ = ("id", "title", "price", "amount", "version")
+
+    def __init__(self, id: int, title: str, price: int, amount: int, version: int):
+        self.id = id
+        self.title = title
+        self.price = price
+        self.amount = amount
+        self.version = version
+
+class PriceSnapshot:
+    """Цены по id и названию; загрузка повторяется после каждого переподключения к очереди событий"""
+
+    def __init__(self, settings: CatalogSettings):
+        self.settings = settings
+        self.prices = {}
+        self.titles = {}
+        #Версия удалённых комиксов, чтобы запоздавшее событие их не вернуло
+        self.deleted = {}
+        self.epoch = None
+        self.version = None
+        self.ready = False
+        #Загрузку попросили (снова), пока она шла: прочитать ещё раз
+        self.pending = False
+        self.buffered = []
+        self.loop = None
+        self.task = None
+        self.loads = 0
+        self.applied = 0
+        self.skipped = 0
+        self.loaded_at = None
+
+    def find(self, comic_id: int | None = None, title: str | None = None):
+        """Комикс по id или названию; None, если его нет"""
+        if comic_id is None:
+            comic_id = self.titles.get((title or "").strip())
+        return self.prices.get(comic_id)
+
+    def apply(self, event: dict):
+        """Событие каталога; до окончания загрузки - в буфер"""
+        if not self.ready:
+            if len(self.buffered) < self.settings.max_buffered:
+                self.buffered.append(event)
+            return
+        if event["epoch"] != self.epoch:
+            #catal.db создан заново: прежние версии несравнимы
+            self.resync()
+            self.buffered.append(event)
+            return
+        comic_id, version = event["id"], event["version"]
+        current = self.prices.get(comic_id)
+        known = current.version if current is not None else self.deleted.get(comic_id, -1)
+        if version <= known:
+            self.skipped += 1
+            return
+        self.remove(comic_id)
+        if event.get("deleted"):
+            self.deleted[comic_id] = version
+        else:
+            self.put(Price(comic_id, event["title"], event["price"], event["amount"], version))
+        self.version = max(self.version, version)
+        self.applied += 1
+
+    def put(self, price: Price):
+        """Запись комикса и его названия"""
+        self.prices[price.id] = price
+        self.titles[price.title] = price.id
+        self.deleted.pop(price.id, None)
+
+    def remove(self, comic_id: int):
+        """Удаление комикса и его названия"""
+        old = self.prices.pop(comic_id, None)
+        if old is not None and self.titles.get(old.title) == comic_id:
+            del self.titles[old.title]
+
+    def load(self, epoch: str, version: int, rows):
+        """Полная замена снимка; версия каталога прочитана до строк, события после неё применяются"""
+        self.prices, self.titles, self.deleted = {}, {}, {}
+        for comic_id, title, price, amount in rows:
+            self.put(Price(comic_id, title, price, amount, version))
+        self.epoch, self.version = epoch, version
+        self.ready = True
+        self.loads += 1
+        self.loaded_at = time.time()
+        buffered, self.buffered = self.buffered, []
+        for event in buffered:
+            if event["epoch"] == epoch:
+                self.apply(event)
+
+    def read_database(self):
+        """Версия и комиксы одной читающей транзакцией (в отдельном потоке)"""
+        path = self.settings.db or default_catalog_db()
+        if not os.path.exists(path):
+            logger.warning("Catalog database %s not found; set BASKET_CATALOG_URL if Catal runs on another host", path)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            conn.execute("BEGIN")
+            epoch, version = conn.execute("SELECT epoch, version FROM catalog_version WHERE id = 1").fetchone()
+            rows = conn.execute("SELECT id, title, price, amount FROM comics").fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return epoch, version, rows
+
+    async def read_http(self):
+        """Версия и потоковая NDJSON-выгрузка комиксов из Catal"""
+        async with httpx.AsyncClient(base_url=self.settings.url, timeout=30) as client:
+            response = await client.get("/catalog/version")
+            response.raise_for_status()
+            state = response.json()
+            rows = []
+            async with client.stream("GET", "/view/comics", params={"format": "ndjson"}) as stream:
+                stream.raise_for_status()
+                async for line in stream.aiter_lines():
+                    if line:
+                        comic = json.loads(line)
+                        rows.append((comic["id"], comic["title"], comic["price"], comic["amount"]))
+        return state["epoch"], state["version"], rows
+
+    async def run(self):
+        """Загрузка с повтором, пока не удастся; повторная, если её запросили во время чтения"""
+        while self.pending:
+            self.pending = False
+            try:
+                if self.settings.url:
+                    epoch, version, rows = await self.read_http()
+                else:
+                    epoch, version, rows = await asyncio.to_thread(self.read_database)
+            except (sqlite3.Error, httpx.HTTPError, TypeError, KeyError, ValueError):
+                self.pending = True
+                await asyncio.sleep(self.settings.retry_delay)
+                continue
+            if not self.pending:
+                self.load(epoch, version, rows)
+
+    def resync(self):
+        """Новая загрузка; события до её окончания копятся в буфере"""
+        self.ready = False
+        self.pending = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def resync_threadsafe(self):
+        """resync из потока получателя (после подписки на очередь событий)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.resync)
+
+    async def start(self):
+        """Первая загрузка; дальше - после каждого переподключения получателя"""
+        self.loop = asyncio.get_running_loop()
+        self.resync()
+
+    async def stop(self):
+        """Отмена незаконченной загрузки"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self):
+        """Состояние снимка"""
+        return {"ready": self.ready, "comics": len(self.prices), "epoch": self.epoch, "version": self.version,
+                "loads": self.loads, "applied": self.applied, "skipped": self.skipped,
+                "buffered": len(self.buffered), "loaded_at": self.loaded_at}
+
+settings = CatalogSettings()
+snapshot = PriceSnapshot(settings)
@@ -0,0 +1,31 @@
+"""Публикация сообщений в очередь без блокировки цикла событий"""
+from pydantic import BaseSettings
+from common.broker import BrokerUnavailable, Publisher, memory_broker
+
+class BrokerSettings(BaseSettings):
+    """Настройки брокера (переменные окружения CATAL_BROKER_*)"""
+    #rabbitmq или memory (очереди в памяти процесса, для тестов и замеров)
+    backend: str = "rabbitmq"
+    host: str = "localhost"
+    port: int = 5672
+    queue: str = "comics"
+    #Сколько соединений (и потоков) публикуют параллельно
+    pool_size: int = 2
+    confirm: bool = True
+    #Сколько уже ожидающих сообщений отправлять за один заход
+    batch_size: int = 100
+    #Сколько ждать добора пачки, мс (0 - не ждать)
+    batch_linger_ms: float = 0.0
+    max_pending: int = 10000
+    retries: int = 3
+    reconnect_delay: float = 0.2
+    reconnect_max_delay: float = 5.0
+    #События каталога получает каждый процесс Basket
+    fanout: set = {"catalog"}
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_BROKER_"
+
+settings = BrokerSettings()
+publisher = Publisher(settings, memory_broker)
@@ -0,0 +1,139 @@
+"""Массовая загрузка комиксов (JSON-массив или NDJSON)"""
+import json
+from fastapi import HTTPException
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Comic, Writer, Publisher, Artist, normalized, name_key
+from .validation import REG_COMIC, REG_NAME, REG_PUB, matches
+
+#Строк комиксов в одной транзакции
+CHUNK = 500
+#Параметров в одном IN (SQLite ограничивает число переменных в запросе)
+IN_CHUNK = 500
+FIELDS = ("title", "amount", "price", "publisher", "writer", "artist")
+#Сущность -> модель и шаблон имени
+ENTITIES = {"publisher": (Publisher, REG_PUB), "writer": (Writer, REG_NAME), "artist": (Artist, REG_NAME)}
+
+def parse_body(body: bytes, content_type: str):
+    """Разбор тела запроса: JSON-массив или NDJSON (по строке на комикс)"""
+    if "ndjson" in content_type or "jsonl" in content_type:
+        try:
+            lines = body.decode().splitlines()
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400,detail="Bad NDJSON")
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+        return rows
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400,detail="Bad JSON")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400,detail="Expected JSON array")
+    return rows
+
+def check_row(row):
+    """Нормализация и проверка одной строки; возвращает (комикс, ошибка)"""
+    if not isinstance(row, dict):
+        return None, "Bad row"
+    missing = [field for field in FIELDS if row.get(field) is None]
+    if missing:
+        return None, "Missing " + ", ".join(missing)
+    comic = {field: str(row[field]).strip() for field in FIELDS}
+    if not comic["amount"].isnumeric() or int(comic["amount"])<0:
+        return None, "Bad amount"
+    if not comic["price"].isdigit() or float(comic["price"])<0:
+        return None, "Bad price"
+    if not matches(comic["title"], REG_COMIC):
+        return None, "Bad title"
+    for kind, (_, reg) in ENTITIES.items():
+        if not matches(comic[kind], reg):
+            return None, f"Bad {kind}"
+    return comic, None
+
+def chunks(items: list, size: int):
+    """Нарезка списка на части"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def resolve_names(model, names: set, db: AsyncSession):
+    """id по нормализованному имени: один IN-запрос на часть имён, недостающие вставляются пачкой"""
+    spelling = {}
+    for name in sorted(names):
+        spelling.setdefault(name_key(name), name)
+    ids = await find_names(model, list(spelling), db)
+    missing = [{"name": spelling[key]} for key in spelling if key not in ids]
+    for part in chunks(missing, IN_CHUNK):
+        #Имя могли добавить параллельно: такие строки пропускаются и находятся повторным запросом
+        await db.execute(insert(model).prefix_with("OR IGNORE"), part)
+    if missing:
+        ids.update(await find_names(model, [key for key in spelling if key not in ids], db))
+    return ids
+
+async def find_names(model, keys: list, db: AsyncSession):
+    """Нормализованное имя -> id для уже существующих записей"""
+    ids = {}
+    for part in chunks(keys, IN_CHUNK):
+        found = await db.execute(select(normalized(model.name), model.id).where(normalized(model.name).in_(part)))
+        ids.update(found.tuples().all())
+    return ids
+
+async def existing_titles(titles: list, db: AsyncSession):
+    """Названия из списка, которые уже есть в каталоге"""
+    found = set()
+    for part in chunks(titles, IN_CHUNK):
+        found.update((await db.execute(select(Comic.title).where(Comic.title.in_(part)))).scalars())
+    return found
+
+async def import_comics(rows: list, db: AsyncSession):
+    """Загрузка комиксов с построчным результатом: created, duplicate, invalid или failed"""
+    results = [{"row": i, "title": row.get("title") if isinstance(row, dict) else None} for i, row in enumerate(rows)]
+    valid = []
+    seen = set()
+    for i, row in enumerate(rows):
+        comic, error = check_row(row)
+        if error:
+            results[i].update(status = "invalid", detail = error)
+        elif comic["title"] in seen:
+            results[i].update(status = "duplicate", title = comic["title"])
+        else:
+            seen.add(comic["title"])
+            valid.append((i, comic))
+    for part in chunks(valid, CHUNK):
+        await insert_chunk(part, results, db)
+    summary = {"created": 0, "duplicate": 0, "invalid": 0, "failed": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return {**summary, "results": results}
+
+async def insert_chunk(part: list, results: list, db: AsyncSession):
+    """Имена и комиксы части одной транзакцией; при гонке за название повторяет попытку, затем отмечает часть failed"""
+    for _ in range(2):
+        duplicates = await existing_titles([comic["title"] for _, comic in part], db)
+        fresh = [comic for _, comic in part if comic["title"] not in duplicates]
+        try:
+            if fresh:
+                ids = {kind: await resolve_names(model, {comic[kind] for comic in fresh}, db)
+                       for kind, (model, _) in ENTITIES.items()}
+                await db.execute(insert(Comic), [
+                    {"title": comic["title"], "amount": int(comic["amount"]), "price": float(comic["price"]),
+                     "publisher_id": ids["publisher"][name_key(comic["publisher"])],
+                     "writer_id": ids["writer"][name_key(comic["writer"])],
+                     "artist_id": ids["artist"][name_key(comic["artist"])]} for comic in fresh])
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            continue
+        for i, comic in part:
+            results[i].update(status = "duplicate" if comic["title"] in duplicates else "created", title = comic["title"])
+        return
+    #Уже загруженные части остаются, эта целиком откатывается
+    for i, comic in part:
+        results[i].update(status = "failed", title = comic["title"], detail = "Conflict, retry the row")
@@ -0,0 +1,129 @@
+"""Кэш ответов каталога с вытеснением по LRU/TTL и версией каталога для ETag
+
+Версия каталога хранится в catal.db и увеличивается триггерами, поэтому
+несколько процессов с общим файлом БД видят изменения друг друга. Изменения comics
+увеличивают версию триггеры событий (events.py), остальных таблиц - триггеры здесь:
+каждое изменение увеличивает её ровно один раз.
+"""
+import re
+import time
+import uuid
+from collections import OrderedDict
+from pydantic import BaseSettings
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+#Таблицы, изменение которых меняет ответы каталога (кроме comics: её версию ведут триггеры событий)
+TABLES = ("publishers", "writers", "artists")
+#Триггеры версии comics прежних версий; их удаляет миграция
+COMIC_TRIGGERS = tuple(f"version_comics_{event}" for event in ("i", "u", "d"))
+
+DDL = [
+    """CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1),
+        epoch TEXT NOT NULL, version INTEGER NOT NULL)""",
+    *[f"""CREATE TRIGGER IF NOT EXISTS version_{table}_{event[0].lower()} AFTER {event} ON {table} BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END""" for table in TABLES for event in ("INSERT", "UPDATE", "DELETE")],
+]
+
+#Метка в If-None-Match: W/"..." или "..."; запятая внутри кавычек допустима
+ENTITY_TAG = re.compile(r'(?:W/)?"([^"]*)"')
+
+def etag_matches(header: str | None, etag: str):
+    """If-None-Match по RFC 7232: список меток, W/ и *; сравнение слабое"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (f'"{tag}"' for tag in ENTITY_TAG.findall(header))
+
+def install(conn):
+    """Таблица версии и триггеры; эпоха задаётся один раз при создании"""
+    for statement in DDL:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("INSERT OR IGNORE INTO catalog_version (id, epoch, version) VALUES (1, ?, 0)",
+                         (uuid.uuid4().hex[:8],))
+
+class CacheSettings(BaseSettings):
+    """Настройки кэша (переменные окружения CATAL_CACHE_*)"""
+    max_entries: int = 2048
+    ttl: float = 300.0
+    #Как часто сверять версию с БД, с: столько ответ может отставать от записи в другом процессе
+    check_interval: float = 0.5
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_CACHE_"
+
+class CatalogCache:
+    """LRU-кэш с TTL; любая запись в каталог увеличивает версию и сбрасывает кэш"""
+
+    def __init__(self, max_entries: int, ttl: float, check_interval: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        #Эпоха и версия из catal.db; до первой сверки - случайные, чтобы не совпасть с чужим ETag
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.checked_at = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def etag(self, version: int | None = None):
+        """Сильный ETag текущей версии каталога"""
+        return f'"{self.epoch}-{self.version if version is None else version}"'
+
+    async def refresh(self, db: AsyncSession, force: bool = False):
+        """Сверка версии с БД не чаще check_interval (force - сейчас); при изменении кэш сбрасывается"""
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        row = (await db.execute(text("SELECT epoch, version FROM catalog_version WHERE id = 1"))).first()
+        self.checked_at = now
+        if row is not None and (row.epoch, row.version) != (self.epoch, self.version):
+            self.epoch, self.version = row.epoch, row.version
+            self.entries.clear()
+            self.invalidations += 1
+
+    def get(self, key):
+        """Значение из кэша или None"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, version: int):
+        """Сохранение значения, посчитанного для версии version"""
+        if version != self.version:
+            #Каталог изменился, пока строился ответ
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump(self):
+        """Каталог изменён этим процессом: сброс кэша и сверка версии при следующем чтении"""
+        self.version += 1
+        self.invalidations += 1
+        self.entries.clear()
+        self.checked_at = None
+
+    def stats(self):
+        """Счётчики для подбора размера кэша"""
+        return {"epoch": self.epoch, "version": self.version, "entries": len(self.entries), "max_entries": self.max_entries,
+                "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+settings = CacheSettings()
+catalog_cache = CatalogCache(settings.max_entries, settings.ttl, settings.check_interval)
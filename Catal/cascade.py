@@ -0,0 +1,52 @@
+"""Удаление издателей, сценаристов, художников и комиксов наборами строк"""
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Comic, Writer, Publisher, Artist, name_key
+from .bulk import chunks, find_names, IN_CHUNK
+
+#Сколько имён можно передать в одном запросе на удаление
+MAX_NAMES = 10000
+#Сущность -> модель, её таблица и внешний ключ в comics
+ENTITIES = {"publisher": (Publisher, Comic.publisher_id), "writer": (Writer, Comic.writer_id),
+            "artist": (Artist, Comic.artist_id)}
+
+def check_names(names, field: str):
+    """Список строк не длиннее MAX_NAMES"""
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise HTTPException(status_code=400,detail=f"Expected {field}: list of strings")
+    if len(names) > MAX_NAMES:
+        raise HTTPException(status_code=400,detail=f"Too many {field} (max {MAX_NAMES})")
+    return names
+
+async def delete_by_names(kind: str, names: list, db: AsyncSession):
+    """Удаление записей по именам и всех их комиксов одной транзакцией.
+
+    Комиксы удаляются явным DELETE ... WHERE <fk> IN (...), поэтому работает
+    и на старых файлах БД, где внешние ключи созданы без ON DELETE CASCADE.
+    """
+    model, column = ENTITIES[kind]
+    spelling = {}
+    for name in names:
+        spelling.setdefault(name_key(name), name)
+    ids = await find_names(model, list(spelling), db)
+    comics = removed = 0
+    for part in chunks(list(ids.values()), IN_CHUNK):
+        comics += (await db.execute(delete(Comic).where(column.in_(part))
+                                    .execution_options(synchronize_session = False))).rowcount
+        removed += (await db.execute(delete(model).where(model.id.in_(part))
+                                     .execution_options(synchronize_session = False))).rowcount
+    await db.commit()
+    return {"deleted": {model.__tablename__: removed, "comics": comics},
+            "not_found": [name for key, name in spelling.items() if key not in ids]}
+
+async def delete_comics(titles: list, db: AsyncSession):
+    """Удаление комиксов по названиям одной транзакцией"""
+    titles = list(dict.fromkeys(title.strip() for title in titles))
+    deleted = set()
+    for part in chunks(titles, IN_CHUNK):
+        result = await db.execute(delete(Comic).where(Comic.title.in_(part)).returning(Comic.title)
+                                  .execution_options(synchronize_session = False))
+        deleted.update(result.scalars())
+    await db.commit()
+    return {"deleted": {"comics": len(deleted)}, "not_found": [title for title in titles if title not in deleted]}
@@ -0,0 +1,102 @@
+"""Оформление корзин из Basket: одно сообщение на корзину, списание всей корзины одной транзакцией
+
+Успех - заказ в outbox с id сообщения корзины (повторная доставка не спишет товар
+второй раз: уникальный message_id в outbox откатит транзакцию). Нехватка - отказ
+в очередь событий каталога, корзина у клиента остаётся.
+"""
+import json
+import uuid
+from pydantic import BaseModel, BaseSettings, conint, conlist
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from common.broker import consumer_transport
+from common.consumer import BatchConsumer
+from .broker import settings as broker_settings
+from .cache import catalog_cache
+from .database import async_session
+from .models import OutboxMessage
+from .events import settings as event_settings
+from .outbox import enqueue, relay
+from .purchase import CartLine, OutOfStock, reserve_stock, order_message
+
+class CheckoutSettings(BaseSettings):
+    """Получатель корзин (переменные окружения CATAL_CHECKOUT_*; адрес брокера - из CATAL_BROKER_*)"""
+    backend: str = "rabbitmq"
+    host: str = "localhost"
+    port: int = 5672
+    queue: str = "checkout"
+    #Корзины, которые не удалось оформить: разбираются вручную, а не теряются
+    dead_letter_queue: str = "checkout.dead"
+    run_in_app: bool = True
+    prefetch: int = 50
+    concurrency: int = 1
+    batch_size: int = 20
+    batch_linger: float = 0.05
+    poll_timeout: float = 1.0
+    lag_interval: float = 5.0
+    reconnect_delay: float = 0.2
+    reconnect_max_delay: float = 5.0
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_CHECKOUT_"
+
+class CheckoutLine(BaseModel):
+    """Строка корзины; цена из Basket только для сведения, списывается по цене каталога"""
+    comic_id: int | None = None
+    title: str
+    qty: conint(gt=0)
+    price: int | None = None
+
+class CheckoutMod(BaseModel):
+    """Корзина на оформление"""
+    message_id: str
+    email: str
+    items: conlist(CheckoutLine, min_items=1, max_items=500)
+
+def decode_checkout(body: bytes, message_id: str | None):
+    """Корзина из сообщения; id из свойств сообщения важнее, чем в теле"""
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Checkout must be a JSON object")
+    if message_id:
+        data["message_id"] = message_id
+    return CheckoutMod(**data)
+
+async def place(checkout: CheckoutMod):
+    """Одна корзина одной транзакцией; False, если её уже оформили раньше или не хватило товара"""
+    async with async_session() as db:
+        #Повторная доставка оформленной корзины: без этой проверки товар уже списан и пришёл бы ложный отказ
+        if (await db.execute(select(OutboxMessage.id)
+                             .where(OutboxMessage.message_id == checkout.message_id).limit(1))).first():
+            return False
+        try:
+            reserved = await reserve_stock([CartLine(comic_id = line.comic_id, title = line.title, qty = line.qty)
+                                            for line in checkout.items], db)
+            await enqueue(db, order_message(checkout.email, reserved, checkout.message_id))
+        except OutOfStock as e:
+            #Каждый отказ - новое сообщение: после пополнения ту же корзину можно оформить снова
+            await enqueue(db, {"type": "checkout_rejected", "checkout_id": checkout.message_id,
+                               "email": checkout.email, "shortages": e.shortages},
+                          routing_key = event_settings.routing_key, message_id = uuid.uuid4().hex)
+            placed = False
+        else:
+            placed = True
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return False
+    return placed
+
+async def place_checkouts(checkouts: list):
+    """Пачка корзин из очереди; кэш каталога сбрасывается, только если что-то списано"""
+    placed = 0
+    for checkout in checkouts:
+        placed += await place(checkout)
+    if placed:
+        catalog_cache.bump()
+    relay.wake()
+
+settings = CheckoutSettings(backend = broker_settings.backend, host = broker_settings.host, port = broker_settings.port)
+checkout_consumer = BatchConsumer(settings, decode_checkout, place_checkouts, lambda: consumer_transport(settings))
@@ -0,0 +1,61 @@
+"""События изменения каталога для Basket и ленты изменений: триггеры comics пишут их в outbox той же транзакцией
+
+Каждое событие несёт полное состояние комикса и номер версии каталога. Триггер
+сам увеличивает catalog_version перед записью, поэтому версии событий строго
+растут, и получатель отбрасывает устаревшие, даже если outbox отправил их не по порядку.
+"""
+from pydantic import BaseSettings
+
+class EventSettings(BaseSettings):
+    """Очереди обмена с Basket (переменные окружения CATAL_EVENTS_*)"""
+    #Изменения цен и остатков, отказы в оформлении корзины; в триггеры попадает при их создании
+    routing_key: str = "catalog"
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_EVENTS_"
+
+settings = EventSettings()
+
+#Время для outbox.created_at в секундах unix с долями
+NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+def outbox_insert(payload: str):
+    """Новая версия каталога и событие с ней в outbox"""
+    return f"""UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        INSERT INTO outbox (message_id, routing_key, body, created_at, attempts, next_attempt_at)
+            SELECT lower(hex(randomblob(16))), '{settings.routing_key}',
+                json_object('type', 'comic', 'epoch', epoch, 'version', version, {payload}), {NOW}, 0, 0
+            FROM catalog_version WHERE id = 1;"""
+
+def publisher(row: str):
+    """Издательство комикса (для фильтра ленты); при каскадном удалении комиксы удаляются раньше издательства"""
+    return (f"'publisher_id', {row}.publisher_id, "
+            f"'publisher', (SELECT name FROM publishers WHERE id = {row}.publisher_id)")
+
+def state(row: str, change: str):
+    """Поля комикса в событии"""
+    return (f"'change', '{change}', 'id', {row}.id, 'title', {row}.title, 'price', {row}.price, "
+            f"'amount', {row}.amount, {publisher(row)}, 'deleted', json('false')")
+
+DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS events_comics_ai AFTER INSERT ON comics BEGIN
+        {outbox_insert(state("new", "created"))}
+    END""",
+    #Смена издательства, сценариста или художника тоже событие: по нему выгрузка снимка находит изменённые комиксы
+    f"""CREATE TRIGGER IF NOT EXISTS events_comics_au
+        AFTER UPDATE OF title, price, amount, publisher_id, writer_id, artist_id ON comics BEGIN
+        {outbox_insert(state("new", "updated"))}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS events_comics_ad AFTER DELETE ON comics BEGIN
+        {outbox_insert(f"'change', 'deleted', 'id', old.id, 'title', old.title, {publisher('old')}, 'deleted', json('true')")}
+    END""",
+]
+
+#Триггеры прежних версий удаляет миграция, install создаёт заново
+TRIGGERS = ("events_comics_ai", "events_comics_au", "events_comics_ad")
+
+def install(conn):
+    """Триггеры событий (после таблиц outbox и catalog_version)"""
+    for statement in DDL:
+        conn.exec_driver_sql(statement)
@@ -0,0 +1,194 @@
+"""Выгрузка каталога в двоичный снимок для реплик (Catal.snapshot)
+
+Снимок строится заново, только если изменилась версия каталога. Если предыдущий снимок
+той же эпохи и все строки outbox после него ещё на месте, из catal.db читаются только
+изменённые комиксы (по событиям каталога в outbox) и справочники, остальное берётся из
+предыдущего файла. Иначе - полная выгрузка. Строит снимок один процесс: остальные
+пропускают ход, пока держится блокировка файла.
+
+Запуск вручную из корня репозитория:
+    python -m Catal.export [путь к catal.db] [путь к снимку] [--full]
+"""
+import asyncio
+import fcntl
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from pydantic import BaseSettings
+from .events import settings as event_settings
+from .snapshot import Columns, DIMENSIONS, NONE, Snapshot, SnapshotError, build, write
+
+class SnapshotSettings(BaseSettings):
+    """Настройки выгрузки (переменные окружения CATAL_SNAPSHOT_*)"""
+    #Файл снимка; по умолчанию рядом с catal.db с расширением .snap
+    path: str | None = None
+    #Выгружать из приложения (иначе - вручную или по расписанию python -m Catal.export)
+    run_in_app: bool = False
+    #Как часто проверять версию каталога, с
+    interval: float = 5.0
+    #Сколько id комиксов читать одним запросом при частичной выгрузке
+    chunk: int = 500
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_SNAPSHOT_"
+
+COMIC_COLUMNS = "id, title, amount, price, publisher_id, writer_id, artist_id"
+
+def snapshot_path(database: str, settings: SnapshotSettings):
+    """Файл снимка для catal.db"""
+    return settings.path or str(Path(database).with_suffix(".snap"))
+
+def open_base(path: str):
+    """Предыдущий снимок или None, если его нет или он повреждён; его читают целиком, поэтому crc32 проверяется сразу"""
+    try:
+        return Snapshot(path, verify=True)
+    except (OSError, SnapshotError):
+        return None
+
+def read_names(conn, columns: Columns):
+    """Справочники целиком: их мало, и изменения в них событий не порождают"""
+    for dimension, table in DIMENSIONS.items():
+        for row_id, name in conn.execute(f"SELECT id, name FROM {table} ORDER BY id"):
+            columns.add_name(dimension, row_id, name)
+
+def changed_comics(conn, since: int, last_id: int):
+    """id комиксов из событий outbox после since; None, если часть строк outbox уже удалена"""
+    present = conn.execute("SELECT count(*) FROM outbox WHERE id > ? AND id <= ?", (since, last_id)).fetchone()[0]
+    if present != last_id - since:
+        return None
+    rows = conn.execute("SELECT body FROM outbox WHERE routing_key = ? AND id > ? AND id <= ? ORDER BY id",
+                        (event_settings.routing_key, since, last_id))
+    changed = set()
+    for (body,) in rows:
+        event = json.loads(body)
+        if event.get("type") == "comic":
+            changed.add(event["id"])
+    return changed
+
+def read_changed(conn, changed: set, chunk: int):
+    """Текущие строки изменённых комиксов по порядку id (удалённых среди них нет)"""
+    ids = sorted(changed)
+    rows = []
+    for start in range(0, len(ids), chunk):
+        part = ids[start:start + chunk]
+        rows += conn.execute(f"SELECT {COMIC_COLUMNS} FROM comics WHERE id IN ({','.join('?' * len(part))})",
+                             part).fetchall()
+    rows.sort()
+    return rows
+
+def merge(base: Snapshot, changed: set, fresh: list):
+    """Комиксы предыдущего снимка без изменённых и свежие строки изменённых - по порядку id"""
+    ids, titles = base.column("c_id"), base.column("c_title")
+    amounts, prices = base.column("c_amount"), base.column("c_price")
+    refs = [(base.column(f"c_{dimension[0]}"), base.column(f"{dimension[0]}_id")) for dimension in DIMENSIONS]
+    position = 0
+    for row in range(base.count):
+        comic_id = ids[row]
+        while position < len(fresh) and fresh[position][0] < comic_id:
+            yield fresh[position]
+            position += 1
+        if comic_id in changed:
+            continue
+        yield (comic_id, base.string(titles[row]), amounts[row], prices[row],
+               *[dimension_ids[column[row]] if column[row] != NONE else 0 for column, dimension_ids in refs])
+    yield from fresh[position:]
+
+def export(database: str, path: str, settings: SnapshotSettings, full: bool = False):
+    """Новый снимок, если каталог изменился; сведения о выгрузке или None"""
+    started = time.perf_counter()
+    base = None if full else open_base(path)
+    conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        #Одна читающая транзакция: версия, outbox и таблицы согласованы
+        conn.execute("BEGIN")
+        epoch, version = conn.execute("SELECT epoch, version FROM catalog_version WHERE id = 1").fetchone()
+        last_id = conn.execute("SELECT coalesce(max(id), 0) FROM outbox").fetchone()[0]
+        if base is not None and base.epoch == epoch and base.version == version:
+            return None
+        columns = Columns()
+        read_names(conn, columns)
+        changed = None
+        if base is not None and base.epoch == epoch and base.outbox_id <= last_id:
+            changed = changed_comics(conn, base.outbox_id, last_id)
+        if changed is None:
+            columns.add_comics(conn.execute(f"SELECT {COMIC_COLUMNS} FROM comics ORDER BY id"))
+        else:
+            columns.add_comics(merge(base, changed, read_changed(conn, changed, settings.chunk)))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    size = write(path, build(columns, epoch, version, last_id))
+    return {"version": version, "incremental": changed is not None, "changed": len(changed or ()),
+            "comics": len(columns.ids), "bytes": size, "seconds": round(time.perf_counter() - started, 4)}
+
+class SnapshotExporter:
+    """Периодическая выгрузка из приложения основного сервиса"""
+
+    def __init__(self, settings: SnapshotSettings, database: str):
+        self.settings = settings
+        self.database = database
+        self.path = snapshot_path(database, settings)
+        self.task = None
+        self.builds = 0
+        self.incremental = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last = None
+
+    def export_locked(self, full: bool = False):
+        """Выгрузка под блокировкой файла; None, если строит другой процесс или менять нечего"""
+        with open(f"{self.path}.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return export(self.database, self.path, self.settings, full)
+
+    async def export(self, full: bool = False):
+        """Одна выгрузка в отдельном потоке"""
+        result = await asyncio.to_thread(self.export_locked, full)
+        if result is None:
+            self.skipped += 1
+        else:
+            self.builds += 1
+            self.incremental += result["incremental"]
+            self.last = result
+        return result
+
+    async def run(self):
+        """Проверка версии каждые interval секунд"""
+        while True:
+            try:
+                await self.export()
+            except (OSError, sqlite3.Error):
+                self.errors += 1
+            await asyncio.sleep(self.settings.interval)
+
+    async def start(self):
+        """Запуск, если выгрузка включена в приложении"""
+        if self.settings.run_in_app:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self):
+        """Счётчики выгрузки"""
+        return {"path": self.path, "builds": self.builds, "incremental": self.incremental, "skipped": self.skipped,
+                "errors": self.errors, "last": self.last}
+
+settings = SnapshotSettings()
+
+if __name__ == "__main__":
+    from .database import engine
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    database = args[0] if args else engine.url.database
+    path = args[1] if len(args) > 1 else snapshot_path(database, settings)
+    print(export(database, path, settings, "--full" in sys.argv) or "unchanged")
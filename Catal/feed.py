@@ -0,0 +1,295 @@
+"""Лента изменений комиксов для витрин (SSE и WebSocket)
+
+Один фоновый опрос outbox на процесс читает события каталога, записанные триггерами
+(в том числе из других процессов), и раздаёт их подписчикам из памяти. У каждого
+подписчика ограниченный буфер: кто не успевает читать, отключается. Номер события -
+версия каталога; после переподключения лента продолжается с него, если событие ещё
+есть в истории процесса, иначе клиент получает reset и перечитывает /view/comics.
+"""
+import asyncio
+import json
+from collections import deque
+from fastapi import HTTPException
+from pydantic import BaseSettings
+from sqlalchemy import select, func, text
+from sqlalchemy.exc import SQLAlchemyError
+from .database import async_session
+from .events import settings as event_settings
+from .models import OutboxMessage
+
+class FeedSettings(BaseSettings):
+    """Настройки ленты (переменные окружения CATAL_FEED_*)"""
+    #Как часто читать outbox, если изменений в этом процессе не было, с
+    poll_interval: float = 0.2
+    batch_size: int = 500
+    #Сколько последних событий хранить для продолжения после переподключения
+    history: int = 10000
+    #Буфер подписчика: переполнился - подписчик отключается
+    buffer: int = 256
+    max_subscribers: int = 10000
+    #Пустое сообщение раз в heartbeat секунд, чтобы прокси не закрывали соединение
+    heartbeat: float = 15.0
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_FEED_"
+
+class Subscriber:
+    """Подписчик: фильтры, буфер событий и признак отключения"""
+
+    def __init__(self, titles: set, publishers: set, size: int, after: int = 0):
+        self.titles = titles
+        self.publishers = publishers
+        self.queue = deque()
+        self.size = size
+        #Номер последнего полученного события: процесс, к которому переподключились, мог ещё не дочитать до него
+        self.after = after
+        self.wakeup = asyncio.Event()
+        #Продолжить с запрошенного номера нельзя: клиент должен перечитать каталог
+        self.reset = False
+        self.dropped = False
+        #Клиент отключился сам
+        self.closed = False
+        self.delivered = 0
+
+    def matches(self, event: dict):
+        """Событие проходит фильтры: любое из названий и любое из издательств"""
+        if event["version"] <= self.after:
+            return False
+        if self.titles and event["title"] not in self.titles:
+            return False
+        return not self.publishers or (event.get("publisher") or "").strip().lower() in self.publishers
+
+    def push(self, event: dict):
+        """Событие в буфер; False, если буфер полон"""
+        if len(self.queue) >= self.size:
+            return False
+        self.queue.append(event)
+        self.wakeup.set()
+        return True
+
+    def close(self):
+        """Клиент отключился: ожидание next прерывается"""
+        self.closed = True
+        self.wakeup.set()
+
+    async def next(self, timeout: float):
+        """Накопившиеся события; пустой список, если за timeout ничего не пришло или подписчик отключён"""
+        if not self.queue and not self.dropped and not self.closed:
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        events = list(self.queue)
+        self.queue.clear()
+        self.delivered += len(events)
+        return events
+
+class FeedHub:
+    """Раздача событий каталога подписчикам процесса"""
+
+    def __init__(self, settings: FeedSettings, session_factory):
+        self.settings = settings
+        self.session_factory = session_factory
+        self.history = deque(maxlen=settings.history)
+        #События с версией больше floor все есть в history
+        self.floor = 0
+        self.epoch = None
+        self.seq = 0
+        self.last_id = 0
+        #Подписчики по первому фильтру: событие проверяется только у тех, кому оно может подойти
+        self.by_title = {}
+        self.by_publisher = {}
+        self.everything = set()
+        self.count = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.events = 0
+        self.dropped = 0
+        self.resets = 0
+
+    async def position(self):
+        """Эпоха, версия каталога и последний id outbox одной читающей транзакцией"""
+        async with self.session_factory() as db:
+            epoch, version = (await db.execute(text("SELECT epoch, version FROM catalog_version WHERE id = 1"))).one()
+            last_id = (await db.execute(select(func.max(OutboxMessage.id)))).scalar() or 0
+        return epoch, version, last_id
+
+    async def start(self):
+        """Лента начинается с текущей версии: старые события не раздаются"""
+        self.epoch, self.seq, self.last_id = await self.position()
+        self.floor = self.seq
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка опроса и отключение подписчиков"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for subscriber in self.subscribers():
+            self.drop(subscriber)
+
+    def wake(self):
+        """Каталог изменён в этом процессе: прочитать outbox без ожидания"""
+        self.wakeup.set()
+
+    async def poll(self):
+        """Новые события каталога по индексу (routing_key, id); возвращает их число"""
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(OutboxMessage.id, OutboxMessage.body)
+                .where(OutboxMessage.routing_key == event_settings.routing_key, OutboxMessage.id > self.last_id)
+                .order_by(OutboxMessage.id).limit(self.settings.batch_size))).all()
+        for row_id, body in rows:
+            self.last_id = row_id
+            event = json.loads(body)
+            if event.get("type") == "comic":
+                self.publish(event)
+        return len(rows)
+
+    async def run(self):
+        """Опрос outbox; полная пачка - сразу следующая"""
+        while True:
+            self.wakeup.clear()
+            try:
+                read = await self.poll()
+            except SQLAlchemyError:
+                read = 0
+            if read < self.settings.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.settings.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def publish(self, event: dict):
+        """Событие в историю и буферы подписчиков"""
+        if event["epoch"] != self.epoch:
+            #catal.db создан заново: прежние номера несравнимы, все начинают сначала
+            self.epoch, self.seq, self.floor = event["epoch"], 0, 0
+            self.history = deque(maxlen=self.settings.history)
+            for subscriber in self.subscribers():
+                self.drop(subscriber)
+        if event["version"] <= self.seq:
+            return
+        if len(self.history) == self.history.maxlen:
+            self.floor = self.history[0]["version"]
+        self.history.append(event)
+        self.seq = event["version"]
+        self.events += 1
+        for subscriber in self.candidates(event):
+            if subscriber.matches(event) and not subscriber.push(event):
+                self.drop(subscriber)
+
+    def candidates(self, event: dict):
+        """Подписчики, которым событие может подойти"""
+        found = set(self.everything)
+        found.update(self.by_title.get(event["title"], ()))
+        found.update(self.by_publisher.get((event.get("publisher") or "").strip().lower(), ()))
+        return found
+
+    def subscribers(self):
+        """Все подписчики"""
+        found = set(self.everything)
+        for group in (*self.by_title.values(), *self.by_publisher.values()):
+            found.update(group)
+        return found
+
+    def groups(self, subscriber: Subscriber):
+        """Наборы, в которые записан подписчик"""
+        if subscriber.titles:
+            return [self.by_title.setdefault(title, set()) for title in subscriber.titles]
+        if subscriber.publishers:
+            return [self.by_publisher.setdefault(name, set()) for name in subscriber.publishers]
+        return [self.everything]
+
+    def subscribe(self, titles: list, publishers: list, after: tuple | None):
+        """Новый подписчик; after - (эпоха, номер) последнего полученного события"""
+        if self.count >= self.settings.max_subscribers:
+            raise HTTPException(status_code=503,detail="Too many feed subscribers")
+        subscriber = Subscriber({title.strip() for title in titles}, {name.strip().lower() for name in publishers},
+                                self.settings.buffer)
+        if after is not None:
+            epoch, seq = after
+            if epoch != self.epoch or seq < self.floor:
+                subscriber.reset = True
+            else:
+                subscriber.after = seq
+                for event in self.history:
+                    if subscriber.matches(event) and not subscriber.push(event):
+                        #Пропущено больше, чем помещается в буфер: дешевле перечитать каталог
+                        subscriber.queue.clear()
+                        subscriber.reset = True
+                        subscriber.after = 0
+                        break
+            self.resets += subscriber.reset
+        for group in self.groups(subscriber):
+            group.add(subscriber)
+        self.count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """Отписка (отключение клиента или медленного подписчика)"""
+        removed = False
+        for group in self.groups(subscriber):
+            if subscriber in group:
+                group.discard(subscriber)
+                removed = True
+        if removed:
+            self.count -= 1
+        for index in (self.by_title, self.by_publisher):
+            for key in [key for key, group in index.items() if not group]:
+                del index[key]
+
+    def drop(self, subscriber: Subscriber):
+        """Отключение подписчика, не успевающего читать"""
+        subscriber.dropped = True
+        subscriber.wakeup.set()
+        self.unsubscribe(subscriber)
+        self.dropped += 1
+
+    def event_id(self, event: dict):
+        """Номер события для Last-Event-ID"""
+        return f"{event['epoch']}:{event['version']}"
+
+    def parse_id(self, value: str | None):
+        """(эпоха, номер) из Last-Event-ID или after; номер без эпохи - в текущей эпохе"""
+        if not value:
+            return None
+        epoch, _, seq = value.rpartition(":")
+        try:
+            return epoch or self.epoch, int(seq)
+        except ValueError:
+            raise HTTPException(status_code=400,detail="Bad event id")
+
+    def stats(self):
+        """Счётчики ленты"""
+        return {"subscribers": self.count, "epoch": self.epoch, "seq": self.seq, "floor": self.floor,
+                "history": len(self.history), "events": self.events, "dropped": self.dropped, "resets": self.resets}
+
+def sse(event: str, data: dict, event_id: str | None = None):
+    """Одно сообщение Server-Sent Events"""
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def sse_stream(hub: FeedHub, subscriber: Subscriber):
+    """Поток SSE подписчика; отписка при отключении клиента"""
+    try:
+        if subscriber.reset:
+            yield sse("reset", {"epoch": hub.epoch, "seq": hub.seq}, f"{hub.epoch}:{hub.seq}")
+        while True:
+            events = await subscriber.next(hub.settings.heartbeat)
+            for event in events:
+                yield sse("comic", event, hub.event_id(event))
+            if subscriber.dropped:
+                yield sse("dropped", {"reason": "slow consumer"})
+                return
+            if not events:
+                yield ": ping\n\n"
+    finally:
+        hub.unsubscribe(subscriber)
+
+settings = FeedSettings()
+hub = FeedHub(settings, async_session)
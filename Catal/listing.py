@@ -0,0 +1,76 @@
+"""Постраничная выдача каталога (keyset по id) и потоковая выгрузка в NDJSON"""
+import json
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from common.pagination import encode_cursor, decode_cursor
+from .database import async_session
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 10000
+#Сколько строк за раз забирать из курсора при потоковой выгрузке
+STREAM_CHUNK = 1000
+
+def dumps(payload):
+    """JSON в байтах: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(payload, option = orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii = False, separators = (",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    """Ответ JSON через dumps; уже готовые байты отдаются как есть"""
+
+    def render(self, content):
+        return content if isinstance(content, bytes) else dumps(content)
+
+def parse_sort(sort: str, columns: dict):
+    """Сортировка вида "price" или "-price" по одному из разрешённых столбцов"""
+    desc = sort.startswith("-")
+    column = columns.get(sort.lstrip("-"))
+    if column is None:
+        raise HTTPException(status_code=400,detail="Bad sort")
+    return column, desc
+
+def keyset(stmt, column, id_column, desc: bool, cursor: str | None):
+    """Добавление условия "после курсора" и порядка (column, id) к запросу"""
+    keys = [id_column] if column is id_column else [column, id_column]
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise HTTPException(status_code=400,detail="Bad cursor")
+        left = keys[0] if len(keys) == 1 else tuple_(*keys)
+        right = values[0] if len(keys) == 1 else tuple_(*values)
+        stmt = stmt.where(left < right if desc else left > right)
+    return stmt.order_by(*[key.desc() if desc else key.asc() for key in keys])
+
+def rows_to_dicts(keys: list, rows):
+    """Строки выборки столбцов в словари"""
+    return [dict(zip(keys, row)) for row in rows]
+
+async def fetch_page(stmt, column, id_column, limit: int, db: AsyncSession):
+    """Страница результатов и курсор на следующую"""
+    result = await db.execute(stmt.limit(limit + 1))
+    keys = list(result.keys())
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        sort_keys = [id_column] if column is id_column else [column, id_column]
+        next_cursor = encode_cursor([getattr(last, key.key) for key in sort_keys])
+    return {"items": rows_to_dicts(keys, rows), "next_cursor": next_cursor}
+
+def stream_ndjson(stmt):
+    """Выгрузка всех строк запроса в NDJSON через серверный курсор"""
+    async def rows():
+        async with async_session() as db:
+            result = await db.stream(stmt.execution_options(yield_per = STREAM_CHUNK))
+            keys = list(result.keys())
+            async for partition in result.partitions():
+                yield b"".join(dumps(row) + b"\n" for row in rows_to_dicts(keys, partition))
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
@@ -1,28 +1,38 @@
 """Добавление комикса, сценариста, художника и издательства"""
 import re
-from pika import ConnectionParameters, BlockingConnection
-from fastapi import FastAPI, HTTPException, Depends, Body
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from fastapi_jwt_auth import AuthJWT
-from database import engine, Base, async_session
-from models import Comic, Writer, Publisher, Artist
-
-#Название комикса от 1 до 100 символов, также цифры и спец. символы
-REG_COMIC = "^[A-Za-z0-9\\s\\-_,\\.:;()''""#]+$"
-#ФИО сценариста или художника
-REG_NAME = "^([a-zA-Z]{2,}\\s[a-zA-Z]{1,}\\'?-?[a-zA-Z]{2,}\\s?([a-zA-Z]{1,})?)"
-#Название издателя
-REG_PUB = "^[A-Za-z0-9\\s\\-_,\\.:;()''""!]+$"
-CONNECTION_PARAMS = ConnectionParameters(host="localhost")
-app = FastAPI()
-
-class Settings(BaseModel):
-    """Настройки для проверки JWT токена"""
-    authjwt_secret_key: str = "secret"
-    authjwt_token_location: set = {"cookies"}
-    authjwt_cookie_csrf_protect: bool = False
+from common.jwt import Claims, configure as configure_jwt, current_user, verifier
+from .database import engine, async_session, init_db
+from .migrations import migrate
+from .models import Comic, Writer, Publisher, Artist, normalized, name_key
+from .validation import REG_COMIC, REG_NAME, REG_PUB
+from .bulk import parse_body, import_comics
+from .cascade import check_names, delete_by_names, delete_comics
+from .broker import publisher
+from .outbox import enqueue, relay
+from .cache import catalog_cache, etag_matches, install as install_cache_version
+from .events import install as install_events
+from .checkout import checkout_consumer, settings as checkout_settings
+from .feed import hub, sse_stream
+from .export import SnapshotExporter, settings as snapshot_settings
+from common.metrics import Registry, install as install_metrics
+from common.admission import admission, require_admin, install as install_admission
+from .purchase import CartMod, OutOfStock, reserve_stock, order_message
+from .search import KINDS, install as install_search, search
+from . import stats
+from .listing import DEFAULT_LIMIT, MAX_LIMIT, FastJSONResponse, dumps, parse_sort, keyset, fetch_page, stream_ndjson
+from .schemas import ComicOut, ComicPage, NamePage, comic_select, name_select, id_by_name, doc
+
+#Допустимые сортировки списка комиксов
+COMIC_SORTS = {"id": Comic.id, "title": Comic.title, "price": Comic.price, "amount": Comic.amount}
 
 class ComicMod(BaseModel):
     """Класс комикса"""
@@ -45,10 +55,73 @@ class ArtistMod(BaseModel):
     """Класс художника"""
     name: str
 
+async def init_schema():
+    """Таблицы, миграции, поисковый индекс, счётчики и версия каталога (повторный вызов ничего не меняет)"""
+    await init_db()
+    await asyncio.to_thread(migrate, engine.url.database)
+    async with engine.begin() as conn:
+        await conn.run_sync(install_search)
+        await conn.run_sync(stats.install)
+        await conn.run_sync(install_cache_version)
+        await conn.run_sync(install_events)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создание схемы при запуске и закрытие пула соединений при остановке"""
+    await init_schema()
+    await verifier.start()
+    await admission.start()
+    await publisher.start()
+    await relay.start()
+    await hub.start()
+    await exporter.start()
+    if checkout_settings.run_in_app:
+        await checkout_consumer.start()
+    yield
+    await checkout_consumer.stop()
+    await exporter.stop()
+    await hub.stop()
+    await relay.stop()
+    await publisher.stop()
+    await admission.stop()
+    await verifier.stop()
+    await engine.dispose()
+
+#Метрики сервиса с меткой service="catal"
+registry = Registry("catal")
+app = FastAPI(lifespan = lifespan, default_response_class = FastJSONResponse)
+exporter = SnapshotExporter(snapshot_settings, engine.url.database)
+#Прослойка метрик снаружи: отклонённые запросы тоже учитываются
+install_admission(app, {"/buy": "buy", "/create/": "create"})
+install_metrics(app, engine, registry)
+configure_jwt()
+registry.callback("broker_published_total", "Messages confirmed by the broker", lambda: publisher.published, "counter")
+registry.callback("broker_publish_failed_total", "Messages not published", lambda: publisher.failed, "counter")
+registry.callback("broker_publish_batches_total", "Publish batches", lambda: publisher.batches, "counter")
+registry.callback("broker_reconnects_total", "Broker reconnects", lambda: publisher.reconnects, "counter")
+registry.callback("broker_publish_pending", "Messages waiting to be published", lambda: publisher.stats()["pending"])
+registry.callback("outbox_relayed_total", "Outbox messages delivered to the broker", lambda: relay.relayed, "counter")
+registry.callback("outbox_failed_total", "Outbox delivery attempts that failed", lambda: relay.failed, "counter")
+registry.callback("outbox_parked_total", "Outbox messages parked after max_attempts", lambda: relay.parked, "counter")
+registry.callback("outbox_pruned_total", "Delivered outbox rows removed", lambda: relay.pruned, "counter")
+registry.callback("catalog_cache_hits_total", "Catalog cache hits", lambda: catalog_cache.hits, "counter")
+registry.callback("catalog_cache_misses_total", "Catalog cache misses", lambda: catalog_cache.misses, "counter")
+registry.callback("catalog_cache_evictions_total", "Catalog cache evictions", lambda: catalog_cache.evictions, "counter")
+registry.callback("catalog_cache_entries", "Catalog cache entries", lambda: len(catalog_cache.entries))
+
+registry.callback("feed_subscribers", "Live feed subscribers", lambda: hub.count)
+registry.callback("feed_events_total", "Catalog events fanned out", lambda: hub.events, "counter")
+registry.callback("feed_dropped_total", "Slow feed subscribers dropped", lambda: hub.dropped, "counter")
+registry.callback("snapshot_builds_total", "Catalog snapshots written", lambda: exporter.builds, "counter")
+
+def catalog_changed():
+    """Каталог изменён: сброс кэша, отправка событий из outbox и лента без ожидания опроса"""
+    catalog_cache.bump()
+    relay.wake()
+    hub.wake()
+
 async def get_db():
     """Использование базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
     db = async_session()
     try:
         yield db
@@ -100,7 +173,11 @@ async def create_publisher(pub: PublisherMod, db: AsyncSession):
         raise HTTPException(status_code=409,detail="Publisher already exists")
     pub_db = Publisher(name = pub.name)
     db.add(pub_db)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409,detail="Publisher already exists")
     await db.refresh(pub_db)
     return pub_db
 
@@ -113,7 +190,11 @@ async def create_writer(writ: WriterMod, db: AsyncSession):
         raise HTTPException(status_code=409,detail="Writer already exists")
     writ_db = Writer(name = writ.name)
     db.add(writ_db)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409,detail="Writer already exists")
     await db.refresh(writ_db)
     return writ_db
 
@@ -126,7 +207,11 @@ async def create_artist(art: ArtistMod, db: AsyncSession):
         raise HTTPException(status_code=409,detail="Artist already exists")
     art_db = Artist(name = art.name)
     db.add(art_db)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409,detail="Artist already exists")
     await db.refresh(art_db)
     return art_db
 
@@ -138,38 +223,19 @@ async def get_comic_by_title(title: str, db: AsyncSession):
 
 async def get_writer_by_name(name: str, db: AsyncSession):
     """Получение сценариста"""
-    name = name.strip()
-    name_db = await db.execute(select(Writer).where(Writer.name == name))
+    name_db = await db.execute(select(Writer).where(normalized(Writer.name) == name_key(name)))
     return name_db.scalars().first()
 
 async def get_artist_by_name(name: str, db: AsyncSession):
     """Получение художника"""
-    name = name.strip()
-    name_db = await db.execute(select(Artist).where(Artist.name == name))
+    name_db = await db.execute(select(Artist).where(normalized(Artist.name) == name_key(name)))
     return name_db.scalars().first()
 
 async def get_publisher_by_name(name: str, db: AsyncSession):
     """Получение издателя"""
-    name = name.strip()
-    name_db = await db.execute(select(Publisher).where(Publisher.name == name))
+    name_db = await db.execute(select(Publisher).where(normalized(Publisher.name) == name_key(name)))
     return name_db.scalars().first()
 
-async def producer():
-    with BlockingConnection(CONNECTION_PARAMS) as conn:
-        with conn.channel() as ch:
-            ch.queue_declare(queue="comics")
-            ch.basic_publish(
-                exchange = "",
-                routing_key = "comics",
-                body = "Hello"
-            )
-            print("Message sent")
-
-@AuthJWT.load_config
-def get_config():
-    """Установка настроек токена"""
-    return Settings()
-
 #async def get_jwt_token_role(access_token_cookie: str | None = Cookie(default=None), authorize: AuthJWT = Depends()):
     """Роль пользователя"""
     #return authorize.get_raw_jwt(access_token_cookie)["role"]
@@ -181,7 +247,20 @@ async def new_comic(comic: ComicMod, db: AsyncSession = Depends(get_db)):
         #return HTTPException(status_code=403,detail="Permission denied")
     if await get_comic_by_title(comic.title, db):
         return HTTPException(status_code=409,detail="Comic already exists")
-    return await create_comic(comic,db)
+    result = await create_comic(comic,db)
+    catalog_changed()
+    return result
+
+@app.post("/create/comics/bulk")
+async def new_comics_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    """Массовое создание комиксов из JSON-массива или NDJSON"""
+    #if await get_jwt_token_role() != "admin":
+        #return HTTPException(status_code=403,detail="Permission denied")
+    rows = parse_body(await request.body(), request.headers.get("content-type", ""))
+    result = await import_comics(rows, db)
+    if result["created"]:
+        catalog_changed()
+    return result
 
 @app.post("/create/writer")
 async def new_writer(writer: WriterMod, db: AsyncSession = Depends(get_db)):
@@ -190,7 +269,9 @@ async def new_writer(writer: WriterMod, db: AsyncSession = Depends(get_db)):
         #return HTTPException(status_code=403,detail="Permission denied")
     if await get_writer_by_name(writer.name, db):
         return HTTPException(status_code=409,detail="Writer already exists")
-    return await create_writer(writer, db)
+    result = await create_writer(writer, db)
+    catalog_changed()
+    return result
 
 @app.post("/create/artist")
 async def new_artist(artist: ArtistMod, db: AsyncSession = Depends(get_db)):
@@ -199,7 +280,9 @@ async def new_artist(artist: ArtistMod, db: AsyncSession = Depends(get_db)):
         #return HTTPException(status_code=403,detail="Permission denied")
     if await get_artist_by_name(artist.name, db):
         return HTTPException(status_code=409,detail="Artist already exists")
-    return await create_artist(artist, db)
+    result = await create_artist(artist, db)
+    catalog_changed()
+    return result
 
 @app.post("/create/pub")
 async def new_pub(pub: PublisherMod, db: AsyncSession = Depends(get_db)):
@@ -208,103 +291,344 @@ async def new_pub(pub: PublisherMod, db: AsyncSession = Depends(get_db)):
         #return HTTPException(status_code=403,detail="Permission denied")
     if await get_publisher_by_name(pub.name, db):
         return HTTPException(status_code=409,detail="Publisher already exists")
-    return await create_publisher(pub, db)
-
-@app.get("/view/comics")
-async def view_comics(db: AsyncSession = Depends(get_db)):
-    """JSON всех комиксов"""
-    comics = await db.execute(select(Comic))
-    return comics.scalars().all()
-
-@app.get("/view/publishers")
-async def view_pubs(db: AsyncSession = Depends(get_db)):
-    """JSON всех издательств"""
-    pubs = await db.execute(select(Publisher))
-    return pubs.scalars().all()
-
-@app.get("/view/writers")
-async def view_writers(db: AsyncSession = Depends(get_db)):
-    """JSON всех сценаристов"""
-    writers = await db.execute(select(Writer))
-    return writers.scalars().all()
-
-@app.get("/view/artists")
-async def view_artists(db: AsyncSession = Depends(get_db)):
-    """JSON всех художников"""
-    artists = await db.execute(select(Artist))
-    return artists.scalars().all()
+    result = await create_publisher(pub, db)
+    catalog_changed()
+    return result
+
+async def cached_view(request: Request, build, db: AsyncSession):
+    """Ответ из кэша каталога с ETag; 304, если у клиента актуальная версия"""
+    await catalog_cache.refresh(db)
+    version = catalog_cache.version
+    etag = catalog_cache.etag(version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    #В кэше лежат уже сериализованные байты
+    payload = catalog_cache.get(key)
+    if payload is None:
+        payload = dumps(await build())
+        catalog_cache.put(key, payload, version)
+    return FastJSONResponse(payload, headers={"ETag": etag})
+
+async def view_page(request: Request, stmt, column, id_column, desc, cursor, limit, format, db: AsyncSession):
+    """Общая часть /view/*: страница JSON или полная выгрузка NDJSON"""
+    if format == "ndjson":
+        return stream_ndjson(keyset(stmt, column, id_column, desc, cursor))
+    if format != "json":
+        raise HTTPException(status_code=400,detail="Bad format")
+    return await cached_view(request, lambda: fetch_page(keyset(stmt, column, id_column, desc, cursor),
+                                                         column, id_column, limit, db), db)
+
+@app.get("/view/comic", responses=doc(ComicOut))
+async def view_comic(request: Request, title: str, embed: bool = False, db: AsyncSession = Depends(get_db)):
+    """JSON одного комикса по названию"""
+    async def build():
+        comic = (await db.execute(comic_select(embed).where(Comic.title == title.strip()))).mappings().first()
+        if not comic:
+            raise HTTPException(status_code=404,detail="Title not found")
+        return dict(comic)
+    return await cached_view(request, build, db)
+
+@app.get("/search")
+async def search_catalog(request: Request, q: str, kind: str | None = None,
+                         limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                         facets: bool = False, db: AsyncSession = Depends(get_db)):
+    """Поиск по комиксам, издателям, сценаристам и художникам с автодополнением"""
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=400,detail="Bad kind")
+    return await cached_view(request, lambda: search(q, kind, limit, offset, facets, db), db)
+
+@app.get("/broker/stats")
+async def broker_stats():
+    """Счётчики отправки сообщений"""
+    return publisher.stats()
+
+@app.get("/outbox/stats")
+async def outbox_stats():
+    """Счётчики отправки из outbox и число неотправленных сообщений"""
+    return await relay.stats()
+
+@app.post("/outbox/unpark")
+async def outbox_unpark(user: Claims = Depends(require_admin)):
+    """Возврат отложенных сообщений outbox в очередь отправки"""
+    return {"unparked": await relay.unpark()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Счётчики кэша каталога"""
+    return catalog_cache.stats()
+
+@app.get("/checkout/stats")
+async def checkout_stats():
+    """Счётчики получателя корзин из Basket"""
+    return checkout_consumer.stats()
+
+@app.get("/feed/comics")
+async def feed_comics(request: Request, title: list[str] = Query([]), publisher: list[str] = Query([]),
+                      after: str | None = None):
+    """Лента изменений комиксов (SSE); продолжение - заголовок Last-Event-ID или after"""
+    subscriber = hub.subscribe(title, publisher, hub.parse_id(request.headers.get("last-event-id") or after))
+    return StreamingResponse(sse_stream(hub, subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/feed/comics/ws")
+async def feed_comics_ws(websocket: WebSocket, title: list[str] = Query([]), publisher: list[str] = Query([]),
+                         after: str | None = None):
+    """Та же лента через WebSocket: JSON-сообщения с полями event, id, data"""
+    try:
+        subscriber = hub.subscribe(title, publisher, hub.parse_id(after))
+    except HTTPException:
+        await websocket.close(code=1013)
+        return
+    async def watch_disconnect():
+        """Входящие сообщения не нужны, но только из них видно отключение клиента"""
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        subscriber.close()
+    watcher = None
+    try:
+        await websocket.accept()
+        watcher = asyncio.create_task(watch_disconnect())
+        if subscriber.reset:
+            await websocket.send_json({"event": "reset", "id": f"{hub.epoch}:{hub.seq}"})
+        while True:
+            events = await subscriber.next(hub.settings.heartbeat)
+            if subscriber.closed:
+                return
+            for event in events:
+                await websocket.send_json({"event": "comic", "id": hub.event_id(event), "data": event})
+            if subscriber.dropped:
+                await websocket.send_json({"event": "dropped", "reason": "slow consumer"})
+                await websocket.close(code=1013)
+                return
+            if not events:
+                await websocket.send_json({"event": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        hub.unsubscribe(subscriber)
+
+@app.get("/feed/stats")
+async def feed_stats():
+    """Подписчики и события ленты в этом процессе"""
+    return hub.stats()
+
+@app.get("/snapshot/stats")
+async def snapshot_stats():
+    """Счётчики выгрузки снимка для реплик"""
+    return exporter.stats()
+
+@app.post("/snapshot/export")
+async def snapshot_export(full: bool = False, user: Claims = Depends(require_admin)):
+    """Выгрузка снимка сейчас; full - без использования предыдущего файла"""
+    result = await exporter.export(full)
+    return result or {"msg":"Snapshot is up to date or being written by another process"}
+
+@app.get("/catalog/version")
+async def catalog_version(db: AsyncSession = Depends(get_db)):
+    """Эпоха и версия каталога: с них Basket начинает применять события после полной выгрузки"""
+    await catalog_cache.refresh(db, force = True)
+    return {"epoch": catalog_cache.epoch, "version": catalog_cache.version}
+
+@app.get("/view/comics", responses=doc(ComicPage))
+async def view_comics(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                      publisher: str | None = None, writer: str | None = None, artist: str | None = None,
+                      min_price: float | None = None, max_price: float | None = None,
+                      in_stock: bool | None = None, sort: str = "id", format: str = "json", embed: bool = False,
+                      db: AsyncSession = Depends(get_db)):
+    """JSON комиксов постранично, с фильтрами и сортировкой, либо выгрузка в NDJSON"""
+    column, desc = parse_sort(sort, COMIC_SORTS)
+    stmt = comic_select(embed)
+    if publisher is not None:
+        stmt = stmt.where(Comic.publisher_id == id_by_name(Publisher, publisher))
+    if writer is not None:
+        stmt = stmt.where(Comic.writer_id == id_by_name(Writer, writer))
+    if artist is not None:
+        stmt = stmt.where(Comic.artist_id == id_by_name(Artist, artist))
+    if min_price is not None:
+        stmt = stmt.where(Comic.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(Comic.price <= max_price)
+    if in_stock is not None:
+        stmt = stmt.where(Comic.amount > 0 if in_stock else Comic.amount <= 0)
+    return await view_page(request, stmt, column, Comic.id, desc, cursor, limit, format, db)
+
+@app.get("/view/publishers", responses=doc(NamePage))
+async def view_pubs(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                    name: str | None = None, sort: str = "id", format: str = "json",
+                    db: AsyncSession = Depends(get_db)):
+    """JSON издательств постранично"""
+    column, desc = parse_sort(sort, {"id": Publisher.id, "name": Publisher.name})
+    stmt = name_select(Publisher)
+    if name is not None:
+        stmt = stmt.where(Publisher.name.startswith(name.strip(), autoescape = True))
+    return await view_page(request, stmt, column, Publisher.id, desc, cursor, limit, format, db)
+
+@app.get("/view/writers", responses=doc(NamePage))
+async def view_writers(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                       name: str | None = None, sort: str = "id", format: str = "json",
+                       db: AsyncSession = Depends(get_db)):
+    """JSON сценаристов постранично"""
+    column, desc = parse_sort(sort, {"id": Writer.id, "name": Writer.name})
+    stmt = name_select(Writer)
+    if name is not None:
+        stmt = stmt.where(Writer.name.startswith(name.strip(), autoescape = True))
+    return await view_page(request, stmt, column, Writer.id, desc, cursor, limit, format, db)
+
+@app.get("/view/artists", responses=doc(NamePage))
+async def view_artists(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                       name: str | None = None, sort: str = "id", format: str = "json",
+                       db: AsyncSession = Depends(get_db)):
+    """JSON художников постранично"""
+    column, desc = parse_sort(sort, {"id": Artist.id, "name": Artist.name})
+    stmt = name_select(Artist)
+    if name is not None:
+        stmt = stmt.where(Artist.name.startswith(name.strip(), autoescape = True))
+    return await view_page(request, stmt, column, Artist.id, desc, cursor, limit, format, db)
+
+#Списки статистики: путь -> вид сущности и модель
+STATS_ENTITIES = {"publishers": ("publisher", Publisher), "writers": ("writer", Writer), "artists": ("artist", Artist)}
+
+@app.get("/stats")
+async def view_stats(request: Request, db: AsyncSession = Depends(get_db)):
+    """Итоги каталога: число комиксов, остаток, стоимость остатка, число сущностей"""
+    return await cached_view(request, lambda: stats.totals(db), db)
+
+@app.get("/stats/check")
+async def check_stats(db: AsyncSession = Depends(get_db), user: Claims = Depends(require_admin)):
+    """Сверка счётчиков с пересчётом по comics (полный проход по таблице)"""
+    connection = await db.connection()
+    mismatches = await connection.run_sync(stats.check)
+    return {"ok": not mismatches, "mismatches": mismatches}
+
+@app.post("/stats/rebuild")
+async def rebuild_stats(db: AsyncSession = Depends(get_db), user: Claims = Depends(require_admin)):
+    """Полный пересчёт счётчиков"""
+    connection = await db.connection()
+    await connection.run_sync(stats.rebuild)
+    await db.commit()
+    catalog_changed()
+    return {"msg":"Successfully rebuilt stats"}
+
+@app.get("/stats/{plural}")
+async def view_entity_stats(request: Request, plural: str, name: str | None = None,
+                            limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                            sort: str = "-value", db: AsyncSession = Depends(get_db)):
+    """Счётчики одной сущности по имени или список сущностей с комиксами, отсортированный по счётчику"""
+    if plural not in STATS_ENTITIES:
+        raise HTTPException(status_code=404,detail="Not found")
+    kind, model = STATS_ENTITIES[plural]
+    if name is not None:
+        async def build():
+            found = await db.execute(select(model.id).where(normalized(model.name) == name_key(name)))
+            entity_id = found.scalar()
+            if entity_id is None:
+                raise HTTPException(status_code=404,detail="Name not found")
+            return await stats.entity(kind, model, entity_id, db)
+        return await cached_view(request, build, db)
+    column, desc = parse_sort(sort, {"id": model.id, **{field: stats.entity_stats.c[field] for field in stats.COUNTERS}})
+    return await view_page(request, stats.entity_select(kind, model), column, model.id, desc, cursor, limit, "json", db)
 
 @app.delete("/delete/comic")
 async def delete_comic_by_title(title = Body(), db: AsyncSession = Depends(get_db)):
     """Удаление комикса"""
     #if await get_jwt_token_role() != "admin":
         #return HTTPException(status_code=403,detail="Permission denied")
-    comic = await get_comic_by_title(title=title["title"], db = db)
-    if not comic:
+    result = await delete_comics([title["title"]], db)
+    if result["not_found"]:
         return HTTPException(status_code=404,detail="Title not found")
-    db.delete(comic)
-    await db.commit()
-    return {"msg":"Successfully deleted comic"}
+    catalog_changed()
+    return {"msg":"Successfully deleted comic", "deleted": result["deleted"]}
+
+@app.delete("/delete/comics")
+async def delete_comics_by_titles(data = Body(), db: AsyncSession = Depends(get_db)):
+    """Удаление списка комиксов: {"titles": [...]}"""
+    result = await delete_comics(check_names(data.get("titles"), "titles"), db)
+    if result["deleted"]["comics"]:
+        catalog_changed()
+    return result
+
+async def delete_one(kind: str, name: str, db: AsyncSession):
+    """Удаление одной записи с её комиксами; 404, если имени нет"""
+    result = await delete_by_names(kind, [name], db)
+    if result["not_found"]:
+        raise HTTPException(status_code=404,detail="Name not found")
+    catalog_changed()
+    return {"msg":f"Successfully deleted {kind}", "deleted": result["deleted"]}
+
+async def delete_many(kind: str, data: dict, db: AsyncSession):
+    """Удаление списка записей с их комиксами: {"names": [...]}"""
+    result = await delete_by_names(kind, check_names(data.get("names"), "names"), db)
+    if any(result["deleted"].values()):
+        catalog_changed()
+    return result
 
 @app.delete("/delete/publisher")
 async def delete_pub_by_name(name = Body(), db: AsyncSession = Depends(get_db)):
     """Удаление издателя"""
     #if await get_jwt_token_role() != "admin":
         #return HTTPException(status_code=403,detail="Permission denied")
-    pub = await get_publisher_by_name(name=name["name"], db = db)
-    if not pub:
-        return HTTPException(status_code=404,detail="Name not found")
-    db.delete(pub)
-    await db.commit()
-    return {"msg":"Successfully deleted publisher"}
+    return await delete_one("publisher", name["name"], db)
+
+@app.delete("/delete/publishers")
+async def delete_pubs_by_names(data = Body(), db: AsyncSession = Depends(get_db)):
+    """Удаление списка издателей"""
+    return await delete_many("publisher", data, db)
 
 @app.delete("/delete/writer")
 async def delete_writer_by_name(name = Body(), db: AsyncSession = Depends(get_db)):
     """Удаление сценариста"""
     #if await get_jwt_token_role() != "admin":
         #return HTTPException(status_code=403,detail="Permission denied")
-    writer = await get_writer_by_name(name=name["name"], db = db)
-    if not writer:
-        return HTTPException(status_code=404,detail="Name not found")
-    db.delete(writer)
-    await db.commit()
-    return {"msg":"Successfully deleted writer"}
+    return await delete_one("writer", name["name"], db)
+
+@app.delete("/delete/writers")
+async def delete_writers_by_names(data = Body(), db: AsyncSession = Depends(get_db)):
+    """Удаление списка сценаристов"""
+    return await delete_many("writer", data, db)
 
 @app.delete("/delete/artist")
 async def delete_artist_by_name(name = Body(), db: AsyncSession = Depends(get_db)):
     """Удаление художника"""
     #if await get_jwt_token_role() != "admin":
         #return HTTPException(status_code=403,detail="Permission denied")
-    artist = await get_artist_by_name(name=name["name"], db = db)
-    if not artist:
-        return HTTPException(status_code=404,detail="Name not found")
-    db.delete(artist)
-    await db.commit()
-    return {"msg":"Successfully deleted artist"}
+    return await delete_one("artist", name["name"], db)
+
+@app.delete("/delete/artists")
+async def delete_artists_by_names(data = Body(), db: AsyncSession = Depends(get_db)):
+    """Удаление списка художников"""
+    return await delete_many("artist", data, db)
 
 @app.patch("/patch/comicamount")
 async def update_comic_amount(data = Body(), db: AsyncSession = Depends(get_db)):
-    """Удаление комикса"""
+    """Изменение количества комикса"""
     #if await get_jwt_token_role() != "admin":
         #return HTTPException(status_code=403,detail="Permission denied")
-    title = data["title"]
-    amount = data["amount"]
-    comic = await get_comic_by_title(title=title, db = db)
-    if not comic:
-        return HTTPException(status_code=404,detail="Title not found")
-    comic.amount = amount
+    title = data["title"].strip()
+    amount = str(data["amount"])
+    if not amount.isnumeric():
+        raise HTTPException(status_code=400,detail="Bad amount")
+    result = await db.execute(update(Comic).where(Comic.title == title).values(amount = int(amount))
+                              .execution_options(synchronize_session = False))
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404,detail="Title not found")
     await db.commit()
+    catalog_changed()
     return {"msg":"Successfully changed amount"}
 
 @app.post("/buy")
-async def buy_comic(data: str = Body(), db: AsyncSession = Depends(get_db)):
-    """Покупка комикса"""
-    await producer()
-    """comics = list(data)
-    comics_for_buy = []
-    for comic in comics:
-        comic_buy = await get_comic_by_title(comic.title, db)
-        if not await comic_buy:
-            return HTTPException(status_code=404,detail="Comic not found")
-        comics_for_buy.append(comic_buy)
-    return await create_comic(comic,db)"""
+async def buy_comic(cart: CartMod, db: AsyncSession = Depends(get_db), user: Claims = Depends(current_user)):
+    """Покупка комиксов: списание всей корзины одной транзакцией и одно сообщение о заказе"""
+    email = user.subject
+    try:
+        reserved = await reserve_stock(cart.items, db)
+    except OutOfStock as e:
+        raise HTTPException(status_code=409,detail={"msg": "Not enough comics", "shortages": e.shortages})
+    order = order_message(email, reserved)
+    #Заказ уходит в брокер фоном из outbox, записанного в той же транзакции
+    await enqueue(db, order)
+    await db.commit()
+    catalog_changed()
+    return {"msg":"Successfully bought", "order": order}
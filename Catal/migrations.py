@@ -0,0 +1,112 @@
+"""Миграции схемы catal.db
+
+Запуск вручную из корня репозитория:
+    python -m Catal.migrations [путь к БД] [--status | --check]
+"""
+import sys
+from common.migrations import Migration, add_column, migrate as run, main as run_main
+from .cache import COMIC_TRIGGERS
+from .events import TRIGGERS
+from .search import configure_rank
+
+def dedupe_names(table: str, column: str):
+    """Слияние имён, совпадающих без учёта регистра и пробелов: комиксы переходят к меньшему id"""
+    return [
+        "DROP TABLE IF EXISTS temp.name_dups",
+        f"CREATE TEMP TABLE name_dups AS SELECT id, keep FROM "
+        f"(SELECT id, min(id) OVER (PARTITION BY lower(trim(name))) AS keep FROM {table}) WHERE id != keep",
+        f"UPDATE comics SET {column} = (SELECT keep FROM name_dups WHERE name_dups.id = comics.{column}) "
+        f"WHERE {column} IN (SELECT id FROM name_dups)",
+        f"DELETE FROM {table} WHERE id IN (SELECT id FROM name_dups)",
+        "DROP TABLE temp.name_dups",
+        f"UPDATE {table} SET name = trim(name) WHERE name != trim(name)",
+        f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_name_norm ON {table} (lower(trim(name)))",
+    ]
+
+def new_epoch(conn):
+    """Новая эпоха каталога: снимки и получатели событий перестают доверять прежней истории outbox"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_version'").fetchone():
+        conn.execute("UPDATE catalog_version SET epoch = lower(hex(randomblob(4))) WHERE id = 1")
+
+MIGRATIONS = [
+    Migration(1, "Уникальные нормализованные имена, индексы внешних ключей и цены",
+              dedupe_names("publishers", "publisher_id") + dedupe_names("writers", "writer_id")
+              + dedupe_names("artists", "artist_id") + [
+                  "CREATE INDEX IF NOT EXISTS ix_comics_publisher_id ON comics (publisher_id, id)",
+                  "CREATE INDEX IF NOT EXISTS ix_comics_writer_id ON comics (writer_id, id)",
+                  "CREATE INDEX IF NOT EXISTS ix_comics_artist_id ON comics (artist_id, id)",
+                  "CREATE INDEX IF NOT EXISTS ix_comics_price ON comics (price, id)",
+              ],
+              [
+                  ("SELECT id, name FROM publishers WHERE lower(trim(name)) = ?", ("marvel",),
+                   ("uq_publishers_name_norm",)),
+                  ("SELECT id, name FROM writers WHERE lower(trim(name)) = ?", ("stan lee",),
+                   ("uq_writers_name_norm",)),
+                  ("SELECT id, name FROM artists WHERE lower(trim(name)) = ?", ("jack kirby",),
+                   ("uq_artists_name_norm",)),
+                  ("SELECT * FROM comics WHERE publisher_id = (SELECT id FROM publishers WHERE lower(trim(name)) = ?) "
+                   "AND id > ? ORDER BY id LIMIT ?", ("marvel", 0, 50),
+                   ("ix_comics_publisher_id", "uq_publishers_name_norm")),
+                  ("SELECT * FROM comics WHERE writer_id = ? ORDER BY id LIMIT ?", (1, 50), ("ix_comics_writer_id",)),
+                  ("SELECT * FROM comics WHERE artist_id = ? ORDER BY id LIMIT ?", (1, 50), ("ix_comics_artist_id",)),
+                  ("SELECT * FROM comics WHERE (price, id) > (?, ?) ORDER BY price, id LIMIT ?", (10, 0, 50),
+                   ("ix_comics_price",)),
+                  ("SELECT count(*) FROM comics WHERE publisher_id = ?", (1,), ("ix_comics_publisher_id",)),
+              ]),
+    Migration(2, "Таблица outbox для надёжной отправки заказов",
+              [
+                  "CREATE TABLE IF NOT EXISTS outbox (id INTEGER NOT NULL PRIMARY KEY, message_id VARCHAR NOT NULL, "
+                  "routing_key VARCHAR NOT NULL, body VARCHAR NOT NULL, created_at FLOAT NOT NULL, "
+                  "attempts INTEGER NOT NULL, next_attempt_at FLOAT NOT NULL, sent_at FLOAT)",
+                  "CREATE UNIQUE INDEX IF NOT EXISTS uq_outbox_message_id ON outbox (message_id)",
+                  "CREATE INDEX IF NOT EXISTS ix_outbox_pending ON outbox (id, next_attempt_at) WHERE sent_at IS NULL",
+                  "CREATE INDEX IF NOT EXISTS ix_outbox_sent_at ON outbox (sent_at) WHERE sent_at IS NOT NULL",
+              ],
+              [
+                  ("SELECT id FROM outbox WHERE sent_at IS NULL AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                   (0, 100), ("ix_outbox_pending",)),
+                  ("SELECT id FROM outbox WHERE sent_at < ? LIMIT ?", (0, 1000), ("ix_outbox_sent_at",)),
+              ]),
+    Migration(3, "Лента изменений каталога: чтение событий из outbox по порядку, издательство в событиях",
+              [
+                  "CREATE INDEX IF NOT EXISTS ix_outbox_routing ON outbox (routing_key, id)",
+                  #Триггеры событий пересоздаются с новыми полями при запуске (events.install)
+                  *[f"DROP TRIGGER IF EXISTS {trigger}" for trigger in TRIGGERS],
+              ],
+              [
+                  ("SELECT id, body FROM outbox WHERE routing_key = ? AND id > ? ORDER BY id LIMIT ?",
+                   ("catalog", 0, 500), ("ix_outbox_routing",)),
+              ]),
+    Migration(4, "Откладывание сообщений outbox после max_attempts неудачных попыток",
+              [
+                  add_column("outbox", "parked_at", "FLOAT"),
+                  "CREATE INDEX IF NOT EXISTS ix_outbox_parked ON outbox (id) WHERE parked_at IS NOT NULL",
+              ],
+              [
+                  ("SELECT id FROM outbox WHERE sent_at IS NULL AND next_attempt_at <= ? AND parked_at IS NULL "
+                   "ORDER BY id LIMIT ?", (0, 100), ("ix_outbox_pending",)),
+                  ("SELECT count(*) FROM outbox WHERE parked_at IS NOT NULL", (), ("ix_outbox_parked",)),
+              ]),
+    Migration(5, "События при смене издательства, сценариста и художника комикса",
+              [
+                  #Триггер пересоздаёт events.install; прежние такие изменения в outbox не попали,
+                  #поэтому новая эпоха заставляет выгрузку снимка и Basket загрузиться заново целиком
+                  "DROP TRIGGER IF EXISTS events_comics_au",
+                  new_epoch,
+              ],
+              []),
+    Migration(6, "Один источник увеличения версии каталога при изменении comics",
+              [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in COMIC_TRIGGERS],
+              []),
+    Migration(7, "Веса bm25 поиска в конфигурации индекса вместо записи при каждом запуске",
+              [configure_rank],
+              []),
+]
+
+def migrate(path: str):
+    """Применение новых миграций catal.db"""
+    return run(path, MIGRATIONS)
+
+if __name__ == "__main__":
+    from .database import engine
+    run_main(sys.argv[1:], MIGRATIONS, engine.url.database)
@@ -1,7 +1,8 @@
 """Модель комикса"""
-from sqlalchemy import ForeignKey
+import string
+from sqlalchemy import ForeignKey, Index, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from database import Base
+from .database import Base
 
 class Comic(Base):
     """Класс комикса"""
@@ -11,11 +12,11 @@ class Comic(Base):
     title: Mapped[str] = mapped_column(unique=True)
     amount: Mapped[int] = mapped_column()
     price: Mapped[int] = mapped_column()
-    publisher_id: Mapped[int] = mapped_column(ForeignKey("publishers.id"))
+    publisher_id: Mapped[int] = mapped_column(ForeignKey("publishers.id", ondelete="CASCADE"))
     publisher = relationship("Publisher", back_populates = "comics")
-    writer_id: Mapped[int] = mapped_column(ForeignKey("writers.id"))
+    writer_id: Mapped[int] = mapped_column(ForeignKey("writers.id", ondelete="CASCADE"))
     writer = relationship("Writer", back_populates = "comics")
-    artist_id: Mapped[int] = mapped_column(ForeignKey("artists.id"))
+    artist_id: Mapped[int] = mapped_column(ForeignKey("artists.id", ondelete="CASCADE"))
     artist = relationship("Artist", back_populates = "comics")
 
 class Publisher(Base):
@@ -24,7 +25,8 @@ class Publisher(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column()
-    comics = relationship("Comic", back_populates = "publisher", cascade="all, delete-orphan")
+    comics = relationship("Comic", back_populates = "publisher", cascade="all, delete-orphan",
+                          passive_deletes=True)
 
 class Writer(Base):
     """Класс сценариста"""
@@ -32,7 +34,8 @@ class Writer(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column()
-    comics = relationship("Comic", back_populates = "writer", cascade="all, delete-orphan")
+    comics = relationship("Comic", back_populates = "writer", cascade="all, delete-orphan",
+                          passive_deletes=True)
 
 class Artist(Base):
     """Класс художника"""
@@ -40,4 +43,49 @@ class Artist(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column()
-    comics = relationship("Comic", back_populates = "artist", cascade="all, delete-orphan")
+    comics = relationship("Comic", back_populates = "artist", cascade="all, delete-orphan",
+                          passive_deletes=True)
+
+class OutboxMessage(Base):
+    """Сообщение для брокера, записанное в одной транзакции с изменением каталога"""
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    message_id: Mapped[str] = mapped_column()
+    routing_key: Mapped[str] = mapped_column()
+    body: Mapped[str] = mapped_column()
+    created_at: Mapped[float] = mapped_column()
+    attempts: Mapped[int] = mapped_column(default=0)
+    #До этого момента строку не берут: задержка перед повтором или аренда текущей отправки
+    next_attempt_at: Mapped[float] = mapped_column(default=0)
+    sent_at: Mapped[float | None] = mapped_column(nullable=True)
+    #Отложена после max_attempts неудачных попыток: не отправляется, пока её не вернут в очередь
+    parked_at: Mapped[float | None] = mapped_column(nullable=True)
+
+def normalized(column):
+    """Имя без пробелов по краям и без учёта регистра (как в уникальных индексах)"""
+    return func.lower(func.trim(column))
+
+#lower() в SQLite меняет регистр только латиницы, а trim() убирает только пробелы
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def name_key(name: str):
+    """То же преобразование на стороне Python, символ в символ как lower(trim()) в SQLite"""
+    return name.strip(" ").translate(ASCII_LOWER)
+
+Index("uq_publishers_name_norm", normalized(Publisher.name), unique=True)
+Index("uq_writers_name_norm", normalized(Writer.name), unique=True)
+Index("uq_artists_name_norm", normalized(Artist.name), unique=True)
+#Внешние ключи + id: фильтр по издателю/автору/художнику с keyset-сортировкой по id
+Index("ix_comics_publisher_id", Comic.publisher_id, Comic.id)
+Index("ix_comics_writer_id", Comic.writer_id, Comic.id)
+Index("ix_comics_artist_id", Comic.artist_id, Comic.id)
+#Сортировка и фильтр по цене
+Index("ix_comics_price", Comic.price, Comic.id)
+Index("uq_outbox_message_id", OutboxMessage.message_id, unique=True)
+#Очередь на отправку: только неотправленные строки, по порядку id
+Index("ix_outbox_pending", OutboxMessage.id, OutboxMessage.next_attempt_at, sqlite_where=OutboxMessage.sent_at.is_(None))
+#Чистка отправленных
+Index("ix_outbox_sent_at", OutboxMessage.sent_at, sqlite_where=OutboxMessage.sent_at.is_not(None))
+#Отложенные строки
+Index("ix_outbox_parked", OutboxMessage.id, sqlite_where=OutboxMessage.parked_at.is_not(None))
@@ -0,0 +1,181 @@
+"""Transactional outbox: сообщения пишутся в catal.db вместе с изменением данных и отправляются фоном"""
+import asyncio
+import json
+import time
+import uuid
+from pydantic import BaseSettings
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .broker import publisher, settings as broker_settings
+from .database import async_session
+from .models import OutboxMessage
+
+class OutboxSettings(BaseSettings):
+    """Настройки отправки из outbox (переменные окружения CATAL_OUTBOX_*)"""
+    batch_size: int = 200
+    #Как часто проверять таблицу, если никто не разбудил, с
+    poll_interval: float = 1.0
+    #На сколько строка считается занятой отправляющим процессом, с
+    lease: float = 30.0
+    retry_delay: float = 0.5
+    retry_max_delay: float = 60.0
+    #После стольких неудачных попыток строка откладывается (parked_at) и больше не берётся
+    max_attempts: int = 20
+    #Сколько хранить отправленные строки и как часто их чистить, с
+    retention: float = 3600.0
+    prune_interval: float = 60.0
+    prune_chunk: int = 1000
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_OUTBOX_"
+
+async def enqueue(db: AsyncSession, payload: dict, routing_key: str | None = None, message_id: str | None = None):
+    """Запись сообщения в текущую транзакцию; фиксирует вызывающий"""
+    message_id = message_id or payload.get("message_id") or uuid.uuid4().hex
+    db.add(OutboxMessage(message_id = message_id, routing_key = routing_key or broker_settings.queue,
+                         body = json.dumps(payload), created_at = time.time(), attempts = 0, next_attempt_at = 0))
+    return message_id
+
+class OutboxRelay:
+    """Фоновая отправка outbox пачками: не меньше одного раза, повтор с экспоненциальной задержкой"""
+
+    def __init__(self, settings: OutboxSettings, publisher, session_factory):
+        self.settings = settings
+        self.publisher = publisher
+        self.session_factory = session_factory
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.relayed = 0
+        self.failed = 0
+        self.parked = 0
+        self.pruned = 0
+        self.last_prune = 0.0
+
+    async def start(self):
+        """Запуск фоновой задачи"""
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка; неотправленное останется в таблице до следующего запуска"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def wake(self):
+        """Новые строки зафиксированы: отправить, не дожидаясь опроса"""
+        self.wakeup.set()
+
+    async def run(self):
+        """Цикл: забрать пачку, отправить, отметить; спать, если пачка неполная"""
+        while True:
+            self.wakeup.clear()
+            try:
+                sent = await self.relay_batch()
+                if time.monotonic() - self.last_prune >= self.settings.prune_interval:
+                    await self.prune()
+            except SQLAlchemyError:
+                sent = 0
+            if sent < self.settings.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.settings.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def claim(self):
+        """Строки, готовые к отправке; им сразу продлевается аренда, чтобы их не взял другой процесс"""
+        now = time.time()
+        ready = (select(OutboxMessage.id)
+                 .where(OutboxMessage.sent_at.is_(None), OutboxMessage.next_attempt_at <= now,
+                        OutboxMessage.parked_at.is_(None))
+                 .order_by(OutboxMessage.id).limit(self.settings.batch_size))
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ready))
+                .values(next_attempt_at = now + self.settings.lease, attempts = OutboxMessage.attempts + 1)
+                .returning(OutboxMessage.id, OutboxMessage.message_id, OutboxMessage.routing_key,
+                           OutboxMessage.body, OutboxMessage.attempts)
+                .execution_options(synchronize_session = False))).all()
+            await db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def retry_at(self, attempts: int, now: float):
+        """Время следующей попытки после attempts неудачных"""
+        return now + min(self.settings.retry_delay * 2 ** (attempts - 1), self.settings.retry_max_delay)
+
+    async def relay_batch(self):
+        """Одна пачка; возвращает число взятых строк"""
+        rows = await self.claim()
+        if not rows:
+            return 0
+        results = await asyncio.gather(*[self.publisher.publish(row.body.encode(), row.routing_key, row.message_id)
+                                         for row in rows], return_exceptions=True)
+        now = time.time()
+        sent, retry, parked = [], [], []
+        #Любая ошибка, не только BrokerUnavailable, ведёт к повтору с задержкой, а после max_attempts - к откладыванию
+        for row, result in zip(rows, results):
+            if not isinstance(result, BaseException):
+                sent.append(row.id)
+            elif row.attempts >= self.settings.max_attempts:
+                parked.append(row.id)
+            else:
+                retry.append({"id": row.id, "next_attempt_at": self.retry_at(row.attempts, now)})
+        async with self.session_factory() as db:
+            if sent:
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(sent)).values(sent_at = now)
+                                 .execution_options(synchronize_session = False))
+            if retry:
+                await db.execute(update(OutboxMessage), retry)
+            if parked:
+                await db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(parked)).values(parked_at = now)
+                                 .execution_options(synchronize_session = False))
+            await db.commit()
+        self.relayed += len(sent)
+        self.failed += len(rows) - len(sent)
+        self.parked += len(parked)
+        return len(rows)
+
+    async def unpark(self):
+        """Возврат отложенных строк в очередь с обнулённым счётчиком попыток; возвращает их число"""
+        async with self.session_factory() as db:
+            count = (await db.execute(update(OutboxMessage).where(OutboxMessage.parked_at.is_not(None))
+                                      .values(parked_at = None, attempts = 0, next_attempt_at = 0)
+                                      .execution_options(synchronize_session = False))).rowcount
+            await db.commit()
+        self.wake()
+        return count
+
+    async def prune(self):
+        """Удаление отправленных строк старше retention частями"""
+        self.last_prune = time.monotonic()
+        border = time.time() - self.settings.retention
+        while True:
+            #Последняя строка остаётся: иначе SQLite выдаст её id снова, а лента изменений читает outbox по id
+            last = select(func.max(OutboxMessage.id)).scalar_subquery()
+            old = (select(OutboxMessage.id).where(OutboxMessage.sent_at < border, OutboxMessage.id < last)
+                   .limit(self.settings.prune_chunk))
+            async with self.session_factory() as db:
+                removed = (await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(old))
+                                            .execution_options(synchronize_session = False))).rowcount
+                await db.commit()
+            self.pruned += removed
+            if removed < self.settings.prune_chunk:
+                return
+
+    async def stats(self):
+        """Счётчики и состояние таблицы"""
+        async with self.session_factory() as db:
+            pending, oldest = (await db.execute(
+                select(func.count(), func.min(OutboxMessage.created_at))
+                .where(OutboxMessage.sent_at.is_(None), OutboxMessage.parked_at.is_(None)))).one()
+            parked = (await db.execute(select(func.count()).where(OutboxMessage.parked_at.is_not(None)))).scalar()
+        return {"relayed": self.relayed, "failed": self.failed, "parked_total": self.parked, "pruned": self.pruned,
+                "pending": pending, "parked": parked,
+                "oldest_pending_age": round(time.time() - oldest, 3) if oldest else None}
+
+settings = OutboxSettings()
+relay = OutboxRelay(settings, publisher, async_session)
@@ -0,0 +1,86 @@
+"""Резервирование товара по корзине одной транзакцией"""
+import time
+import uuid
+from pydantic import BaseModel, conint, conlist
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Comic
+
+class CartLine(BaseModel):
+    """Строка корзины; comic_id, если известен, важнее названия"""
+    comic_id: int | None = None
+    title: str
+    qty: conint(gt=0) = 1
+
+class CartMod(BaseModel):
+    """Корзина для покупки"""
+    items: conlist(CartLine, min_items=1, max_items=500)
+
+class OutOfStock(Exception):
+    """Хотя бы одной позиции не хватает; shortages - отчёт по строкам"""
+
+    def __init__(self, shortages: list):
+        super().__init__("Not enough comics")
+        self.shortages = shortages
+
+def merge_lines(lines: list):
+    """Сложение количеств одинаковых позиций: по comic_id, если он есть, иначе по названию.
+
+    Возвращает (comic_id или None, название, количество); сначала строки по id, затем по названию.
+    """
+    merged = {}
+    for line in lines:
+        title = line.title.strip()
+        key = ("id", line.comic_id) if line.comic_id is not None else ("title", title)
+        _, qty = merged.get(key, (title, 0))
+        merged[key] = (title, qty + line.qty)
+    return [(key[1] if key[0] == "id" else None, title, qty) for key, (title, qty) in sorted(merged.items())]
+
+async def reserve_stock(lines: list, db: AsyncSession):
+    """Условное списание всех строк (amount >= qty) в текущей транзакции.
+
+    Всё или ничего: при нехватке хотя бы одной позиции транзакция
+    откатывается и выбрасывается OutOfStock. Фиксирует вызывающий.
+    """
+    reserved = []
+    failed = []
+    for comic_id, title, qty in merge_lines(lines):
+        match = Comic.id == comic_id if comic_id is not None else Comic.title == title
+        row = (await db.execute(
+            update(Comic)
+            .where(match, Comic.amount >= qty)
+            .values(amount = Comic.amount - qty)
+            .returning(Comic.id, Comic.title, Comic.price, Comic.amount)
+            .execution_options(synchronize_session = False))).first()
+        if row is None:
+            failed.append((comic_id, title, qty))
+        else:
+            reserved.append({"comic_id": row.id, "title": row.title, "qty": qty, "price": row.price, "left": row.amount})
+    if failed:
+        await db.rollback()
+        raise OutOfStock(await shortage_report(failed, db))
+    return reserved
+
+async def shortage_report(failed: list, db: AsyncSession):
+    """Отчёт по несписанным строкам: сколько есть и почему не хватило"""
+    ids = [comic_id for comic_id, _, _ in failed if comic_id is not None]
+    titles = [title for comic_id, title, _ in failed if comic_id is None]
+    by_id = dict((await db.execute(select(Comic.id, Comic.amount).where(Comic.id.in_(ids)))).tuples().all()) if ids else {}
+    by_title = (dict((await db.execute(select(Comic.title, Comic.amount).where(Comic.title.in_(titles)))).tuples().all())
+                if titles else {})
+    report = []
+    for comic_id, title, qty in failed:
+        found = comic_id in by_id if comic_id is not None else title in by_title
+        available = by_id.get(comic_id) if comic_id is not None else by_title.get(title)
+        line = {"title": title, "requested": qty, "available": available,
+                "reason": "insufficient" if found else "not_found"}
+        if comic_id is not None:
+            line["comic_id"] = comic_id
+        report.append(line)
+    return report
+
+def order_message(email: str, reserved: list, message_id: str | None = None):
+    """Сообщение о заказе для Basket по зарезервированным строкам"""
+    return {"message_id": message_id or uuid.uuid4().hex, "email": email, "created_at": time.time(),
+            "price": sum(line["price"] * line["qty"] for line in reserved),
+            "items": [{key: line[key] for key in ("comic_id", "title", "qty", "price")} for line in reserved]}
@@ -0,0 +1,369 @@
+"""Реплика каталога только на чтение: /view/*, /view/comic и /search из двоичного снимка
+
+Запуск из корня репозитория (снимок готовит python -m Catal.export или основной сервис
+с CATAL_SNAPSHOT_RUN_IN_APP=true):
+    uvicorn Catal.replica:app
+
+Снимок отображается в память; новый файл (атомарная замена) подхватывается фоном без
+перезапуска, запросы, начатые на старом снимке, дочитывают его. Поиск - по префиксам
+слов, как в основном сервисе, но без ранжирования FTS: результаты по виду и имени.
+"""
+import asyncio
+import bisect
+import heapq
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseSettings
+from common.pagination import encode_cursor, decode_cursor
+from .cache import etag_matches
+from .database import engine
+from .export import settings as export_settings, snapshot_path
+from .models import name_key
+from .listing import DEFAULT_LIMIT, MAX_LIMIT, STREAM_CHUNK, FastJSONResponse, dumps
+from .schemas import ComicOut, ComicPage, NamePage, doc
+from .search import KINDS, match_query
+from .snapshot import DIMENSIONS, KIND_SHIFT, Snapshot, SnapshotError
+
+#Код вида в поиске -> вид
+KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+DIMENSION_CODES = {KINDS[dimension]: dimension for dimension in DIMENSIONS}
+
+class ReplicaSettings(BaseSettings):
+    """Настройки реплики (переменные окружения CATAL_REPLICA_*)"""
+    #Файл снимка; по умолчанию тот же, что у выгрузки
+    path: str | None = None
+    #Как часто проверять, не заменён ли файл, с
+    check_interval: float = 1.0
+    #Проверять crc32 секций в фоне после замены (при открытии проверяются только заголовок и каталог секций)
+    verify: bool = True
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "CATAL_REPLICA_"
+
+class Replica:
+    """Текущий снимок и его замена при появлении нового файла"""
+
+    def __init__(self, settings: ReplicaSettings, path: str):
+        self.settings = settings
+        self.path = path
+        self.snapshot = None
+        #Прежний снимок, пока crc32 нового не проверена: к нему возвращаемся при несовпадении
+        self.previous = None
+        self.verified = False
+        self.key = None
+        self.task = None
+        self.loads = 0
+        self.errors = 0
+        self.load_seconds = None
+
+    def load(self):
+        """Открытие файла, если он изменился; ошибка оставляет прежний снимок"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.key:
+            return
+        started = time.perf_counter()
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, SnapshotError):
+            self.errors += 1
+            return
+        if not self.settings.verify:
+            self.previous = None
+        elif self.verified or self.previous is None:
+            self.previous = self.snapshot
+        self.snapshot, self.key, self.verified = snapshot, key, False
+        self.loads += 1
+        self.load_seconds = round(time.perf_counter() - started, 4)
+
+    def check(self):
+        """crc32 секций текущего снимка; при несовпадении - возврат к прежнему (файл не перечитывается, пока не изменится)"""
+        snapshot = self.snapshot
+        if snapshot is None or self.verified or not self.settings.verify:
+            return
+        if snapshot.check():
+            self.verified, self.previous = True, None
+        elif self.snapshot is snapshot:
+            self.errors += 1
+            self.snapshot, self.previous, self.verified = self.previous, None, True
+
+    async def run(self):
+        """Проверка нового снимка и файла каждые check_interval секунд"""
+        while True:
+            await asyncio.to_thread(self.check)
+            await asyncio.sleep(self.settings.check_interval)
+            await asyncio.to_thread(self.load)
+
+    async def start(self):
+        """Первая загрузка и фоновая проверка"""
+        self.load()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка проверки"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def current(self):
+        """Снимок для запроса; 503, пока его нет"""
+        if self.snapshot is None:
+            raise HTTPException(status_code=503,detail="Catalog snapshot is not available")
+        return self.snapshot
+
+    def stats(self):
+        """Сведения о снимке и загрузках"""
+        return {"loads": self.loads, "errors": self.errors, "load_seconds": self.load_seconds, "verified": self.verified,
+                "snapshot": self.snapshot.stats() if self.snapshot is not None else None}
+
+def comic_sort(snapshot: Snapshot, sort: str):
+    """Ключ сортировки строки комикса: (значение, id) или id"""
+    ids = snapshot.column("c_id")
+    if sort == "id":
+        return ids.__getitem__
+    if sort == "title":
+        titles = snapshot.column("c_title")
+        return lambda row: (snapshot.raw(titles[row]), ids[row])
+    values = snapshot.column(f"c_{sort}")
+    return lambda row: (values[row], ids[row])
+
+def name_sort(snapshot: Snapshot, dimension: str, sort: str):
+    """Ключ сортировки строки издательства, сценариста или художника"""
+    ids = snapshot.column(f"{dimension[0]}_id")
+    if sort == "id":
+        return ids.__getitem__
+    names = snapshot.column(f"{dimension[0]}_name")
+    return lambda row: (snapshot.raw(names[row]), ids[row])
+
+def cursor_target(cursor: str, sort: str):
+    """Ключ последней отданной строки из курсора"""
+    if sort == "id":
+        return decode_cursor(cursor, 1)[0]
+    value, row_id = decode_cursor(cursor, 2)
+    return (value.encode() if isinstance(value, str) else value, row_id)
+
+def cursor_value(key):
+    """Ключ строки в курсор"""
+    if not isinstance(key, tuple):
+        return [key]
+    value, row_id = key
+    return [value.decode() if isinstance(value, bytes) else value, row_id]
+
+def scan(rows, key, desc: bool, cursor: str | None, sort: str):
+    """Строки после курсора в порядке сортировки (rows уже упорядочены по key)"""
+    if cursor:
+        target = cursor_target(cursor, sort)
+        if desc:
+            position = bisect.bisect_left(rows, target, key=key)
+            return (rows[index] for index in range(position - 1, -1, -1))
+        position = bisect.bisect_right(rows, target, key=key)
+        return (rows[index] for index in range(position, len(rows)))
+    if desc:
+        return (rows[index] for index in range(len(rows) - 1, -1, -1))
+    return iter(rows)
+
+def take(rows, limit: int):
+    """Первые limit строк и признак, что есть ещё"""
+    page = []
+    for row in rows:
+        if len(page) == limit:
+            return page, True
+        page.append(row)
+    return page, False
+
+def parse_sort(sort: str, allowed: tuple):
+    """Сортировка вида "price" или "-price" из разрешённых"""
+    desc = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in allowed:
+        raise HTTPException(status_code=400,detail="Bad sort")
+    return sort, desc
+
+def respond(request: Request, snapshot: Snapshot, rows, key, limit: int, format: str, render):
+    """Страница JSON с курсором или потоковая выгрузка NDJSON; ETag - эпоха и версия снимка"""
+    if format == "ndjson":
+        async def stream():
+            chunk = []
+            for row in rows:
+                chunk.append(dumps(render(row)) + b"\n")
+                if len(chunk) == STREAM_CHUNK:
+                    yield b"".join(chunk)
+                    chunk = []
+            if chunk:
+                yield b"".join(chunk)
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400,detail="Bad format")
+    etag = f'"{snapshot.epoch}-{snapshot.version}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    page, more = take(rows, limit)
+    next_cursor = encode_cursor(cursor_value(key(page[-1]))) if more else None
+    return FastJSONResponse(dumps({"items": [render(row) for row in page], "next_cursor": next_cursor}),
+                            headers={"ETag": etag})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Загрузка снимка при запуске, фоновая замена; остановка при завершении"""
+    await replica.start()
+    yield
+    await replica.stop()
+
+app = FastAPI(lifespan = lifespan)
+settings = ReplicaSettings()
+replica = Replica(settings, settings.path or snapshot_path(engine.url.database, export_settings))
+
+@app.get("/view/comics", responses=doc(ComicPage))
+async def view_comics(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                      publisher: str | None = None, writer: str | None = None, artist: str | None = None,
+                      min_price: float | None = None, max_price: float | None = None,
+                      in_stock: bool | None = None, sort: str = "id", format: str = "json", embed: bool = False):
+    """Комиксы постранично с теми же фильтрами, сортировками и курсорами, что у основного сервиса"""
+    snapshot = replica.current()
+    sort, desc = parse_sort(sort, ("id", "title", "price", "amount"))
+    key = comic_sort(snapshot, sort)
+    filters = {dimension: name for dimension, name in
+               (("publisher", publisher), ("writer", writer), ("artist", artist)) if name is not None}
+    rows = None
+    checks = []
+    for dimension, name in filters.items():
+        found = snapshot.find_name(dimension, name)
+        if found is None:
+            rows = []
+            break
+        refs = snapshot.column(f"c_{dimension[0]}")
+        checks.append((refs, found))
+        #Самый короткий список комиксов записи - основа выборки, остальные фильтры - проверкой
+        candidates = snapshot.comics_of(dimension, found)
+        if rows is None or len(candidates) < len(rows):
+            rows = candidates
+    if rows is None:
+        rows = range(snapshot.count) if sort == "id" else snapshot.column(f"c_by{sort}")
+    elif sort != "id":
+        rows = sorted(rows, key=key)
+    prices, amounts = snapshot.column("c_price"), snapshot.column("c_amount")
+    def accept(row: int):
+        """Фильтры, не вошедшие в основу выборки"""
+        if any(refs[row] != found for refs, found in checks):
+            return False
+        if min_price is not None and prices[row] < min_price:
+            return False
+        if max_price is not None and prices[row] > max_price:
+            return False
+        return in_stock is None or (amounts[row] > 0) == in_stock
+    ordered = (row for row in scan(rows, key, desc, cursor, sort) if accept(row))
+    return respond(request, snapshot, ordered, key, limit, format, lambda row: snapshot.comic(row, embed))
+
+@app.get("/view/comic", responses=doc(ComicOut))
+async def view_comic(title: str, embed: bool = False):
+    """Один комикс по названию (двоичный поиск по упорядоченным названиям)"""
+    snapshot = replica.current()
+    row = snapshot.find_title(title.strip())
+    if row is None:
+        raise HTTPException(status_code=404,detail="Title not found")
+    return snapshot.comic(row, embed)
+
+def view_names(request: Request, dimension: str, limit: int, cursor: str | None, name: str | None, sort: str,
+               format: str):
+    """Общая часть /view/publishers, /view/writers, /view/artists"""
+    snapshot = replica.current()
+    sort, desc = parse_sort(sort, ("id", "name"))
+    key = name_sort(snapshot, dimension, sort)
+    prefix = dimension[0]
+    if name is not None:
+        #Префикс без учёта регистра по перестановке нормализованных имён
+        permutation = snapshot.column(f"{prefix}_bykey")
+        names = snapshot.column(f"{prefix}_name")
+        target = name_key(name).encode()
+        normalized = lambda row: name_key(snapshot.string(names[row])).encode()
+        start = bisect.bisect_left(permutation, target, key=normalized)
+        rows = []
+        for index in range(start, len(permutation)):
+            if not normalized(permutation[index]).startswith(target):
+                break
+            rows.append(permutation[index])
+        rows.sort(key=key)
+    else:
+        rows = range(snapshot.names(dimension)) if sort == "id" else snapshot.column(f"{prefix}_byname")
+    return respond(request, snapshot, scan(rows, key, desc, cursor, sort), key, limit, format,
+                   lambda row: snapshot.name(dimension, row))
+
+@app.get("/view/publishers", responses=doc(NamePage))
+async def view_pubs(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                    name: str | None = None, sort: str = "id", format: str = "json"):
+    """Издательства постранично"""
+    return view_names(request, "publisher", limit, cursor, name, sort, format)
+
+@app.get("/view/writers", responses=doc(NamePage))
+async def view_writers(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                       name: str | None = None, sort: str = "id", format: str = "json"):
+    """Сценаристы постранично"""
+    return view_names(request, "writer", limit, cursor, name, sort, format)
+
+@app.get("/view/artists", responses=doc(NamePage))
+async def view_artists(request: Request, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None,
+                       name: str | None = None, sort: str = "id", format: str = "json"):
+    """Художники постранично"""
+    return view_names(request, "artist", limit, cursor, name, sort, format)
+
+def search_name(snapshot: Snapshot, entry: int):
+    """Название комикса или имя записи для упорядочивания результатов"""
+    code, row = entry >> KIND_SHIFT, entry & ((1 << KIND_SHIFT) - 1)
+    column = "c_title" if code == KINDS["comic"] else f"{DIMENSION_CODES[code][0]}_name"
+    return snapshot.raw(snapshot.column(column)[row])
+
+def search_item(snapshot: Snapshot, entry: int):
+    """Результат поиска в том же виде, что у основного сервиса"""
+    code, row = entry >> KIND_SHIFT, entry & ((1 << KIND_SHIFT) - 1)
+    if code == KINDS["comic"]:
+        comic = snapshot.comic(row)
+        return {"kind": "comic", "id": comic["id"], "name": comic["title"], "price": comic["price"],
+                "amount": comic["amount"], "score": None}
+    dimension = DIMENSION_CODES[code]
+    return {"kind": dimension, **snapshot.name(dimension, row), "price": None, "amount": None, "score": None}
+
+@app.get("/search")
+async def search_catalog(q: str, kind: str | None = None, limit: int = Query(20, ge=1, le=100),
+                         offset: int = Query(0, ge=0), facets: bool = False):
+    """Поиск по префиксам слов в названиях и именах"""
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=400,detail="Bad kind")
+    snapshot = replica.current()
+    #Те же слова, что в FTS-запросе основного сервиса
+    words = [word.strip('"*').lower() for word in match_query(q).split()]
+    if not words:
+        return {"items": [], "facets": {} if facets else None}
+    found = None
+    for word in sorted(words, key=len, reverse=True):
+        rows = snapshot.matches(word)
+        found = rows if found is None else found & rows
+        if not found:
+            break
+    counts = {}
+    for entry in found if facets else ():
+        kind_name = KIND_NAMES[entry >> KIND_SHIFT]
+        counts[kind_name] = counts.get(kind_name, 0) + 1
+    if kind is not None:
+        found = {entry for entry in found if entry >> KIND_SHIFT == KINDS[kind]}
+    #Объекты ответа - только для отданной страницы
+    page = heapq.nsmallest(offset + limit, found, key=lambda entry: (entry >> KIND_SHIFT, search_name(snapshot, entry)))
+    return {"items": [search_item(snapshot, entry) for entry in page[offset:]], "facets": counts if facets else None}
+
+@app.get("/catalog/version")
+async def catalog_version():
+    """Эпоха и версия каталога в снимке"""
+    snapshot = replica.current()
+    return {"epoch": snapshot.epoch, "version": snapshot.version}
+
+@app.get("/snapshot/stats")
+async def snapshot_stats():
+    """Текущий снимок и счётчики загрузок"""
+    return replica.stats()
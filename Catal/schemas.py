@@ -0,0 +1,58 @@
+"""Схемы ответов каталога и выборка только нужных столбцов"""
+from pydantic import BaseModel
+from sqlalchemy import select
+from .models import Comic, Writer, Publisher, Artist, normalized, name_key
+
+#Столбцы комикса в ответах; строки ORM не создаются
+COMIC_COLUMNS = (Comic.id, Comic.title, Comic.amount, Comic.price, Comic.publisher_id, Comic.writer_id, Comic.artist_id)
+
+class ComicOut(BaseModel):
+    """Комикс в ответе; имена есть только при embed=true"""
+    id: int
+    title: str
+    amount: int
+    price: float
+    publisher_id: int
+    writer_id: int
+    artist_id: int
+    publisher: str | None = None
+    writer: str | None = None
+    artist: str | None = None
+
+class NameOut(BaseModel):
+    """Издатель, сценарист или художник в ответе"""
+    id: int
+    name: str
+
+class ComicPage(BaseModel):
+    """Страница комиксов"""
+    items: list[ComicOut]
+    next_cursor: str | None = None
+
+class NamePage(BaseModel):
+    """Страница издателей, сценаристов или художников"""
+    items: list[NameOut]
+    next_cursor: str | None = None
+
+def comic_select(embed: bool = False):
+    """Запрос столбцов комикса; при embed имена подтягиваются одним запросом через JOIN"""
+    stmt = select(*COMIC_COLUMNS)
+    if embed:
+        stmt = (stmt.add_columns(Publisher.name.label("publisher"), Writer.name.label("writer"),
+                                 Artist.name.label("artist"))
+                .join(Publisher, Comic.publisher_id == Publisher.id)
+                .join(Writer, Comic.writer_id == Writer.id)
+                .join(Artist, Comic.artist_id == Artist.id))
+    return stmt
+
+def name_select(model):
+    """Запрос столбцов id и name"""
+    return select(model.id, model.name)
+
+def id_by_name(model, name: str):
+    """Подзапрос id по нормализованному имени; не связывается с JOIN внешнего запроса"""
+    return select(model.id).where(normalized(model.name) == name_key(name)).correlate(None).scalar_subquery()
+
+def doc(model):
+    """Описание ответа 200 для OpenAPI без проверки каждой строки при выдаче"""
+    return {200: {"model": model}}
@@ -0,0 +1,373 @@
+"""Двоичный снимок каталога для реплик только на чтение
+
+Файл (little-endian, все секции выровнены по 8 байт):
+    заголовок  HEADER: magic, версия формата, crc32 каталога секций, crc32 секций, эпоха и версия
+               каталога, последний id outbox в снимке, время создания, число секций;
+    каталог    SECTION на каждую секцию: имя, смещение, длина в байтах;
+    секции     массивы q (int64) и I (uint32), строки - в общей таблице (смещения + UTF-8).
+
+Комиксы хранятся столбцами в порядке id; строки издательств, сценаристов и художников
+тоже в порядке id. Для сортировок и поиска есть перестановки строк, отсортированные по
+ключу (название, цена, количество, имя в нижнем регистре), для фильтра по издательству
+и т.п. - комиксы каждой записи подряд (CSR: начала и строки). Поиск по префиксам слов -
+по отсортированному словарю слов со списками вхождений.
+
+Читатель отображает файл в память и работает с memoryview поверх него: объекты Python
+создаются только для строк, попавших в ответ. При открытии проверяются только заголовок
+и каталог секций; crc32 секций читает весь файл и вызывается отдельно (check).
+"""
+import bisect
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+from array import array
+from collections import Counter
+from itertools import accumulate, islice
+from .models import name_key
+from .search import KINDS
+
+MAGIC = b"CATSNAP\x00"
+FORMAT = 2
+HEADER = struct.Struct("<8sIII16sqqdI")
+SECTION = struct.Struct("<12sQQ")
+#Нет записи (комикс без издательства и т.п.)
+NONE = 0xFFFFFFFF
+#Виды в словаре слов: код вида в старших битах номера строки
+KIND_SHIFT = 30
+DIMENSIONS = {"publisher": "publishers", "writer": "writers", "artist": "artists"}
+WORD = re.compile(r"\w+")
+
+if array("I").itemsize != 4 or array("q").itemsize != 8:
+    raise ImportError("Snapshot format needs 4-byte I and 8-byte q arrays")
+
+class SnapshotError(Exception):
+    """Файл снимка повреждён или другого формата"""
+
+class Columns:
+    """Данные для записи снимка: столбцы в порядке id"""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.titles = []
+        self.amounts = array("q")
+        self.prices = array("q")
+        #id записей измерений: publisher, writer, artist
+        self.refs = {dimension: array("q") for dimension in DIMENSIONS}
+        #Измерение -> (ids, имена) в порядке id
+        self.names = {dimension: (array("q"), []) for dimension in DIMENSIONS}
+
+    def add_comics(self, rows, chunk: int = 100000):
+        """Комиксы (id, название, количество, цена, id издательства, сценариста, художника) в конец пачками"""
+        rows = iter(rows)
+        while part := list(islice(rows, chunk)):
+            ids, titles, amounts, prices, *refs = zip(*part)
+            self.ids.extend(ids)
+            self.titles.extend(titles)
+            self.amounts.extend(amounts)
+            self.prices.extend(prices)
+            for dimension, column in zip(DIMENSIONS, refs):
+                self.refs[dimension].extend(column)
+
+    def add_name(self, dimension: str, row_id: int, name: str):
+        """Издательство, сценарист или художник в конец; id должны расти"""
+        ids, names = self.names[dimension]
+        ids.append(row_id)
+        names.append(name)
+
+class StringTable:
+    """Общая таблица строк: смещения и UTF-8 подряд"""
+
+    def __init__(self):
+        self.offsets = array("Q", [0])
+        self.data = bytearray()
+
+    def extend(self, values: list):
+        """Номера новых строк (уже в байтах) подряд"""
+        first = len(self.offsets) - 1
+        self.offsets.extend(accumulate(map(len, values), initial=len(self.data)))
+        self.offsets.pop(first)
+        self.data += b"".join(values)
+        return array("I", range(first, first + len(values)))
+
+def permutation(count: int, key):
+    """Номера строк, отсортированные по key; при равных ключах - по номеру (сортировка устойчивая)"""
+    return array("I", sorted(range(count), key=key))
+
+def grouped(refs: array, size: int):
+    """Строки комиксов, сгруппированные по записи измерения (CSR): начала групп и строки в порядке id"""
+    counts = [0] * (size + 1)
+    for ref, number in Counter(refs).items():
+        if ref != NONE:
+            counts[ref + 1] = number
+    starts = array("I", accumulate(counts))
+    #NONE больше любого номера записи: комиксы без записи оказываются в конце и отбрасываются
+    rows = permutation(len(refs), refs.__getitem__)
+    return starts, rows[:starts[-1]]
+
+def words(value: str):
+    """Слова для поиска по префиксам, как в FTS-индексе"""
+    return set(WORD.findall(value.lower()))
+
+def build(columns: Columns, epoch: str, version: int, outbox_id: int):
+    """Секции снимка: имя -> массив или байты"""
+    strings = StringTable()
+    sections = {}
+    postings = {}
+    count = len(columns.ids)
+    for dimension, (ids, names) in columns.names.items():
+        prefix = dimension[0]
+        keys = [name_key(name).encode() for name in names]
+        raw = [name.encode() for name in names]
+        sections[f"{prefix}_id"] = ids
+        sections[f"{prefix}_name"] = strings.extend(raw)
+        sections[f"{prefix}_byname"] = permutation(len(ids), raw.__getitem__)
+        sections[f"{prefix}_bykey"] = permutation(len(ids), keys.__getitem__)
+        for row, name in enumerate(names):
+            for word in words(name):
+                postings.setdefault(word, []).append(KINDS[dimension] << KIND_SHIFT | row)
+        #Комиксы каждой записи подряд в порядке id
+        row_of = {row_id: row for row, row_id in enumerate(ids)}
+        refs = array("I", [row_of.get(ref, NONE) for ref in columns.refs[dimension]])
+        sections[f"c_{prefix}"] = refs
+        sections[f"{prefix}_start"], sections[f"{prefix}_comics"] = grouped(refs, len(ids))
+    raw = [title.encode() for title in columns.titles]
+    sections["c_id"] = columns.ids
+    sections["c_title"] = strings.extend(raw)
+    sections["c_amount"] = columns.amounts
+    sections["c_price"] = columns.prices
+    #Строки и так в порядке id: равные значения остаются упорядоченными по id
+    sections["c_bytitle"] = permutation(count, raw.__getitem__)
+    sections["c_byprice"] = permutation(count, columns.prices.__getitem__)
+    sections["c_byamount"] = permutation(count, columns.amounts.__getitem__)
+    del raw
+    comic = KINDS["comic"] << KIND_SHIFT
+    for row, title in enumerate(columns.titles):
+        for word in words(title):
+            postings.setdefault(word, []).append(comic | row)
+    vocabulary = sorted(postings, key=str.encode)
+    sections["t_word"] = strings.extend([word.encode() for word in vocabulary])
+    starts, entries = array("I", [0]), array("I")
+    for word in vocabulary:
+        entries.extend(postings[word])
+        starts.append(len(entries))
+    sections["t_start"] = starts
+    sections["t_rows"] = entries
+    sections["s_offsets"] = strings.offsets
+    sections["s_data"] = bytes(strings.data)
+    return {"epoch": epoch, "version": version, "outbox_id": outbox_id, "sections": sections}
+
+def padding(size: int):
+    """Байты до выравнивания по 8"""
+    return b"\0" * (-size % 8)
+
+def write(path: str, snapshot: dict):
+    """Запись во временный файл рядом и атомарная замена: читатели видят старый или новый файл целиком"""
+    sections = snapshot["sections"]
+    blobs = [(name, memoryview(value).cast("B")) for name, value in sections.items()]
+    offset = HEADER.size + SECTION.size * len(blobs)
+    offset += -offset % 8
+    directory = []
+    for name, blob in blobs:
+        directory.append(SECTION.pack(name.encode(), offset, len(blob)))
+        offset += len(blob) + (-len(blob) % 8)
+    body = b"".join(directory)
+    directory_crc = zlib.crc32(body)
+    body += padding(HEADER.size + len(body))
+    crc = 0
+    for _, blob in blobs:
+        crc = zlib.crc32(blob, crc)
+        crc = zlib.crc32(padding(len(blob)), crc)
+    header = HEADER.pack(MAGIC, FORMAT, directory_crc, crc, snapshot["epoch"].encode(), snapshot["version"],
+                         snapshot["outbox_id"], time.time(), len(blobs))
+    temp = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(temp, "wb") as file:
+            file.write(header)
+            file.write(body)
+            for _, blob in blobs:
+                file.write(blob)
+                file.write(padding(len(blob)))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    directory_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+    return offset
+
+def section_type(name: str):
+    """Тип элементов секции по имени"""
+    if name == "s_data":
+        return "B"
+    if name == "s_offsets":
+        return "Q"
+    if name.endswith("_id") or name in ("c_amount", "c_price"):
+        return "q"
+    return "I"
+
+class Reversed:
+    """Последовательность в обратном порядке без копирования"""
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index: int):
+        return self.sequence[len(self.sequence) - 1 - index]
+
+class Snapshot:
+    """Снимок, отображённый в память; после open не меняется"""
+
+    def __init__(self, path: str, verify: bool = False):
+        self.path = path
+        with open(path, "rb") as file:
+            self.stat = os.fstat(file.fileno())
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if len(view) < HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+        (magic, version, directory_crc, self.crc, epoch, self.version, self.outbox_id, self.created_at,
+         count) = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT:
+            raise SnapshotError("Not a catalog snapshot or unsupported format")
+        end = HEADER.size + count * SECTION.size
+        if end > len(view):
+            raise SnapshotError("Snapshot is truncated")
+        if zlib.crc32(view[HEADER.size:end]) != directory_crc:
+            raise SnapshotError("Snapshot directory checksum mismatch")
+        self.start = end + -end % 8
+        self.epoch = epoch.rstrip(b"\0").decode()
+        self.sections = {}
+        for number in range(count):
+            name, offset, size = SECTION.unpack_from(view, HEADER.size + number * SECTION.size)
+            if offset + size > len(view):
+                raise SnapshotError("Snapshot is truncated")
+            name = name.rstrip(b"\0").decode()
+            self.sections[name] = view[offset:offset + size].cast(section_type(name))
+        self.offsets = self.sections["s_offsets"]
+        self.data = self.sections["s_data"]
+        self.count = len(self.sections["c_id"])
+        if verify and not self.check():
+            raise SnapshotError("Snapshot checksum mismatch")
+
+    def check(self):
+        """crc32 всех секций (читает весь файл); True, если совпадает с заголовком"""
+        return zlib.crc32(memoryview(self.map)[self.start:]) == self.crc
+
+    def column(self, name: str):
+        """Секция как массив только для чтения"""
+        return self.sections[name]
+
+    def size(self):
+        """Размер файла, байт"""
+        return len(self.map)
+
+    def raw(self, string: int):
+        """Строка таблицы в байтах (для сравнения в двоичном поиске)"""
+        return bytes(self.data[self.offsets[string]:self.offsets[string + 1]])
+
+    def string(self, string: int):
+        """Строка таблицы"""
+        return str(self.data[self.offsets[string]:self.offsets[string + 1]], "utf-8")
+
+    def prefix_range(self, permutation, strings, prefix: bytes):
+        """Границы строк перестановки, у которых строка начинается с prefix"""
+        key = lambda row: self.raw(strings[row])
+        start = bisect.bisect_left(permutation, prefix, key=key)
+        end = start
+        while end < len(permutation) and key(permutation[end]).startswith(prefix):
+            end += 1
+        return start, end
+
+    def find_title(self, title: str):
+        """Строка комикса по точному названию или None"""
+        permutation, titles = self.column("c_bytitle"), self.column("c_title")
+        target = title.encode()
+        index = bisect.bisect_left(permutation, target, key=lambda row: self.raw(titles[row]))
+        if index < len(permutation) and self.raw(titles[permutation[index]]) == target:
+            return permutation[index]
+        return None
+
+    def find_name(self, dimension: str, name: str):
+        """Строка издательства, сценариста или художника по нормализованному имени или None"""
+        prefix = dimension[0]
+        permutation, names = self.column(f"{prefix}_bykey"), self.column(f"{prefix}_name")
+        target = name_key(name).encode()
+        key = lambda row: name_key(self.string(names[row])).encode()
+        index = bisect.bisect_left(permutation, target, key=key)
+        if index < len(permutation) and key(permutation[index]) == target:
+            return permutation[index]
+        return None
+
+    def comic(self, row: int, embed: bool = False):
+        """Комикс в том же виде, что и в /view/comics основного сервиса"""
+        comic = {"id": self.column("c_id")[row], "title": self.string(self.column("c_title")[row]),
+                 "amount": self.column("c_amount")[row], "price": self.column("c_price")[row]}
+        for dimension in DIMENSIONS:
+            ref = self.column(f"c_{dimension[0]}")[row]
+            comic[f"{dimension}_id"] = self.column(f"{dimension[0]}_id")[ref] if ref != NONE else None
+        if embed:
+            for dimension in DIMENSIONS:
+                ref = self.column(f"c_{dimension[0]}")[row]
+                comic[dimension] = self.string(self.column(f"{dimension[0]}_name")[ref]) if ref != NONE else None
+        return comic
+
+    def name(self, dimension: str, row: int):
+        """Издательство, сценарист или художник: id и name"""
+        prefix = dimension[0]
+        return {"id": self.column(f"{prefix}_id")[row], "name": self.string(self.column(f"{prefix}_name")[row])}
+
+    def names(self, dimension: str):
+        """Число записей измерения"""
+        return len(self.column(f"{dimension[0]}_id"))
+
+    def comics_of(self, dimension: str, row: int):
+        """Строки комиксов записи измерения в порядке id"""
+        prefix = dimension[0]
+        starts = self.column(f"{prefix}_start")
+        return self.column(f"{prefix}_comics")[starts[row]:starts[row + 1]]
+
+    def word_rows(self, prefix: str):
+        """Вхождения всех слов, начинающихся с prefix: множество (вид << KIND_SHIFT | строка)"""
+        vocabulary, starts, entries = self.column("t_word"), self.column("t_start"), self.column("t_rows")
+        target = prefix.encode()
+        key = lambda index: self.raw(vocabulary[index])
+        positions = range(len(vocabulary))
+        start = bisect.bisect_left(positions, target, key=key)
+        found = set()
+        index = start
+        while index < len(vocabulary) and key(index).startswith(target):
+            found.update(entries[starts[index]:starts[index + 1]])
+            index += 1
+        return found
+
+    def matches(self, prefix: str):
+        """Как word_rows, но с комиксами тех издательств, сценаристов и художников, чьё имя подошло
+
+        Так же ищет search_index: в документе комикса есть имена его издательства, сценариста и художника.
+        """
+        found = self.word_rows(prefix)
+        comic = KINDS["comic"] << KIND_SHIFT
+        mask = (1 << KIND_SHIFT) - 1
+        for dimension in DIMENSIONS:
+            code = KINDS[dimension]
+            for entry in [entry for entry in found if entry >> KIND_SHIFT == code]:
+                found.update(comic | row for row in self.comics_of(dimension, entry & mask))
+        return found
+
+    def stats(self):
+        """Сведения о снимке"""
+        return {"path": self.path, "epoch": self.epoch, "version": self.version, "outbox_id": self.outbox_id,
+                "created_at": self.created_at, "bytes": self.size(), "comics": self.count,
+                **{plural: self.names(dimension) for dimension, plural in DIMENSIONS.items()}}
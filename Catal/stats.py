@@ -0,0 +1,192 @@
+"""Сводные счётчики каталога, которые поддерживаются триггерами
+
+Запуск вручную из корня репозитория:
+    python -m Catal.stats check | rebuild
+"""
+import asyncio
+import sys
+from sqlalchemy import table, column, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+#Вид сущности -> таблица и внешний ключ в comics
+ENTITIES = {"publisher": ("publishers", "publisher_id"), "writer": ("writers", "writer_id"),
+            "artist": ("artists", "artist_id")}
+#Поля итогов, которые можно пересчитать по comics
+TOTALS = ("comics", "stock", "value", "in_stock")
+COUNTERS = ("comics", "stock", "value")
+#Расхождений в отчёте проверки не больше
+MAX_MISMATCHES = 100
+
+catalog_totals = table("catalog_totals", *[column(name) for name in ("id", *TOTALS, "publishers", "writers", "artists")])
+entity_stats = table("entity_stats", column("kind"), column("entity_id"), *[column(name) for name in COUNTERS])
+
+def entity_upsert(kind: str, row: str, sign: str, condition: str = "true"):
+    """Прибавление (sign="+") или вычитание строки comics к счётчикам сущности"""
+    fk = ENTITIES[kind][1]
+    statement = f"""INSERT INTO entity_stats(kind, entity_id, comics, stock, value)
+            SELECT '{kind}', {row}.{fk}, {sign}1, {sign}{row}.amount, {sign}{row}.amount * {row}.price WHERE {condition}
+            ON CONFLICT (kind, entity_id) DO UPDATE SET comics = comics + excluded.comics,
+                stock = stock + excluded.stock, value = value + excluded.value;"""
+    if sign == "-":
+        #Строки для сущности без комиксов не храним
+        statement += f"""
+            DELETE FROM entity_stats WHERE kind = '{kind}' AND entity_id = {row}.{fk} AND comics = 0;"""
+    return statement
+
+def totals_delta(row: str, sign: str):
+    """Изменение итогов каталога на одну строку comics"""
+    return f"""UPDATE catalog_totals SET comics = comics {sign} 1, stock = stock {sign} {row}.amount,
+            value = value {sign} {row}.amount * {row}.price, in_stock = in_stock {sign} ({row}.amount > 0) WHERE id = 1;"""
+
+def entity_update(kind: str):
+    """Изменение комикса: перенос между сущностями или поправка на разницу остатка и цены"""
+    fk = ENTITIES[kind][1]
+    return f"""{entity_upsert(kind, "old", "-", f"old.{fk} != new.{fk}")}
+        {entity_upsert(kind, "new", "", f"old.{fk} != new.{fk}")}
+        UPDATE entity_stats SET stock = stock + new.amount - old.amount,
+            value = value + new.amount * new.price - old.amount * old.price
+            WHERE kind = '{kind}' AND entity_id = new.{fk} AND old.{fk} = new.{fk};"""
+
+def entity_triggers(kind: str):
+    """Счётчик сущностей в итогах и удаление строки статистики вместе с сущностью"""
+    name = ENTITIES[kind][0]
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS stats_{name}_ai AFTER INSERT ON {name} BEGIN
+            UPDATE catalog_totals SET {name} = {name} + 1 WHERE id = 1;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_{name}_ad AFTER DELETE ON {name} BEGIN
+            UPDATE catalog_totals SET {name} = {name} - 1 WHERE id = 1;
+            DELETE FROM entity_stats WHERE kind = '{kind}' AND entity_id = old.id;
+        END""",
+    ]
+
+DDL = [
+    """CREATE TABLE IF NOT EXISTS catalog_totals (id INTEGER PRIMARY KEY CHECK (id = 1),
+        comics INTEGER NOT NULL DEFAULT 0, stock INTEGER NOT NULL DEFAULT 0, value REAL NOT NULL DEFAULT 0,
+        in_stock INTEGER NOT NULL DEFAULT 0, publishers INTEGER NOT NULL DEFAULT 0,
+        writers INTEGER NOT NULL DEFAULT 0, artists INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE TABLE IF NOT EXISTS entity_stats (kind TEXT NOT NULL, entity_id INTEGER NOT NULL,
+        comics INTEGER NOT NULL, stock INTEGER NOT NULL, value REAL NOT NULL,
+        PRIMARY KEY (kind, entity_id)) WITHOUT ROWID""",
+    #Сортировки списка сущностей
+    "CREATE INDEX IF NOT EXISTS ix_entity_stats_comics ON entity_stats (kind, comics, entity_id)",
+    "CREATE INDEX IF NOT EXISTS ix_entity_stats_stock ON entity_stats (kind, stock, entity_id)",
+    "CREATE INDEX IF NOT EXISTS ix_entity_stats_value ON entity_stats (kind, value, entity_id)",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_comics_ai AFTER INSERT ON comics BEGIN
+        {totals_delta("new", "+")}
+        {"".join(entity_upsert(kind, "new", "") for kind in ENTITIES)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_comics_ad AFTER DELETE ON comics BEGIN
+        {totals_delta("old", "-")}
+        {"".join(entity_upsert(kind, "old", "-") for kind in ENTITIES)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_comics_au
+        AFTER UPDATE OF amount, price, publisher_id, writer_id, artist_id ON comics BEGIN
+        UPDATE catalog_totals SET stock = stock + new.amount - old.amount,
+            value = value + new.amount * new.price - old.amount * old.price,
+            in_stock = in_stock + (new.amount > 0) - (old.amount > 0) WHERE id = 1;
+        {"".join(entity_update(kind) for kind in ENTITIES)}
+    END""",
+    *[statement for kind in ENTITIES for statement in entity_triggers(kind)],
+]
+
+def actual_totals():
+    """Итоги, посчитанные заново по таблицам"""
+    return """SELECT 1, count(*), coalesce(sum(amount), 0), coalesce(sum(amount * price), 0),
+        coalesce(sum(amount > 0), 0), (SELECT count(*) FROM publishers), (SELECT count(*) FROM writers),
+        (SELECT count(*) FROM artists) FROM comics"""
+
+def actual_entities(kind: str):
+    """Счётчики сущностей вида kind, посчитанные заново"""
+    fk = ENTITIES[kind][1]
+    return f"""SELECT '{kind}', {fk}, count(*), sum(amount), sum(amount * price) FROM comics GROUP BY {fk}"""
+
+REBUILD = [
+    "DELETE FROM catalog_totals",
+    f"INSERT INTO catalog_totals (id, {', '.join(TOTALS)}, publishers, writers, artists) {actual_totals()}",
+    "DELETE FROM entity_stats",
+    *[f"INSERT INTO entity_stats (kind, entity_id, {', '.join(COUNTERS)}) {actual_entities(kind)}"
+      for kind in ENTITIES],
+]
+
+def install(conn):
+    """Создание таблиц и триггеров; при первом запуске счётчики считаются по каталогу"""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_totals'").first()
+    for statement in DDL:
+        conn.exec_driver_sql(statement)
+    if not exists:
+        rebuild(conn)
+
+def rebuild(conn):
+    """Полный пересчёт счётчиков"""
+    for statement in REBUILD:
+        conn.exec_driver_sql(statement)
+
+def differs(stored, actual):
+    """Значения не совпадают (денежные суммы сравниваются с допуском)"""
+    if isinstance(stored, float) or isinstance(actual, float):
+        return abs((stored or 0) - (actual or 0)) > 1e-6 * max(1.0, abs(actual or 0))
+    return stored != actual
+
+def check(conn):
+    """Сравнение хранимых счётчиков с пересчитанными; возвращает список расхождений"""
+    mismatches = []
+    names = ("id", *TOTALS, "publishers", "writers", "artists")
+    stored = conn.exec_driver_sql("SELECT * FROM catalog_totals WHERE id = 1").first()
+    actual = conn.exec_driver_sql(actual_totals()).first()
+    for name, have, want in zip(names, stored or [None] * len(names), actual):
+        if differs(have, want):
+            mismatches.append({"kind": "totals", "field": name, "stored": have, "actual": want})
+    for kind in ENTITIES:
+        have = {row[1]: row[2:] for row in conn.exec_driver_sql(
+            f"SELECT * FROM entity_stats WHERE kind = '{kind}'")}
+        want = {row[1]: row[2:] for row in conn.exec_driver_sql(actual_entities(kind))}
+        for entity_id in sorted(have.keys() | want.keys()):
+            for name, stored_value, actual_value in zip(COUNTERS, have.get(entity_id, (0, 0, 0.0)),
+                                                        want.get(entity_id, (0, 0, 0.0))):
+                if differs(stored_value, actual_value):
+                    mismatches.append({"kind": kind, "id": entity_id, "field": name,
+                                       "stored": stored_value, "actual": actual_value})
+            if len(mismatches) >= MAX_MISMATCHES:
+                return mismatches
+    return mismatches
+
+async def totals(db: AsyncSession):
+    """Итоги каталога: одна строка по первичному ключу"""
+    row = (await db.execute(select(catalog_totals).where(catalog_totals.c.id == 1))).mappings().first()
+    result = dict(row) if row else {name: 0 for name in ("id", *TOTALS, "publishers", "writers", "artists")}
+    result.pop("id")
+    return result
+
+def entity_select(kind: str, model):
+    """Запрос счётчиков сущностей, у которых есть комиксы, с их именами"""
+    return (select(model.id, model.name, entity_stats.c.comics, entity_stats.c.stock, entity_stats.c.value)
+            .join(entity_stats, (entity_stats.c.entity_id == model.id) & (entity_stats.c.kind == kind)))
+
+async def entity(kind: str, model, entity_id: int, db: AsyncSession):
+    """Счётчики одной сущности; нули, если у неё нет комиксов"""
+    row = (await db.execute(
+        select(model.id, model.name, *[func.coalesce(entity_stats.c[name], 0).label(name) for name in COUNTERS])
+        .outerjoin(entity_stats, (entity_stats.c.entity_id == model.id) & (entity_stats.c.kind == kind))
+        .where(model.id == entity_id))).mappings().first()
+    return dict(row) if row else None
+
+async def main(command: str):
+    """Пересчёт или проверка из командной строки"""
+    from .database import engine
+    async with engine.begin() as conn:
+        await conn.run_sync(install)
+        if command == "rebuild":
+            await conn.run_sync(rebuild)
+            print("rebuilt")
+        else:
+            mismatches = await conn.run_sync(check)
+            for mismatch in mismatches:
+                print(mismatch)
+            print("ok" if not mismatches else f"{len(mismatches)} mismatches")
+    await engine.dispose()
+    return 1 if command != "rebuild" and mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "check")))
@@ -0,0 +1,13 @@
+"""Шаблоны для проверки названий и имён"""
+import re
+
+#Название комикса от 1 до 100 символов, также цифры и спец. символы
+REG_COMIC = "^[A-Za-z0-9\\s\\-_,\\.:;()''""#]+$"
+#ФИО сценариста или художника
+REG_NAME = "^([a-zA-Z]{2,}\\s[a-zA-Z]{1,}\\'?-?[a-zA-Z]{2,}\\s?([a-zA-Z]{1,})?)"
+#Название издателя
+REG_PUB = "^[A-Za-z0-9\\s\\-_,\\.:;()''""!]+$"
+
+def matches(valid: str, reg: str):
+    """Синхронная проверка строки по шаблону"""
+    return re.search(reg, valid) is not None
@@ -0,0 +1,258 @@
+"""Нагрузочные замеры Auth, Catal и Basket
+
+Запуск из корня репозитория:
+    python bench/run.py --comics 100000 --out results.json
+    python bench/run.py --compare results.json --threshold 0.15
+Против запущенных uvicorn:
+    python bench/run.py --auth-url http://localhost:8000 --catal-url http://localhost:8001 \\
+        --basket-url http://localhost:8002
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from services import Services, configure, ROOT
+
+SCENARIOS = ("bulk_import", "register", "login", "catalog_browse", "search", "buy_contention", "order_consumption")
+PASSWORD = "Bench1!x"
+
+def word(i: int, length: int = 6):
+    """Детерминированное слово из латинских букв для имени"""
+    letters = []
+    for _ in range(length):
+        i, rest = divmod(i, 26)
+        letters.append(string.ascii_lowercase[rest])
+    return "".join(letters).capitalize()
+
+def comic_row(i: int, writers: int, artists: int, publishers: int):
+    """Синтетический комикс"""
+    return {"title": f"{word(i % 5000, 5)} Issue {i}", "amount": str(random.randint(0, 50)),
+            "price": str(random.randint(1, 100)), "publisher": f"Publisher {word(i % publishers)}",
+            "writer": f"Writer {word(i % writers)}", "artist": f"Artist {word(i % artists)}"}
+
+def percentile(values: list, p: float):
+    """Перцентиль по ближайшему рангу, мс"""
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))], 3)
+
+async def load(call, total: int, concurrency: int):
+    """total вызовов call(i) в concurrency параллельных задачах; call возвращает True при успехе"""
+    latencies = []
+    errors = 0
+    numbers = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in numbers:
+            start = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    return {"requests": total, "errors": errors, "seconds": round(wall, 3),
+            "throughput": round(total / wall, 1) if wall else None,
+            "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99)}
+
+async def bulk_import(services: Services, args):
+    """Загрузка синтетического каталога пачками через /create/comics/bulk"""
+    catal = services.clients["catal"]
+    batch = 5000
+    writers, artists, publishers = max(1, args.comics // 20), max(1, args.comics // 20), max(1, args.comics // 500)
+
+    async def call(i):
+        rows = [comic_row(n, writers, artists, publishers) for n in range(i * batch, min(args.comics, (i + 1) * batch))]
+        response = await catal.post("/create/comics/bulk", json=rows)
+        return response.status_code == 200 and response.json()["invalid"] == 0
+
+    result = await load(call, -(-args.comics // batch), 1)
+    result["rows_per_second"] = round(args.comics / result["seconds"], 1)
+    return result
+
+async def register(services: Services, args):
+    """Поток регистраций (bcrypt)"""
+    auth = services.clients["auth"]
+
+    async def call(i):
+        response = await auth.post("/register", json={"email": f"user{i}@bench.io", "password": PASSWORD})
+        return response.status_code == 200
+
+    return await load(call, args.users, args.concurrency)
+
+async def login(services: Services, args):
+    """Поток входов (bcrypt checkpw)"""
+    auth = services.clients["auth"]
+
+    async def call(i):
+        response = await auth.post("/login", json={"email": f"user{i % args.users}@bench.io", "password": PASSWORD})
+        return response.status_code == 200
+
+    return await load(call, args.requests, args.concurrency)
+
+async def catalog_browse(services: Services, args):
+    """Листание каталога со случайными фильтрами, сортировкой и переходом по курсору"""
+    catal = services.clients["catal"]
+    sorts = ["id", "-id", "price", "-price", "title"]
+
+    async def call(i):
+        params = {"limit": random.choice([20, 50, 100]), "sort": random.choice(sorts)}
+        if random.random() < 0.3:
+            params["min_price"] = random.randint(1, 50)
+        if random.random() < 0.3:
+            params["in_stock"] = "true"
+        response = await catal.get("/view/comics", params=params)
+        if response.status_code != 200:
+            return False
+        cursor = response.json().get("next_cursor")
+        if cursor:
+            response = await catal.get("/view/comics", params={**params, "cursor": cursor})
+        return response.status_code == 200
+
+    return await load(call, args.requests, args.concurrency)
+
+async def search(services: Services, args):
+    """Поиск по случайным префиксам"""
+    catal = services.clients["catal"]
+
+    async def call(i):
+        q = word(random.randrange(5000), 5)[:random.randint(2, 5)]
+        response = await catal.get("/search", params={"q": q, "facets": str(i % 2 == 0).lower()})
+        return response.status_code == 200
+
+    return await load(call, args.requests, args.concurrency)
+
+async def buy_contention(services: Services, args):
+    """Множество покупателей одного выпуска: продано ровно столько, сколько было"""
+    catal, auth = services.clients["catal"], services.clients["auth"]
+    stock = max(1, args.requests // 4)
+    title = f"Hot Issue {random.randrange(10 ** 9)}"
+    await catal.post("/create/comic", json={"title": title, "amount": str(stock), "price": "5",
+                                            "publisher": "Bench Press", "writer": "Hot Writer",
+                                            "artist": "Hot Artist"})
+    await auth.post("/register", json={"email": "buyer@bench.io", "password": PASSWORD})
+    response = await auth.post("/login", json={"email": "buyer@bench.io", "password": PASSWORD})
+    for name, value in response.cookies.items():
+        catal.cookies.set(name, value)
+    sold = 0
+
+    async def call(i):
+        nonlocal sold
+        response = await catal.post("/buy", json={"items": [{"title": title, "qty": 1}]})
+        sold += response.status_code == 200
+        return response.status_code in (200, 409)
+
+    result = await load(call, args.requests, args.concurrency)
+    left = (await catal.get("/view/comic", params={"title": title})).json()["amount"]
+    result.update(stock = stock, sold = sold, oversold = sold > stock or left < 0)
+    return result
+
+async def order_consumption(services: Services, args):
+    """Скорость, с которой Basket сохраняет заказы из очереди (только в процессе)"""
+    if not services.in_process:
+        return None
+    broker = services.modules["basket"]["broker"]
+    consumer = services.modules["basket"]["main"].order_consumer
+    total = args.requests
+    before = consumer.persisted
+    start = time.perf_counter()
+    for i in range(total):
+        order = {"message_id": f"bench-{start}-{i}", "email": f"user{i}@bench.io", "price": 5,
+                 "items": [{"comic_id": 1, "title": "Bench", "qty": 1, "price": 5}]}
+        broker.memory_broker.publish(broker.settings.queue, json.dumps(order).encode(), order["message_id"])
+    while consumer.persisted - before < total and time.perf_counter() - start < 120:
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - start
+    done = consumer.persisted - before
+    return {"requests": total, "errors": total - done, "seconds": round(wall, 3),
+            "throughput": round(done / wall, 1), "p50_ms": None, "p95_ms": None, "p99_ms": None}
+
+def compare(old: dict, new: dict, threshold: float):
+    """Сценарии, где пропускная способность упала или p95 вырос больше чем на threshold"""
+    regressions = []
+    for name, result in new["scenarios"].items():
+        base = old.get("scenarios", {}).get(name)
+        if not base or not result:
+            continue
+        if base.get("throughput") and result.get("throughput") is not None \
+                and result["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['throughput']} -> {result['throughput']}")
+        if base.get("p95_ms") and result.get("p95_ms") is not None \
+                and result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+    return regressions
+
+def git_commit():
+    """Текущий коммит для подписи результатов"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    """Выполнение выбранных сценариев"""
+    urls = None
+    if args.auth_url or args.catal_url or args.basket_url:
+        urls = {"auth": args.auth_url, "catal": args.catal_url, "basket": args.basket_url}
+    results = {}
+    async with Services(urls) as services:
+        for name in args.scenarios:
+            print(f"{name}...", file=sys.stderr, flush=True)
+            results[name] = await globals()[name](services, args)
+            print(f"  {results[name]}", file=sys.stderr, flush=True)
+    return {"meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "in_process": urls is None, "comics": args.comics, "users": args.users,
+                     "requests": args.requests, "concurrency": args.concurrency},
+            "scenarios": results}
+
+def main():
+    """Разбор аргументов, замеры, сохранение и сравнение результатов"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--comics", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", type=Path, help="каталог для БД (по умолчанию временный)")
+    parser.add_argument("--auth-url")
+    parser.add_argument("--catal-url")
+    parser.add_argument("--basket-url")
+    parser.add_argument("--out", type=Path, help="куда записать JSON с результатами")
+    parser.add_argument("--compare", type=Path, help="JSON с прошлыми результатами")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    configure(workdir)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(output)
+    print(output)
+    if args.compare:
+        regressions = compare(json.loads(args.compare.read_text()), report, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Запуск сервисов для замеров: в процессе через ASGI или по адресам uvicorn"""
+import importlib
+import os
+import sys
+from contextlib import AsyncExitStack
+from pathlib import Path
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVICES = {"auth": "Auth", "catal": "Catal", "basket": "Basket"}
+DATABASES = {"auth": ("AUTH_DB_URL", "clients.db"), "catal": ("CATAL_DB_URL", "catal.db"),
+             "basket": ("BASKET_DB_URL", "basket.db")}
+
+def configure(workdir: Path):
+    """Отдельные файлы БД и брокер в памяти, чтобы не трогать рабочие данные; без лимитов допуска"""
+    for env, filename in DATABASES.values():
+        os.environ.setdefault(env, f"sqlite+aiosqlite:///{workdir / filename}")
+    os.environ.setdefault("CATAL_BROKER_BACKEND", "memory")
+    os.environ.setdefault("BASKET_BROKER_BACKEND", "memory")
+    #Весь трафик замеров идёт с одного адреса: лимиты допуска исказили бы результаты
+    os.environ.setdefault("ADMISSION_ENABLED", "0")
+
+def load_service(name: str):
+    """Импорт пакета сервиса; возвращает его модули по коротким именам (main, broker, ...)"""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    package = SERVICES[name]
+    importlib.import_module(f"{package}.main")
+    return {module.rsplit(".", 1)[1]: sys.modules[module] for module in list(sys.modules)
+            if module.startswith(f"{package}.")}
+
+class Services:
+    """Клиенты httpx для трёх сервисов"""
+
+    def __init__(self, urls: dict | None = None):
+        self.urls = urls
+        self.modules = {}
+        self.clients = {}
+        self.stack = AsyncExitStack()
+
+    @property
+    def in_process(self):
+        """Сервисы запущены в этом процессе"""
+        return not self.urls
+
+    async def __aenter__(self):
+        if self.in_process:
+            #Брокер в памяти общий (common.broker), Catal и Basket видят одну очередь
+            for name in SERVICES:
+                self.modules[name] = load_service(name)
+        for name in SERVICES:
+            if self.in_process:
+                app = self.modules[name]["main"].app
+                await self.stack.enter_async_context(app.router.lifespan_context(app))
+                client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=f"http://{name}",
+                                           timeout=None)
+            else:
+                client = httpx.AsyncClient(base_url=self.urls[name], timeout=None)
+            self.clients[name] = await self.stack.enter_async_context(client)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stack.aclose()
@@ -0,0 +1,76 @@
+"""Auth, Catal и Basket в одном процессе под префиксами /auth, /catal, /basket
+
+Запуск из корня репозитория:
+    python launcher.py --workers 4
+или одним процессом:
+    uvicorn combined:app
+"""
+import logging
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+from fastapi import FastAPI
+from pydantic import BaseSettings
+from Auth.main import app as auth_app, init_schema as init_auth
+from Catal.main import app as catal_app, init_schema as init_catal
+from Basket.main import app as basket_app, init_schema as init_basket
+from Auth.database import engine as auth_engine
+from Catal.database import engine as catal_engine
+from Basket.database import engine as basket_engine
+
+logger = logging.getLogger("combined")
+
+class CombinedSettings(BaseSettings):
+    """Настройки общего процесса (переменные окружения COMBINED_*)"""
+    #Сколько может длиться запуск всех сервисов, с; дольше - предупреждение в лог
+    startup_target: float = 2.0
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "COMBINED_"
+
+settings = CombinedSettings()
+#Префикс -> приложение сервиса
+APPS = {"auth": auth_app, "catal": catal_app, "basket": basket_app}
+#Подготовка схемы каждого сервиса; мастер launcher.py выполняет её один раз до запуска рабочих
+SCHEMAS = {"auth": init_auth, "catal": init_catal, "basket": init_basket}
+ENGINES = (auth_engine, catal_engine, basket_engine)
+#Время запуска последнего старта, с
+startup = {}
+
+async def init_schemas():
+    """Схемы всех сервисов; возвращает время каждого, с"""
+    timings = {}
+    for name, init_schema in SCHEMAS.items():
+        started = time.perf_counter()
+        await init_schema()
+        timings[name] = round(time.perf_counter() - started, 4)
+    return timings
+
+async def dispose_engines():
+    """Закрытие пулов соединений (перед fork соединения SQLite не должны переходить в дочерние процессы)"""
+    for engine in ENGINES:
+        await engine.dispose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск сервисов по очереди с замером времени; остановка в обратном порядке"""
+    started = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        for name, service in APPS.items():
+            begin = time.perf_counter()
+            await stack.enter_async_context(service.router.lifespan_context(service))
+            startup[name] = round(time.perf_counter() - begin, 4)
+        startup["total"] = round(time.perf_counter() - started, 4)
+        if startup["total"] > settings.startup_target:
+            logger.warning("Startup took %.3f s (target %.3f s): %s", startup["total"], settings.startup_target,
+                           startup)
+        yield
+
+app = FastAPI(lifespan = lifespan)
+for prefix, service in APPS.items():
+    app.mount(f"/{prefix}", service)
+
+@app.get("/startup")
+def startup_timings():
+    """Время запуска каждого сервиса и общее, с"""
+    return {"target": settings.startup_target, "timings": startup}
@@ -0,0 +1 @@
+"""Общий код сервисов: настройки JWT, метрики, миграции, брокер в памяти"""
@@ -0,0 +1,437 @@
+"""Допуск запросов к тяжёлым маршрутам: лимиты частоты и ограничение одновременных запросов
+
+Маршруты делятся на классы (вход и регистрация, запись в каталог, покупка). Для каждого
+класса действуют:
+    - корзина токенов на клиента (subject из cookie с токеном, иначе адрес) и на маршрут:
+      превышение - сразу 429 с Retry-After;
+    - не больше concurrency запросов класса одновременно, остальные ждут в очереди длиной
+      не больше queue; если ожидание по оценке длиннее budget или очередь полна - сразу
+      503 с Retry-After. Так запросы, которые всё же допущены, не стоят в очереди дольше
+      budget, и их задержка не растёт вместе с нагрузкой.
+
+Лимиты меняются без перезапуска через PUT /admin/limits/{класс} (роль admin и subject из
+ADMISSION_ADMINS). Корзины токенов живут в памяти процесса; с ADMISSION_SHARED_DB они
+общие для всех процессов (launcher.py) и хранятся в файле SQLite, туда же пишутся
+изменённые лимиты. Очередь и счётчик одновременных запросов у каждого процесса свои.
+"""
+import asyncio
+import math
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, BaseSettings, confloat, conint
+from .jwt import Claims, current_user, verifier
+from .metrics import registry
+
+class Limits(BaseModel):
+    """Лимиты класса маршрутов; 0 - ограничения нет"""
+    #Запросов в секунду от одного клиента и запас сверх этого
+    client_rate: confloat(ge=0) = 0
+    client_burst: confloat(ge=1) = 1
+    #Запросов в секунду на маршрут от всех клиентов
+    route_rate: confloat(ge=0) = 0
+    route_burst: confloat(ge=1) = 1
+    #Сколько запросов класса выполняется одновременно и сколько ждёт
+    concurrency: conint(ge=0) = 0
+    queue: conint(ge=0) = 0
+    #Дольше этого запрос в очереди не ждёт, с
+    budget: confloat(gt=0) = 0.5
+
+class AdmissionSettings(BaseSettings):
+    """Настройки допуска (переменные окружения ADMISSION_*)"""
+    enabled: bool = True
+    #Лимиты по классам; ADMISSION_CLASSES='{"auth": {...}}' заменяет их целиком
+    classes: dict[str, Limits] = {
+        #Без токена клиент - адрес: за NAT и прокси (см. trusted_proxies) за ним много пользователей
+        "auth": Limits(client_rate=5, client_burst=30, route_rate=50, route_burst=100, concurrency=8, queue=32,
+                       budget=1.0),
+        "create": Limits(client_rate=5, client_burst=20, route_rate=200, route_burst=400, concurrency=8, queue=64,
+                         budget=0.5),
+        "buy": Limits(client_rate=5, client_burst=10, route_rate=500, route_burst=1000, concurrency=16, queue=128,
+                      budget=0.5),
+    }
+    #Файл SQLite для корзин и лимитов, общих для процессов; без него всё в памяти процесса
+    shared_db: str | None = None
+    #Сколько ждать блокировку общего файла, мс; не дождались - корзина процесса
+    shared_timeout: int = 20
+    #Как часто перечитывать лимиты из общего файла и удалять старые корзины, с
+    reload_interval: float = 1.0
+    #Сколько корзин клиентов держать в памяти
+    max_buckets: int = 100000
+    #Адреса своих прокси: для запросов от них клиент берётся из X-Forwarded-For
+    trusted_proxies: set[str] = set()
+    #Кому можно менять лимиты: subject токена с ролью admin (роль при регистрации выбирает сам клиент)
+    admins: set[str] = set()
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "ADMISSION_"
+
+class Rejected(Exception):
+    """Запрос не допущен: код ответа и через сколько секунд повторить"""
+
+    def __init__(self, status: int, retry_after: float, reason: str):
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+class Buckets:
+    """Корзины токенов в памяти: ключ -> (токены, время), вытеснение самых давних"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: float, now: float):
+        """0, если токен взят, иначе сколько секунд ждать следующего"""
+        tokens, updated = self.entries.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.entries[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self.entries[key] = (tokens - 1, now)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return 0.0
+
+SHARED_DDL = [
+    """CREATE TABLE IF NOT EXISTS admission_buckets (
+        key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS ix_admission_buckets_updated ON admission_buckets (updated_at)",
+    """CREATE TABLE IF NOT EXISTS admission_limits (
+        name TEXT PRIMARY KEY, body TEXT NOT NULL, updated_at REAL NOT NULL)""",
+]
+
+#Пополнение и списание одним оператором: SQLite выполняет его атомарно для всех процессов
+TAKE_SQL = """INSERT INTO admission_buckets (key, tokens, updated_at) VALUES (:key, :burst - 1, :now)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = min(:burst, tokens + max(0, :now - updated_at) * :rate) - 1, updated_at = :now
+    WHERE min(:burst, tokens + max(0, :now - updated_at) * :rate) >= 1
+    RETURNING tokens"""
+
+class SharedBuckets:
+    """Корзины токенов в файле SQLite, общем для процессов"""
+
+    def __init__(self, path: str, timeout: int):
+        self.path = path
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        """Соединение; состояние корзин не ценно, поэтому без fsync"""
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute(f"PRAGMA busy_timeout = {self.timeout}")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            for statement in SHARED_DDL:
+                connection.execute(statement)
+            self.connection = connection
+        return self.connection
+
+    def take(self, key: str, rate: float, burst: float, now: float):
+        """0, если токен взят, иначе оценка ожидания следующего токена"""
+        row = self.connect().execute(TAKE_SQL, {"key": key, "rate": rate, "burst": burst, "now": now}).fetchone()
+        return 0.0 if row is not None else 1 / rate
+
+    def save_limits(self, name: str, limits: Limits, now: float):
+        """Лимиты класса для остальных процессов"""
+        self.connect().execute("INSERT OR REPLACE INTO admission_limits (name, body, updated_at) VALUES (?, ?, ?)",
+                               (name, limits.json(), now))
+
+    def read_limits(self, after: float):
+        """Лимиты, изменённые после after: [(класс, Limits, время)]"""
+        rows = self.connect().execute("SELECT name, body, updated_at FROM admission_limits WHERE updated_at > ?",
+                                      (after,))
+        return [(name, Limits.parse_raw(body), updated_at) for name, body, updated_at in rows]
+
+    def prune(self, before: float):
+        """Удаление корзин, не менявшихся с before (они давно полные)"""
+        self.connect().execute("DELETE FROM admission_buckets WHERE updated_at < ?", (before,))
+
+    def close(self):
+        """Закрытие соединения"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class Gate:
+    """Не больше concurrency одновременных запросов класса и ограниченная очередь"""
+
+    def __init__(self):
+        self.active = 0
+        self.waiters = deque()
+        #Скользящее среднее времени выполнения, с: по нему оценивается ожидание в очереди
+        self.service_time = None
+
+    def estimate(self, limits: Limits):
+        """Сколько ждать новому запросу в очереди, с"""
+        if self.service_time is None:
+            return 0.0
+        return (len(self.waiters) + 1) * self.service_time / limits.concurrency
+
+    async def enter(self, limits: Limits):
+        """Занять место; Rejected, если очередь полна или ожидание не уложится в budget"""
+        if not limits.concurrency or (self.active < limits.concurrency and not self.waiters):
+            self.active += 1
+            return
+        estimate = self.estimate(limits)
+        if len(self.waiters) >= limits.queue or estimate > limits.budget:
+            raise Rejected(503, max(estimate, limits.budget), "overloaded")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), limits.budget)
+        except asyncio.TimeoutError:
+            self.abandon(waiter)
+            raise Rejected(503, limits.budget, "timeout")
+        except asyncio.CancelledError:
+            self.abandon(waiter)
+            raise
+
+    def abandon(self, waiter):
+        """Ожидающий ушёл; если место ему уже передали - отдать следующему"""
+        if waiter.done():
+            self.leave(None)
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+
+    def leave(self, elapsed: float | None):
+        """Освободить место: следующему в очереди или совсем"""
+        if elapsed is not None:
+            self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+class ClassStats:
+    """Счётчики класса"""
+    __slots__ = ("admitted", "throttled", "shed", "queued")
+
+    def __init__(self):
+        self.admitted = 0
+        self.throttled = 0
+        self.shed = 0
+        self.queued = 0
+
+class Admission:
+    """Лимиты, корзины и очереди процесса"""
+
+    def __init__(self, settings: AdmissionSettings):
+        self.settings = settings
+        self.limits = dict(settings.classes)
+        self.buckets = Buckets(settings.max_buckets)
+        self.shared = SharedBuckets(settings.shared_db, settings.shared_timeout) if settings.shared_db else None
+        self.gates = {}
+        self.stats_by_class = {}
+        self.loaded_at = 0.0
+        self.shared_errors = 0
+        self.task = None
+        self.users = 0
+
+    def gate(self, name: str):
+        """Очередь класса"""
+        gate = self.gates.get(name)
+        if gate is None:
+            gate = self.gates[name] = Gate()
+        return gate
+
+    def counters(self, name: str):
+        """Счётчики класса"""
+        counters = self.stats_by_class.get(name)
+        if counters is None:
+            counters = self.stats_by_class[name] = ClassStats()
+        return counters
+
+    def take(self, key: str, rate: float, burst: float, now: float):
+        """Токен из общей корзины, а если файл занят или недоступен - из корзины процесса"""
+        if self.shared is not None:
+            try:
+                return self.shared.take(key, rate, burst, now)
+            except sqlite3.Error:
+                self.shared_errors += 1
+        return self.buckets.take(key, rate, burst, now)
+
+    def throttle(self, name: str, limits: Limits, client: str, route: str):
+        """Проверка корзин клиента и маршрута; Rejected с 429, если токена нет"""
+        now = time.time()
+        for rate, burst, key in ((limits.client_rate, limits.client_burst, f"{name}|c|{client}"),
+                                 (limits.route_rate, limits.route_burst, f"{name}|r|{route}")):
+            if rate:
+                wait = self.take(key, rate, burst, now)
+                if wait:
+                    raise Rejected(429, wait, "rate")
+
+    async def admit(self, name: str, client: str, route: str):
+        """Допуск запроса класса name; Rejected, если нельзя"""
+        limits = self.limits.get(name)
+        if limits is None or not self.settings.enabled:
+            return None
+        counters = self.counters(name)
+        try:
+            self.throttle(name, limits, client, route)
+            gate = self.gate(name)
+            if gate.waiters or (limits.concurrency and gate.active >= limits.concurrency):
+                counters.queued += 1
+            await gate.enter(limits)
+        except Rejected as rejected:
+            if rejected.status == 429:
+                counters.throttled += 1
+            else:
+                counters.shed += 1
+            raise
+        counters.admitted += 1
+        return gate
+
+    def configure(self, name: str, limits: Limits):
+        """Новые лимиты класса; с общим файлом - и для остальных процессов"""
+        self.limits[name] = limits
+        if self.shared is not None:
+            self.shared.save_limits(name, limits, time.time())
+
+    def reload(self):
+        """Лимиты, изменённые другими процессами, и очистка старых корзин"""
+        for name, limits, updated_at in self.shared.read_limits(self.loaded_at):
+            self.limits[name] = limits
+            self.loaded_at = max(self.loaded_at, updated_at)
+        #Корзина, не тронутая час, давно полная: строка не нужна
+        self.shared.prune(time.time() - 3600)
+
+    async def run(self):
+        """Периодическое чтение общего файла"""
+        while True:
+            try:
+                self.reload()
+            except sqlite3.Error:
+                self.shared_errors += 1
+            await asyncio.sleep(self.settings.reload_interval)
+
+    async def start(self):
+        """Запуск чтения общего файла (один на процесс, сколько бы сервисов в нём ни было)"""
+        self.users += 1
+        if self.shared is not None and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка, когда её вызвал последний сервис процесса"""
+        self.users -= 1
+        if self.users > 0 or self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        self.shared.close()
+
+    def stats(self):
+        """Лимиты, очереди и счётчики по классам"""
+        result = {}
+        for name, limits in self.limits.items():
+            gate, counters = self.gate(name), self.counters(name)
+            result[name] = {"limits": limits.dict(), "active": gate.active, "waiting": len(gate.waiters),
+                            "service_time": gate.service_time, **{key: getattr(counters, key)
+                                                                 for key in ClassStats.__slots__}}
+        return {"enabled": self.settings.enabled, "shared": self.settings.shared_db is not None,
+                "shared_errors": self.shared_errors, "classes": result}
+
+def client_address(scope, request: Request, trusted_proxies: set):
+    """Адрес клиента: за своими прокси - последний адрес X-Forwarded-For, добавленный не ими"""
+    address = scope["client"][0] if scope.get("client") else "unknown"
+    if address in trusted_proxies:
+        for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+            address = hop.strip() or address
+            if address not in trusted_proxies:
+                break
+    return address
+
+def client_key(scope, trusted_proxies: set):
+    """Клиент для лимитов: subject проверенного токена, иначе адрес"""
+    request = Request(scope)
+    try:
+        return "u:" + verifier.verify(verifier.token(request)).subject
+    except HTTPException:
+        pass
+    return "ip:" + client_address(scope, request, trusted_proxies)
+
+class AdmissionMiddleware:
+    """ASGI-прослойка: допуск запросов к маршрутам из rules до их обработки"""
+
+    def __init__(self, app, rules: dict):
+        self.app = app
+        #Путь -> класс; путь с "/" на конце - префикс
+        self.exact = {path: name for path, name in rules.items() if not path.endswith("/")}
+        self.prefixes = [(path, name) for path, name in rules.items() if path.endswith("/")]
+
+    def match(self, path: str):
+        """Класс маршрута или None"""
+        name = self.exact.get(path)
+        if name is None:
+            for prefix, prefix_name in self.prefixes:
+                if path.startswith(prefix):
+                    return prefix_name
+        return name
+
+    async def __call__(self, scope, receive, send):
+        name = self.match(scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            gate = await admission.admit(name, client_key(scope, admission.settings.trusted_proxies), scope["path"])
+        except Rejected as rejected:
+            detail = "Too many requests" if rejected.status == 429 else "Service is overloaded, try again later"
+            response = JSONResponse(status_code=rejected.status, content={"detail": detail},
+                                    headers={"Retry-After": str(max(1, math.ceil(rejected.retry_after)))})
+            await response(scope, receive, send)
+            return
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.leave(time.perf_counter() - started)
+
+router = APIRouter()
+
+def require_admin(user: Claims = Depends(current_user)):
+    """Зависимость FastAPI: роль admin и subject из ADMISSION_ADMINS"""
+    if user.role != "admin" or user.subject not in admission.settings.admins:
+        raise HTTPException(status_code=403,detail="Permission denied")
+    return user
+
+@router.get("/admin/limits")
+async def get_limits(user: Claims = Depends(require_admin)):
+    """Лимиты и состояние очередей по классам"""
+    return admission.stats()
+
+@router.put("/admin/limits/{name}")
+async def put_limits(name: str, limits: Limits, user: Claims = Depends(require_admin)):
+    """Новые лимиты класса без перезапуска"""
+    if name not in admission.limits:
+        raise HTTPException(status_code=404,detail="Unknown class")
+    admission.configure(name, limits)
+    return {"msg":"Limits updated", "limits": limits.dict()}
+
+def install(app: FastAPI, rules: dict):
+    """Подключение прослойки с правилами сервиса и маршрутов /admin/limits"""
+    app.add_middleware(AdmissionMiddleware, rules=rules)
+    app.include_router(router)
+
+settings = AdmissionSettings()
+admission = Admission(settings)
+registry.callback("admission_admitted_total", "Requests admitted to limited routes",
+                  lambda: sum(counters.admitted for counters in admission.stats_by_class.values()), "counter")
+registry.callback("admission_throttled_total", "Requests rejected with 429 by rate limits",
+                  lambda: sum(counters.throttled for counters in admission.stats_by_class.values()), "counter")
+registry.callback("admission_shed_total", "Requests rejected with 503 by concurrency limits",
+                  lambda: sum(counters.shed for counters in admission.stats_by_class.values()), "counter")
+registry.callback("admission_waiting", "Requests waiting in admission queues",
+                  lambda: sum(len(gate.waiters) for gate in admission.gates.values()))
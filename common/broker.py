@@ -0,0 +1,402 @@
+"""Брокер сообщений для всех сервисов: RabbitMQ через pika или очереди в памяти процесса
+
+Настройки у каждого сервиса свои (CATAL_BROKER_*, BASKET_BROKER_*); здесь - транспорты,
+издатель и заменитель RabbitMQ в памяти, общий для Catal и Basket в одном процессе.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pika import BlockingConnection, ConnectionParameters, BasicProperties
+from pika.exceptions import AMQPError
+from pydantic import BaseModel
+
+class InMemoryBroker:
+    """Заменитель RabbitMQ: очереди в памяти с подтверждением получения"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.unacked = {}
+        self.next_tag = 0
+
+    def publish(self, queue: str, body: bytes, message_id: str):
+        """Добавление сообщения в очередь"""
+        with self.lock:
+            self.queues.setdefault(queue, deque()).append((body, message_id))
+
+    def get(self, queue: str, max_count: int):
+        """До max_count сообщений: список (tag, body, message_id)"""
+        batch = []
+        with self.lock:
+            pending = self.queues.setdefault(queue, deque())
+            while pending and len(batch) < max_count:
+                body, message_id = pending.popleft()
+                self.next_tag += 1
+                self.unacked[self.next_tag] = (queue, body, message_id)
+                batch.append((self.next_tag, body, message_id))
+        return batch
+
+    def ack(self, tags):
+        """Подтверждение обработки"""
+        with self.lock:
+            for tag in tags:
+                self.unacked.pop(tag, None)
+
+    def nack(self, tags, requeue: bool):
+        """Отказ от сообщений; при requeue они возвращаются в начало очереди, иначе - в её очередь отказов"""
+        with self.lock:
+            for tag in reversed(list(tags)):
+                queue, body, message_id = self.unacked.pop(tag)
+                if requeue:
+                    self.queues[queue].appendleft((body, message_id))
+                else:
+                    self.queues.setdefault(dead_letter_queue(queue), deque()).appendleft((body, message_id))
+
+    def size(self, queue: str):
+        """Число сообщений, ожидающих получения"""
+        with self.lock:
+            return len(self.queues.get(queue, ()))
+
+#Одна очередь на процесс: в совмещённом режиме Catal и Basket работают с ней напрямую
+memory_broker = InMemoryBroker()
+
+class PublisherSettings(BaseModel):
+    """Поля настроек, которые читает Publisher (Catal передаёт свои BrokerSettings с теми же именами)"""
+    backend: str = "rabbitmq"
+    host: str = "localhost"
+    port: int = 5672
+    queue: str = "comics"
+    pool_size: int = 1
+    confirm: bool = True
+    batch_size: int = 100
+    batch_linger_ms: float = 0.0
+    max_pending: int = 10000
+    retries: int = 3
+    reconnect_delay: float = 0.2
+    reconnect_max_delay: float = 5.0
+    #Ключи, которые публикуются в fanout-обменник с тем же именем (каждый получатель видит все сообщения)
+    fanout: set = set()
+
+def dead_letter_queue(queue: str):
+    """Имя очереди отказов для очереди queue"""
+    return f"{queue}.dead"
+
+def declare_queue(channel, queue: str, dead_letter: str | None = None):
+    """Долговечная очередь, отклонённые сообщения которой брокер переносит в долговечную очередь отказов
+
+    Аргументы объявления должны совпадать у отправителя и получателя, иначе брокер
+    закроет канал: отправитель берёт dead_letter_queue(queue), у получателей
+    dead_letter_queue в настройках по умолчанию такой же.
+    """
+    dead_letter = dead_letter or dead_letter_queue(queue)
+    channel.queue_declare(queue = dead_letter, durable = True)
+    channel.queue_declare(queue = queue, durable = True,
+                          arguments = {"x-dead-letter-exchange": "", "x-dead-letter-routing-key": dead_letter})
+
+class BrokerUnavailable(Exception):
+    """Сообщение не удалось отправить после всех попыток"""
+
+class MemoryTransport:
+    """Отправка в InMemoryBroker"""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def publish_batch(self, messages: list):
+        """Отправка пачки (routing_key, body, message_id)"""
+        for routing_key, body, message_id in messages:
+            self.broker.publish(routing_key, body, message_id)
+
+    def close(self):
+        """Закрывать нечего"""
+
+class PikaTransport:
+    """Долгоживущее соединение с RabbitMQ; используется только из одного потока"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.conn = None
+        self.channel = None
+        self.declared = set()
+
+    def connect(self):
+        """Соединение, канал и режим подтверждений"""
+        self.conn = BlockingConnection(ConnectionParameters(host = self.settings.host, port = self.settings.port))
+        self.channel = self.conn.channel()
+        if self.settings.confirm:
+            self.channel.confirm_delivery()
+        self.declared = set()
+
+    def publish_batch(self, messages: list):
+        """Отправка пачки (routing_key, body, message_id); в режиме подтверждений ждёт ack брокера"""
+        if self.conn is None or self.conn.is_closed:
+            self.connect()
+        for routing_key, body, message_id in messages:
+            fanout = routing_key in self.settings.fanout
+            if routing_key not in self.declared:
+                if fanout:
+                    self.channel.exchange_declare(exchange = routing_key, exchange_type = "fanout", durable = True)
+                else:
+                    declare_queue(self.channel, routing_key)
+                self.declared.add(routing_key)
+            #Без подписчиков сообщение fanout просто не доставляется: они догоняют полной выгрузкой
+            self.channel.basic_publish(
+                exchange = routing_key if fanout else "",
+                routing_key = "" if fanout else routing_key,
+                body = body,
+                properties = BasicProperties(message_id = message_id, content_type = "application/json",
+                                             delivery_mode = 2),
+                mandatory = self.settings.confirm and not fanout
+            )
+
+    def close(self):
+        """Закрытие соединения"""
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except AMQPError:
+            pass
+        self.conn = None
+
+class Publisher:
+    """Пул соединений: сообщения из очереди asyncio отправляются пачками в отдельных потоках"""
+
+    def __init__(self, settings, memory: InMemoryBroker):
+        self.settings = settings
+        self.memory = memory
+        self.pending = None
+        self.workers = []
+        self.published = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.batches = 0
+
+    def transport(self):
+        """Новый транспорт согласно настройкам"""
+        if self.settings.backend == "memory":
+            return MemoryTransport(self.memory)
+        return PikaTransport(self.settings)
+
+    async def start(self):
+        """Запуск потоков отправки"""
+        self.pending = asyncio.Queue(self.settings.max_pending)
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.settings.pool_size)]
+
+    async def stop(self):
+        """Отправка оставшихся сообщений и остановка"""
+        if self.pending is not None:
+            await self.pending.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def publish(self, body: bytes, routing_key: str | None = None, message_id: str | None = None):
+        """Отправка сообщения; возвращает его id после подтверждения брокером"""
+        message_id = message_id or uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.pending.put_nowait((routing_key or self.settings.queue, body, message_id, future))
+        except asyncio.QueueFull:
+            raise BrokerUnavailable("Too many pending messages")
+        await future
+        return message_id
+
+    async def next_batch(self):
+        """Первое сообщение ждём, остальные забираем из уже накопившихся"""
+        batch = [await self.pending.get()]
+        if self.settings.batch_linger_ms and self.pending.empty():
+            await asyncio.sleep(self.settings.batch_linger_ms / 1000)
+        while len(batch) < self.settings.batch_size and not self.pending.empty():
+            batch.append(self.pending.get_nowait())
+        return batch
+
+    async def worker(self):
+        """Отправка пачек через собственное соединение в собственном потоке"""
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publisher")
+        transport = self.transport()
+        try:
+            while True:
+                batch = await self.next_batch()
+                try:
+                    error = await self.send(loop, executor, transport, batch)
+                except Exception as e:
+                    #Ошибка вне AMQP (сериализация, транспорт) не должна останавливать поток:
+                    #иначе publish() ждёт вечно, а stop() висит на pending.join()
+                    error = e
+                    await loop.run_in_executor(executor, transport.close)
+                for *_, future in batch:
+                    self.pending.task_done()
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(BrokerUnavailable(str(error)))
+                if error is None:
+                    self.published += len(batch)
+                    self.batches += 1
+                else:
+                    self.failed += len(batch)
+        finally:
+            await loop.run_in_executor(executor, transport.close)
+            executor.shutdown(wait=False)
+
+    async def send(self, loop, executor, transport, batch):
+        """Отправка пачки с переподключением и экспоненциальной задержкой"""
+        messages = [(routing_key, body, message_id) for routing_key, body, message_id, _ in batch]
+        delay = self.settings.reconnect_delay
+        error = None
+        for attempt in range(self.settings.retries + 1):
+            try:
+                await loop.run_in_executor(executor, transport.publish_batch, messages)
+                return None
+            except AMQPError as e:
+                error = e
+                await loop.run_in_executor(executor, transport.close)
+                self.reconnects += 1
+                if attempt < self.settings.retries:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.settings.reconnect_max_delay)
+        return error
+
+    def stats(self):
+        """Счётчики отправки"""
+        return {"published": self.published, "failed": self.failed, "batches": self.batches,
+                "reconnects": self.reconnects, "pending": self.pending.qsize() if self.pending else 0}
+
+class MemoryConsumerTransport:
+    """Получение из InMemoryBroker"""
+
+    def __init__(self, settings, queue: str, broker: InMemoryBroker, on_connect = None):
+        self.settings = settings
+        self.queue = queue
+        self.broker = broker
+        self.on_connect = on_connect
+
+    def fetch(self, max_count: int, timeout: float):
+        """Пачка (tag, body, message_id); пустая, если за timeout ничего не пришло"""
+        if self.on_connect is not None:
+            self.on_connect()
+            self.on_connect = None
+        deadline = time.monotonic() + timeout
+        while True:
+            batch = self.broker.get(self.queue, max_count)
+            if batch or time.monotonic() >= deadline:
+                return batch
+            time.sleep(min(self.settings.batch_linger, timeout))
+
+    def ack(self, tags):
+        """Подтверждение обработки"""
+        self.broker.ack(tags)
+
+    def nack(self, tags, requeue: bool):
+        """Отказ от сообщений"""
+        self.broker.nack(tags, requeue)
+
+    def dead_letter(self, tag, body: bytes, message_id: str | None):
+        """Перенос сообщения в очередь отказов (settings.dead_letter_queue)"""
+        self.broker.publish(self.settings.dead_letter_queue, body, message_id)
+        self.broker.ack([tag])
+
+    def lag(self):
+        """Число сообщений в очереди"""
+        return self.broker.size(self.queue)
+
+    def close(self):
+        """Закрывать нечего"""
+
+class PikaConsumerTransport:
+    """Долгоживущее соединение с RabbitMQ; используется только из одного потока
+
+    При fanout подписка идёт через собственную временную очередь, привязанную
+    к обменнику queue; on_connect() вызывается после каждой подписки, так как
+    сообщения, пришедшие без подписки, потеряны.
+    """
+
+    def __init__(self, settings, queue: str, fanout: bool = False, on_connect = None):
+        self.settings = settings
+        self.queue = queue
+        self.fanout = fanout
+        self.on_connect = on_connect
+        self.consume_queue = queue
+        self.conn = None
+        self.channel = None
+        self.messages = None
+
+    def connect(self):
+        """Соединение, канал с prefetch и подписка на очередь"""
+        self.conn = BlockingConnection(ConnectionParameters(host = self.settings.host, port = self.settings.port))
+        self.channel = self.conn.channel()
+        self.channel.basic_qos(prefetch_count = self.settings.prefetch)
+        if self.fanout:
+            self.channel.exchange_declare(exchange = self.queue, exchange_type = "fanout", durable = True)
+            self.channel.queue_declare(queue = self.settings.dead_letter_queue, durable = True)
+            #Временная очередь живёт, пока открыто соединение, но отклонённое из неё сохраняется
+            self.consume_queue = self.channel.queue_declare(
+                queue = "", exclusive = True,
+                arguments = {"x-dead-letter-exchange": "", "x-dead-letter-routing-key": self.settings.dead_letter_queue}
+            ).method.queue
+            self.channel.queue_bind(queue = self.consume_queue, exchange = self.queue)
+        else:
+            declare_queue(self.channel, self.queue, self.settings.dead_letter_queue)
+        self.messages = self.channel.consume(self.consume_queue, inactivity_timeout = self.settings.batch_linger)
+        if self.on_connect is not None:
+            self.on_connect()
+
+    def fetch(self, max_count: int, timeout: float):
+        """Пачка (tag, body, message_id): ждёт первое сообщение до timeout, затем добирает уже пришедшие"""
+        if self.conn is None or self.conn.is_closed:
+            self.connect()
+        deadline = time.monotonic() + timeout
+        batch = []
+        for method, properties, body in self.messages:
+            if method is None:
+                if batch or time.monotonic() >= deadline:
+                    break
+                continue
+            batch.append((method.delivery_tag, body, properties.message_id))
+            if len(batch) >= max_count:
+                break
+        return batch
+
+    def ack(self, tags):
+        """Подтверждение обработки"""
+        for tag in tags:
+            self.channel.basic_ack(delivery_tag = tag)
+
+    def nack(self, tags, requeue: bool):
+        """Отказ от сообщений"""
+        for tag in tags:
+            self.channel.basic_nack(delivery_tag = tag, requeue = requeue)
+
+    def dead_letter(self, tag, body: bytes, message_id: str | None):
+        """Отказ без повтора: брокер сам переносит сообщение в очередь отказов (x-dead-letter-routing-key)"""
+        self.channel.basic_nack(delivery_tag = tag, requeue = False)
+
+    def lag(self):
+        """Число сообщений в очереди; у fanout очередь своя у каждого соединения, её длину не узнать"""
+        if self.fanout:
+            return None
+        if self.conn is None or self.conn.is_closed:
+            self.connect()
+        return self.channel.queue_declare(queue = self.consume_queue, passive = True).method.message_count
+
+    def close(self):
+        """Закрытие соединения; неподтверждённые сообщения брокер вернёт в очередь"""
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except AMQPError:
+            pass
+        self.conn = None
+
+def consumer_transport(settings, queue: str | None = None, fanout: bool = False, on_connect = None):
+    """Транспорт получателя согласно settings.backend; queue по умолчанию - settings.queue"""
+    if settings.backend == "memory":
+        return MemoryConsumerTransport(settings, queue or settings.queue, memory_broker, on_connect)
+    return PikaConsumerTransport(settings, queue or settings.queue, fanout, on_connect)
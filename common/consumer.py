@@ -0,0 +1,151 @@
+"""Фоновый получатель сообщений: пачки из очереди сохраняются одной транзакцией"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pika.exceptions import AMQPError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+logger = logging.getLogger("consumer")
+
+class BatchConsumer:
+    """concurrency соединений; сообщения подтверждаются только после commit"""
+
+    def __init__(self, settings, decode, persist, transport):
+        self.settings = settings
+        #decode(body, message_id) -> сообщение или ValueError; persist(сообщения) сохраняет одной транзакцией
+        self.decode = decode
+        self.persist = persist
+        #transport() -> новый транспорт получателя (common.broker.consumer_transport)
+        self.transport = transport
+        self.tasks = []
+        self.consumed = 0
+        self.persisted = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.dead_lettered = 0
+        self.batches = 0
+        self.lag = None
+        self.rate = 0.0
+
+    async def start(self):
+        """Запуск получателей и замера отставания"""
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.settings.concurrency)]
+        self.tasks.append(asyncio.create_task(self.watch_lag()))
+
+    async def stop(self):
+        """Остановка; неподтверждённые сообщения брокер отдаст повторно"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def run(self):
+        """Цикл одного соединения"""
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consumer")
+        transport = self.transport()
+        delay = self.settings.reconnect_delay
+        try:
+            while True:
+                try:
+                    batch = await loop.run_in_executor(executor, transport.fetch,
+                                                       self.settings.batch_size, self.settings.poll_timeout)
+                    if batch:
+                        await self.handle(loop, executor, transport, batch)
+                    delay = self.settings.reconnect_delay
+                except AMQPError:
+                    await loop.run_in_executor(executor, transport.close)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.settings.reconnect_max_delay)
+                except Exception:
+                    #Ошибка обработчика не должна останавливать получателя: пачка уже возвращена в очередь
+                    logger.exception("Consumer batch failed")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.settings.reconnect_max_delay)
+        finally:
+            await loop.run_in_executor(executor, transport.close)
+            executor.shutdown(wait=False)
+
+    async def handle(self, loop, executor, transport, batch):
+        """Разбор пачки, сохранение и подтверждение"""
+        self.consumed += len(batch)
+        messages, bad = [], []
+        raw = {tag: (body, message_id) for tag, body, message_id in batch}
+        for tag, body, message_id in batch:
+            try:
+                messages.append((tag, self.decode(body, message_id)))
+            except Exception:
+                bad.append(tag)
+        #Неразборчивое сообщение не разберётся и при повторе: в очередь отказов, а не в никуда
+        for tag in bad:
+            body, message_id = raw[tag]
+            await loop.run_in_executor(executor, transport.dead_letter, tag, body, message_id)
+        self.rejected += len(bad)
+        self.dead_lettered += len(bad)
+        if not messages:
+            return
+        try:
+            await self.persist([message for _, message in messages])
+        except IntegrityError:
+            #Одно сообщение портит всю пачку: сохраняем по одному
+            await self.persist_each(loop, executor, transport, messages, raw)
+            return
+        except SQLAlchemyError:
+            await loop.run_in_executor(executor, transport.nack, [tag for tag, _ in messages], True)
+            self.requeued += len(messages)
+            await asyncio.sleep(self.settings.reconnect_delay)
+            return
+        except Exception:
+            await loop.run_in_executor(executor, transport.nack, [tag for tag, _ in messages], True)
+            self.requeued += len(messages)
+            raise
+        await loop.run_in_executor(executor, transport.ack, [tag for tag, _ in messages])
+        self.persisted += len(messages)
+        self.batches += 1
+
+    async def persist_each(self, loop, executor, transport, messages, raw):
+        """Сохранение по одному сообщению; не сохранившиеся уходят в очередь отказов, а не теряются"""
+        for number, (tag, message) in enumerate(messages):
+            try:
+                await self.persist([message])
+            except IntegrityError:
+                body, message_id = raw[tag]
+                await loop.run_in_executor(executor, transport.dead_letter, tag, body, message_id)
+                self.dead_lettered += 1
+                continue
+            except Exception:
+                #Эта и оставшиеся - обратно в очередь, ошибку разберёт run
+                rest = [rest_tag for rest_tag, _ in messages[number:]]
+                await loop.run_in_executor(executor, transport.nack, rest, True)
+                self.requeued += len(rest)
+                raise
+            await loop.run_in_executor(executor, transport.ack, [tag])
+            self.persisted += 1
+
+    async def watch_lag(self):
+        """Периодический замер длины очереди и скорости сохранения"""
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consumer-lag")
+        transport = self.transport()
+        last_count, last_time = self.persisted, time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(self.settings.lag_interval)
+                try:
+                    self.lag = await loop.run_in_executor(executor, transport.lag)
+                except AMQPError:
+                    await loop.run_in_executor(executor, transport.close)
+                    self.lag = None
+                now = time.monotonic()
+                self.rate = (self.persisted - last_count) / (now - last_time)
+                last_count, last_time = self.persisted, now
+        finally:
+            await loop.run_in_executor(executor, transport.close)
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """Счётчики получателя"""
+        return {"consumed": self.consumed, "persisted": self.persisted, "rejected": self.rejected,
+                "requeued": self.requeued, "dead_lettered": self.dead_lettered, "batches": self.batches, "lag": self.lag,
+                "persisted_per_second": round(self.rate, 2)}
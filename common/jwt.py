@@ -0,0 +1,300 @@
+"""Общие настройки JWT и проверка токенов для всех сервисов (переменные окружения JWT_*)
+
+Токен проверяется один раз, дальше его данные берутся из LRU-кэша по хэшу токена
+до истечения срока. Отозванные при выходе токены (jti) Auth пишет в таблицу
+revoked_tokens в clients.db; остальные сервисы подтягивают новые строки
+инкрементально из файла БД или через GET /auth/revoked.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+import httpx
+import jwt
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, BaseSettings
+from fastapi_jwt_auth import AuthJWT
+from sqlalchemy.engine import make_url
+from .metrics import registry
+
+class JWTSettings(BaseSettings):
+    """Секрет и место хранения токена; одинаковые для Auth, Catal и Basket"""
+    secret_key: str = "secret"
+    algorithm: str = "HS256"
+    token_location: set = {"cookies"}
+    cookie_csrf_protect: bool = False
+    #Сколько проверенных токенов держать в кэше
+    cache_size: int = 10000
+    #Источник отзывов: файл clients.db (по умолчанию как у Auth) или адрес GET /revoked
+    revocation_db: str | None = None
+    revocation_url: str | None = None
+    #Как часто подтягивать новые отзывы, с: столько отозванный токен ещё принимают другие процессы
+    revocation_poll_interval: float = 0.5
+    revocation_batch: int = 1000
+    #Фильтр Блума отозванных jti: размер в битах и число хэшей
+    bloom_bits: int = 1 << 20
+    bloom_hashes: int = 4
+
+    class Config:
+        """Префикс переменных окружения"""
+        env_prefix = "JWT_"
+
+class Settings(BaseModel):
+    """Настройки для JWT токена в формате fastapi_jwt_auth"""
+    authjwt_secret_key: str
+    authjwt_algorithm: str
+    authjwt_token_location: set
+    authjwt_cookie_csrf_protect: bool
+
+settings = JWTSettings()
+
+def get_config():
+    """Установка настроек токена"""
+    return Settings(authjwt_secret_key = settings.secret_key, authjwt_algorithm = settings.algorithm,
+                    authjwt_token_location = settings.token_location,
+                    authjwt_cookie_csrf_protect = settings.cookie_csrf_protect)
+
+def configure():
+    """Регистрация настроек в AuthJWT (настройки общие для процесса)"""
+    AuthJWT.load_config(get_config)
+
+def default_revocation_db():
+    """Файл clients.db: из AUTH_DB_URL, иначе рядом с пакетом Auth"""
+    url = os.environ.get("AUTH_DB_URL")
+    if url:
+        return make_url(url).database
+    return str(Path(__file__).resolve().parent.parent / "Auth" / "clients.db")
+
+class Claims:
+    """Проверенные данные токена"""
+    __slots__ = ("subject", "role", "type", "jti", "expires_at")
+
+    def __init__(self, subject: str, role: str | None, token_type: str, jti: str, expires_at: float):
+        self.subject = subject
+        self.role = role
+        self.type = token_type
+        self.jti = jti
+        self.expires_at = expires_at
+
+class BloomFilter:
+    """Вероятностное множество: "нет" - точно нет, "да" - нужно проверить точно"""
+
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8 + 1)
+
+    def positions(self, key: str):
+        """Номера битов ключа"""
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * self.hashes).digest()
+        return [int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        """Добавление ключа"""
+        for position in self.positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+class TokenVerifier:
+    """Проверка токенов с кэшем и списком отзыва"""
+
+    def __init__(self, settings: JWTSettings):
+        self.settings = settings
+        #хэш токена -> Claims, порядок LRU
+        self.cache = OrderedDict()
+        #jti -> хэши токенов в кэше, чтобы выбросить их при отзыве
+        self.by_jti = {}
+        #jti -> срок действия токена; после него отзыв можно забыть
+        self.revoked = {}
+        self.bloom = BloomFilter(settings.bloom_bits, settings.bloom_hashes)
+        self.last_id = 0
+        self.task = None
+        self.users = 0
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.synced_at = None
+
+    def key(self, token: str):
+        """Ключ кэша: хэш токена, а не сам токен"""
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def verify(self, token: str, token_type: str = "access"):
+        """Данные токена; HTTPException 401, если он неверный, просрочен или отозван"""
+        key = self.key(token)
+        claims = self.cache.get(key)
+        if claims is not None and claims.expires_at > time.time():
+            #Отозванные токены удаляются из кэша при отзыве, поэтому здесь достаточно словаря
+            self.cache.move_to_end(key)
+            self.hits += 1
+        else:
+            if claims is not None:
+                self.cache.pop(key)
+                self.forget(claims.jti, key)
+            self.misses += 1
+            claims = self.decode(token)
+            if self.is_revoked(claims.jti):
+                self.rejected += 1
+                raise HTTPException(status_code=401,detail="Token has been revoked")
+            self.remember(key, claims)
+        if claims.type != token_type:
+            raise HTTPException(status_code=422,detail=f"Only {token_type} tokens are allowed")
+        return claims
+
+    def decode(self, token: str):
+        """Проверка подписи и срока"""
+        try:
+            raw = jwt.decode(token, self.settings.secret_key, algorithms=[self.settings.algorithm])
+        except jwt.ExpiredSignatureError:
+            self.rejected += 1
+            raise HTTPException(status_code=401,detail="Token has expired")
+        except jwt.InvalidTokenError as error:
+            self.rejected += 1
+            raise HTTPException(status_code=422,detail=str(error))
+        if "sub" not in raw or "jti" not in raw:
+            self.rejected += 1
+            raise HTTPException(status_code=422,detail="Token has no subject or identifier")
+        return Claims(raw["sub"], raw.get("role"), raw.get("type", "access"), raw["jti"],
+                      float(raw.get("exp", float("inf"))))
+
+    def remember(self, key: bytes, claims: Claims):
+        """Запись в кэш с вытеснением самого старого"""
+        self.cache[key] = claims
+        self.by_jti.setdefault(claims.jti, set()).add(key)
+        while len(self.cache) > self.settings.cache_size:
+            old_key, old = self.cache.popitem(last=False)
+            self.forget(old.jti, old_key)
+
+    def forget(self, jti: str, key: bytes):
+        """Удаление хэша из индекса по jti"""
+        keys = self.by_jti.get(jti)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_jti[jti]
+
+    def is_revoked(self, jti: str):
+        """Фильтр Блума отсекает почти все неотозванные jti без поиска"""
+        return jti in self.bloom and jti in self.revoked
+
+    def revoke(self, jti: str, expires_at: float):
+        """Отзыв в этом процессе: запись в список и удаление из кэша"""
+        self.revoked[jti] = expires_at
+        self.bloom.add(jti)
+        for key in self.by_jti.pop(jti, ()):
+            self.cache.pop(key, None)
+
+    def prune(self):
+        """Забыть отзывы истёкших токенов и пересобрать фильтр"""
+        now = time.time()
+        expired = [jti for jti, expires_at in self.revoked.items() if expires_at < now]
+        if not expired:
+            return
+        for jti in expired:
+            del self.revoked[jti]
+        self.bloom = BloomFilter(self.settings.bloom_bits, self.settings.bloom_hashes)
+        for jti in self.revoked:
+            self.bloom.add(jti)
+
+    def read_database(self, after: int):
+        """Новые строки revoked_tokens из clients.db (в отдельном потоке)"""
+        if self.connection is None:
+            path = self.settings.revocation_db or default_revocation_db()
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            self.connection.execute("PRAGMA busy_timeout=1000")
+        return self.connection.execute(
+            "SELECT id, jti, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id LIMIT ?",
+            (after, self.settings.revocation_batch)).fetchall()
+
+    async def read_feed(self, client: httpx.AsyncClient, after: int):
+        """Новые отзывы через GET /revoked сервиса Auth"""
+        response = await client.get(self.settings.revocation_url,
+                                    params={"after": after, "limit": self.settings.revocation_batch})
+        response.raise_for_status()
+        return [(item["id"], item["jti"], item["expires_at"]) for item in response.json()["items"]]
+
+    async def sync(self, client: httpx.AsyncClient | None = None):
+        """Подтягивание всех новых отзывов; возвращает их число"""
+        count = 0
+        while True:
+            if self.settings.revocation_url:
+                rows = await self.read_feed(client, self.last_id)
+            else:
+                rows = await asyncio.to_thread(self.read_database, self.last_id)
+            for row_id, jti, expires_at in rows:
+                self.revoke(jti, expires_at)
+                self.last_id = max(self.last_id, row_id)
+            count += len(rows)
+            if len(rows) < self.settings.revocation_batch:
+                self.synced_at = time.time()
+                return count
+
+    async def run(self):
+        """Фоновый опрос источника отзывов"""
+        async with httpx.AsyncClient(timeout=5) as client:
+            while True:
+                try:
+                    await self.sync(client)
+                    self.prune()
+                except (sqlite3.Error, httpx.HTTPError, KeyError, ValueError):
+                    #Таблицы или Auth ещё нет: повтор на следующем шаге
+                    self.close()
+                await asyncio.sleep(self.settings.revocation_poll_interval)
+
+    async def start(self):
+        """Запуск опроса; в общем процессе его запускает первый сервис"""
+        self.users += 1
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка опроса после остановки последнего сервиса"""
+        self.users = max(0, self.users - 1)
+        if self.users == 0 and self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            self.close()
+
+    def close(self):
+        """Закрытие соединения с clients.db"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def token(self, request: Request, token_type: str = "access"):
+        """Токен из cookie или заголовка Authorization согласно token_location"""
+        if "cookies" in self.settings.token_location:
+            token = request.cookies.get(f"{token_type}_token_cookie")
+            if token:
+                return token
+        if "headers" in self.settings.token_location:
+            scheme, _, token = request.headers.get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token
+        raise HTTPException(status_code=401,detail=f"Missing {token_type} token")
+
+    def stats(self):
+        """Счётчики кэша и списка отзыва"""
+        return {"cached": len(self.cache), "hits": self.hits, "misses": self.misses, "rejected": self.rejected,
+                "revoked": len(self.revoked), "last_id": self.last_id, "synced_at": self.synced_at}
+
+verifier = TokenVerifier(settings)
+registry.callback("jwt_cache_hits_total", "Tokens served from the verification cache", lambda: verifier.hits, "counter")
+registry.callback("jwt_cache_misses_total", "Tokens decoded and verified", lambda: verifier.misses, "counter")
+registry.callback("jwt_rejected_total", "Invalid, expired or revoked tokens", lambda: verifier.rejected, "counter")
+registry.callback("jwt_revoked_tokens", "Revoked tokens that have not expired yet", lambda: len(verifier.revoked))
+
+def current_user(request: Request):
+    """Зависимость FastAPI: данные access-токена текущего пользователя"""
+    return verifier.verify(verifier.token(request))
+
+def refresh_user(request: Request):
+    """Зависимость FastAPI: данные refresh-токена"""
+    return verifier.verify(verifier.token(request, "refresh"), "refresh")
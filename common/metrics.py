@@ -0,0 +1,286 @@
+"""Метрики сервиса в текстовом формате Prometheus (/metrics)
+
+У каждого сервиса свой Registry с меткой service на всех сериях: в совмещённом режиме
+(combined.py) серии Auth, Catal и Basket не сливаются. Общий для процесса registry
+(проверка JWT, допуск) выводится в /metrics каждого сервиса без этой метки.
+"""
+import heapq
+import re
+import time
+from bisect import bisect_left
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+#Границы корзин гистограмм, с
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#Сколько самых медленных запросов SQL показывать
+TOP_STATEMENTS = 10
+#Сколько разных нормализованных запросов помнить
+MAX_STATEMENTS = 1000
+
+def escape(value: str):
+    """Экранирование значения метки"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple):
+    """{a="1",b="2"}"""
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    """Счётчик с метками"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        """Увеличение счётчика"""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        """Строки экспозиции"""
+        return [f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in self.values.items()]
+
+class Gauge(Counter):
+    """Текущее значение с метками"""
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        """Уменьшение значения"""
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+class Callback:
+    """Значение, которое считывается только при запросе /metrics"""
+
+    def __init__(self, name: str, help: str, kind: str, read):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+
+    def render(self):
+        """Строки экспозиции"""
+        value = self.read()
+        return [] if value is None else [f"{self.name} {value}"]
+
+class Histogram:
+    """Гистограмма с метками"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value: float, labels: tuple = ()):
+        """Добавление наблюдения"""
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        """Строки экспозиции"""
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+class Registry:
+    """Набор метрик сервиса; service добавляется меткой к каждой серии"""
+
+    def __init__(self, service: str | None = None):
+        self.service = service
+        self.metrics = []
+
+    def add(self, metric):
+        """Регистрация метрики"""
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()):
+        """Новый счётчик"""
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()):
+        """Новое текущее значение"""
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = ()):
+        """Новая гистограмма"""
+        return self.add(Histogram(name, help, labels))
+
+    def callback(self, name: str, help: str, read, kind: str = "gauge"):
+        """Значение, вычисляемое при запросе /metrics"""
+        return self.add(Callback(name, help, kind, read))
+
+    def label(self, line: str):
+        """Серия с меткой service (имя метрики кончается на первой { или пробеле)"""
+        if not self.service or line.startswith("#"):
+            return line
+        end = min(index for index in (line.find("{"), line.find(" ")) if index >= 0)
+        service = f'service="{escape(self.service)}"'
+        if line[end] == "{":
+            return f"{line[:end + 1]}{service},{line[end + 1:]}"
+        return f"{line[:end]}{{{service}}}{line[end:]}"
+
+    def render(self):
+        """Всё в текстовом формате экспозиции"""
+        lines = []
+        for metric in self.metrics:
+            if metric.name:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(self.label(line) for line in metric.render())
+        return "\n".join(lines) + "\n"
+
+#Метрики общих для процесса объектов (проверка JWT, допуск)
+registry = Registry()
+
+class HttpMetrics:
+    """Метрики запросов HTTP одного сервиса"""
+
+    def __init__(self, registry: Registry):
+        self.requests = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+        self.in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being processed")
+        self.latency = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+
+class MetricsMiddleware:
+    """ASGI-прослойка: число, задержка и количество одновременных запросов по маршрутам"""
+
+    def __init__(self, app, owner: FastAPI, metrics: HttpMetrics):
+        self.app = app
+        self.owner = owner
+        self.metrics = metrics
+        #endpoint -> шаблон пути, чтобы не плодить метки по реальным путям
+        self.routes = {}
+
+    def route(self, endpoint):
+        """Шаблон пути маршрута; карта перестраивается, только если маршрут ещё не встречался"""
+        route = self.routes.get(endpoint)
+        if route is None and endpoint is not None:
+            self.routes = {item.endpoint: item.path for item in self.owner.routes if hasattr(item, "endpoint")}
+            route = self.routes.setdefault(endpoint, "unmatched")
+        return route or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            self.metrics.in_flight.dec()
+            route = self.route(scope.get("endpoint"))
+            self.metrics.requests.inc((scope["method"], route, status))
+            self.metrics.latency.observe(time.perf_counter() - start, (scope["method"], route))
+
+class StatementStats:
+    """Время запросов SQL по нормализованному тексту"""
+    #Заголовки HELP/TYPE пишет сам render: здесь три метрики
+    name = None
+    LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+    SPACES = re.compile(r"\s+")
+
+    def __init__(self, latency: Histogram, service: str | None = None):
+        self.latency = latency
+        self.service = service
+        self.normalized = {}
+        self.stats = {}
+
+    def normalize(self, statement: str):
+        """Текст без литералов и с одним ? вместо списков параметров"""
+        result = self.normalized.get(statement)
+        if result is None:
+            result = self.SPACES.sub(" ", statement).strip()
+            result = self.LISTS.sub("?, ...", self.LITERALS.sub("?", result))
+            if len(self.normalized) < MAX_STATEMENTS:
+                self.normalized[statement] = result
+        return result
+
+    def observe(self, statement: str, elapsed: float):
+        """Учёт одного выполнения"""
+        normalized = self.normalize(statement)
+        entry = self.stats.get(normalized)
+        if entry is None:
+            if len(self.stats) >= MAX_STATEMENTS:
+                return
+            entry = self.stats[normalized] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        self.latency.observe(elapsed, (normalized.split(" ", 1)[0].upper(),))
+
+    def render(self):
+        """Самые медленные запросы по максимальному времени"""
+        top = heapq.nlargest(TOP_STATEMENTS, self.stats.items(), key=lambda item: item[1][2])
+        lines = []
+        names, prefix = ("statement",), ()
+        if self.service:
+            names, prefix = ("service", "statement"), (self.service,)
+        for index, (name, help) in enumerate((("sql_statement_calls_total", "Calls of the slowest statements"),
+                                              ("sql_statement_seconds_total", "Total time of the slowest statements"),
+                                              ("sql_statement_max_seconds", "Worst time of the slowest statements"))):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {'gauge' if index == 2 else 'counter'}")
+            for statement, entry in top:
+                lines.append(f"{name}{format_labels(names, prefix + (statement[:300],))} {entry[index]}")
+        return lines
+
+def instrument_engine(engine, statements: StatementStats):
+    """Замер каждого запроса SQL через события движка"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.observe(statement, time.perf_counter() - conn.info["query_start"].pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+def install(app: FastAPI, engine, service: Registry):
+    """Подключение прослойки, замеров SQL и маршрута /metrics с реестром сервиса и общим реестром процесса"""
+    app.add_middleware(MetricsMiddleware, owner=app, metrics=HttpMetrics(service))
+    sql_latency = service.histogram("sql_query_duration_seconds", "SQL statement latency", ("operation",))
+    #Сам пишет HELP/TYPE и метку service: в реестр добавляется после всех меток
+    statements = StatementStats(sql_latency, service.service)
+    instrument_engine(engine, statements)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Метрики в текстовом формате Prometheus"""
+        return PlainTextResponse(service.render() + "\n".join(statements.render()) + "\n" + registry.render(),
+                                 media_type="text/plain; version=0.0.4")
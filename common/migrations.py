@@ -0,0 +1,101 @@
+"""Миграции схемы SQLite на месте (номер версии хранится в PRAGMA user_version)"""
+import sqlite3
+
+class MigrationError(Exception):
+    """Миграция не применилась или запрос не использует нужный индекс"""
+
+class Migration:
+    """Шаг схемы: SQL-команды и проверки планов горячих запросов"""
+
+    def __init__(self, version: int, description: str, statements: list, checks: list):
+        self.version = version
+        self.description = description
+        #SQL-строки или функции(conn) для шагов, которые нельзя записать идемпотентным SQL
+        self.statements = statements
+        #(запрос, параметры, индексы, которые должны быть в EXPLAIN QUERY PLAN)
+        self.checks = checks
+
+def add_column(table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN, если столбца ещё нет (на новой БД его уже создал create_all)"""
+    def step(conn):
+        if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return step
+
+def connect(path: str):
+    """Соединение без неявных транзакций: BEGIN/COMMIT пишутся явно"""
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+def current_version(conn):
+    """Номер последней применённой миграции"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def query_plan(conn, sql: str, params: tuple):
+    """Строки EXPLAIN QUERY PLAN"""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def verify(conn, migration: Migration):
+    """Горячие запросы миграции должны идти по индексам"""
+    for sql, params, indexes in migration.checks:
+        plan = query_plan(conn, sql, params)
+        for index in indexes:
+            if not any(f"INDEX {index}" in line for line in plan):
+                raise MigrationError(f"Migration {migration.version}: {sql!r} does not use {index}: {plan}")
+
+def migrate(path: str, migrations: list):
+    """Применение новых миграций; каждая в своей транзакции вместе с проверкой планов"""
+    conn = connect(path)
+    applied = []
+    try:
+        for migration in migrations:
+            #Версию перечитываем под блокировкой: миграцию мог уже применить другой процесс
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if current_version(conn) >= migration.version:
+                    conn.execute("ROLLBACK")
+                    continue
+                for statement in migration.statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                verify(conn, migration)
+                conn.execute(f"PRAGMA user_version = {migration.version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(migration.version)
+    finally:
+        conn.close()
+    return applied
+
+def check(path: str, migrations: list):
+    """Проверка планов всех применённых миграций на текущей БД"""
+    conn = connect(path)
+    try:
+        for migration in migrations:
+            if migration.version <= current_version(conn):
+                verify(conn, migration)
+    finally:
+        conn.close()
+
+def main(argv: list, migrations: list, default_path: str):
+    """Командная строка: применить, показать версию или проверить планы"""
+    args = [arg for arg in argv if not arg.startswith("--")]
+    path = args[0] if args else default_path
+    if "--status" in argv:
+        conn = connect(path)
+        try:
+            version = current_version(conn)
+        finally:
+            conn.close()
+        for migration in migrations:
+            print(f"{'+' if migration.version <= version else ' '} {migration.version} {migration.description}")
+    elif "--check" in argv:
+        check(path, migrations)
+        print("ok")
+    else:
+        print("applied:", migrate(path, migrations) or "nothing")
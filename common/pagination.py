@@ -0,0 +1,18 @@
+"""Курсоры постраничной выдачи (keyset): значения ключа сортировки последней строки"""
+import base64
+import json
+from fastapi import HTTPException
+
+def encode_cursor(values: list):
+    """Курсор: значения ключа сортировки последней отданной строки"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, size: int | None = None):
+    """Разбор курсора; size - ожидаемое число значений"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400,detail="Bad cursor")
+    if not isinstance(values, list) or (size is not None and len(values) != size):
+        raise HTTPException(status_code=400,detail="Bad cursor")
+    return values
@@ -0,0 +1,167 @@
+"""Запуск нескольких рабочих процессов uvicorn на одном сокете (pre-fork)
+
+Мастер один раз готовит схемы БД, открывает сокет и запускает рабочих через fork.
+Рабочие не делят ничего, кроме файлов SQLite в режиме WAL: у каждого свои пулы
+соединений, кэш и фоновые задачи. Упавший рабочий перезапускается с растущей задержкой;
+если рабочие падают слишком часто (max-failures за failure-window секунд), мастер
+останавливает остальных и завершается с кодом 1.
+
+    python launcher.py --app combined:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+from collections import deque
+
+def load(target: str):
+    """Модуль и приложение по строке вида module:attribute"""
+    module_name, _, attribute = target.partition(":")
+    module = importlib.import_module(module_name)
+    return module, getattr(module, attribute or "app")
+
+async def prepare(module):
+    """Схемы всех сервисов и закрытие соединений до fork; возвращает время каждой, с"""
+    timings = {}
+    if hasattr(module, "init_schemas"):
+        timings = await module.init_schemas()
+    if hasattr(module, "dispose_engines"):
+        await module.dispose_engines()
+    return timings
+
+def bind(host: str, port: int, backlog: int):
+    """Слушающий сокет, который наследуют рабочие"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def serve(app, sock: socket.socket, log_level: str):
+    """Рабочий процесс: uvicorn на готовом сокете"""
+    import uvicorn
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    config = uvicorn.Config(app, fd=sock.fileno(), log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run()
+    os._exit(0)
+
+def spawn(app, sock: socket.socket, log_level: str):
+    """fork рабочего; в родителе возвращает его pid"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(app, sock, log_level)
+        finally:
+            os._exit(1)
+    return pid
+
+class RestartPolicy:
+    """Задержка перезапуска по числу недавних падений: base, 2*base, ... до max_delay"""
+
+    def __init__(self, base: float, max_delay: float, max_failures: int, window: float):
+        self.base = base
+        self.max_delay = max_delay
+        self.max_failures = max_failures
+        self.window = window
+        self.failures = deque()
+
+    def failed(self, now: float):
+        """Учёт падения; задержка перед перезапуском или None, если падений слишком много"""
+        self.failures.append(now)
+        while self.failures and self.failures[0] <= now - self.window:
+            self.failures.popleft()
+        if len(self.failures) >= self.max_failures:
+            return None
+        return min(self.max_delay, self.base * 2 ** (len(self.failures) - 1))
+
+def main(argv: list):
+    """Мастер: подготовка, запуск рабочих, перезапуск упавших, остановка по SIGTERM/SIGINT"""
+    parser = argparse.ArgumentParser(description="Pre-fork launcher")
+    parser.add_argument("--app", default="combined:app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--restart-delay", type=float, default=0.5)
+    parser.add_argument("--restart-max-delay", type=float, default=30.0)
+    parser.add_argument("--max-failures", type=int, default=10)
+    parser.add_argument("--failure-window", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    module, app = load(args.app)
+    imported = time.perf_counter()
+    schemas = asyncio.run(prepare(module))
+    prepared = time.perf_counter()
+    sock = bind(args.host, args.port, args.backlog)
+    workers = {spawn(app, sock, args.log_level) for _ in range(args.workers)}
+    print(f"master {os.getpid()}: import {imported - started:.3f} s, schema {prepared - imported:.3f} s {schemas}, "
+          f"{args.workers} workers on {args.host}:{args.port} after {time.perf_counter() - started:.3f} s",
+          flush=True)
+
+    stopping = False
+    restarts = RestartPolicy(args.restart_delay, args.restart_max_delay, args.max_failures, args.failure_window)
+    #Когда запустить замену упавшего рабочего (time.monotonic)
+    pending = []
+    exit_code = 0
+
+    def stop(signum, frame):
+        """Передача сигнала рабочим; отложенные перезапуски не выполняются"""
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers or (pending and not stopping):
+        while pending and not stopping and pending[0] <= time.monotonic():
+            pending.pop(0)
+            pid = spawn(app, sock, args.log_level)
+            workers.add(pid)
+            if stopping:
+                #Сигнал пришёл во время запуска: stop() этого рабочего не видел
+                os.kill(pid, signal.SIGTERM)
+        waiting = pending and not stopping
+        try:
+            #Пока ждёт перезапуск, опрос без блокировки
+            pid, status = os.waitpid(-1, os.WNOHANG if waiting else 0)
+        except ChildProcessError:
+            pid = 0
+        except InterruptedError:
+            continue
+        if pid == 0:
+            if waiting:
+                time.sleep(min(0.1, max(0.0, pending[0] - time.monotonic())))
+                continue
+            break
+        workers.discard(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        delay = restarts.failed(time.monotonic())
+        if delay is None:
+            print(f"master: worker {pid} exited with {code}; {args.max_failures} failures within "
+                  f"{args.failure_window:g} s, stopping", flush=True)
+            exit_code = 1
+            stop(None, None)
+            continue
+        print(f"master: worker {pid} exited with {code}, restarting in {delay:g} s", flush=True)
+        pending.append(time.monotonic() + delay)
+        pending.sort()
+    sock.close()
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,20 @@
+"""Общие настройки тестов: пакеты сервисов импортируются из корня репозитория
+
+Файлы БД - во временном каталоге, брокер - в памяти, лимиты допуска выключены
+(как у замеров bench): рабочие catal.db, basket.db и clients.db тесты не трогают.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bench.services import configure
+
+#Администратор из списка допуска (require_admin)
+ADMIN = "admin@example.com"
+os.environ.setdefault("ADMISSION_ADMINS", f'["{ADMIN}"]')
+configure(Path(tempfile.mkdtemp(prefix="backkurs-tests-")))
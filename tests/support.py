@@ -0,0 +1,32 @@
+"""Запуск сервисов в процессе для сценарных тестов"""
+import asyncio
+from bench.services import Services
+
+PASSWORD = "Passw0rd!secret"
+
+def run_services(scenario):
+    """Auth, Catal и Basket в этом процессе на время scenario(services); возвращает его результат"""
+    async def main():
+        async with Services() as services:
+            return await scenario(services)
+    return asyncio.run(main())
+
+async def login(services, email: str, role: str = "user"):
+    """Регистрация (если нужно) и вход; cookies - у клиентов всех сервисов"""
+    auth = services.clients["auth"]
+    await auth.post("/register", json={"email": email, "password": PASSWORD, "role": role})
+    response = await auth.post("/login", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    #Cookie привязаны к хосту auth: копируются без домена
+    cookies = {name: value for name, value in response.cookies.items()}
+    for client in services.clients.values():
+        client.cookies.clear()
+        client.cookies.update(cookies)
+
+async def add_comics(services, comics: list):
+    """Комиксы через массовую загрузку; недостающие поля - по умолчанию"""
+    rows = [{"amount": 1, "price": 10, "publisher": "Pub Alpha", "writer": "Writer Alpha", "artist": "Artist Alpha",
+             **comic} for comic in comics]
+    response = await services.clients["catal"].post("/create/comics/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    return response.json()
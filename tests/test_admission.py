@@ -0,0 +1,79 @@
+"""Допуск запросов: пополнение корзин, адрес клиента за прокси и отказ с Retry-After"""
+import asyncio
+import httpx
+from fastapi import FastAPI
+from starlette.requests import Request
+import common.admission
+from common.admission import (Admission, AdmissionMiddleware, AdmissionSettings, Buckets, Limits, SharedBuckets,
+                              client_address)
+
+def test_bucket_refills_at_rate(tmp_path):
+    for buckets in (Buckets(10), SharedBuckets(str(tmp_path / "admission.db"), 20)):
+        assert [buckets.take("k", 2, 2, 100.0) for _ in range(2)] == [0.0, 0.0]
+        assert buckets.take("k", 2, 2, 100.0) > 0
+        #За 0.5 с при 2 токенах в секунду появляется один токен
+        assert buckets.take("k", 2, 2, 100.5) == 0.0
+        assert buckets.take("k", 2, 2, 100.5) > 0
+        #Простой не копит токенов сверх burst
+        assert [buckets.take("k", 2, 2, 200.0) for _ in range(3)][-1] > 0
+
+def address(peer: str, forwarded: str | None, trusted: set):
+    """Адрес клиента для запроса от peer"""
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded is not None else []
+    scope = {"type": "http", "client": (peer, 1234), "headers": headers}
+    return client_address(scope, Request(scope), trusted)
+
+def test_client_address_behind_trusted_proxies():
+    proxies = {"10.0.0.1", "10.0.0.2"}
+    assert address("10.0.0.1", "6.6.6.6, 1.1.1.1, 10.0.0.2", proxies) == "1.1.1.1"
+    #Заголовок от чужого адреса подделан: не учитывается
+    assert address("8.8.8.8", "1.1.1.1", proxies) == "8.8.8.8"
+    assert address("10.0.0.1", None, proxies) == "10.0.0.1"
+    assert address("10.0.0.1", "10.0.0.2", proxies) == "10.0.0.2"
+
+def limited_app(limits: Limits, monkeypatch):
+    """Приложение с одним ограниченным маршрутом /slow, который ждёт release"""
+    #Сценарные тесты выключают допуск через окружение: здесь он включён явно
+    settings = AdmissionSettings(enabled=True, classes={"slow": limits})
+    monkeypatch.setattr(common.admission, "admission", Admission(settings))
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, rules={"/slow": "slow"})
+    release = asyncio.Event()
+
+    @app.get("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    return app, release
+
+def test_queue_overflow_is_shed_with_retry_after(monkeypatch):
+    app, release = limited_app(Limits(concurrency=1, queue=1, budget=2), monkeypatch)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            running = asyncio.create_task(client.get("/slow"))
+            await asyncio.sleep(0.05)
+            queued = asyncio.create_task(client.get("/slow"))
+            await asyncio.sleep(0.05)
+            overflow = await asyncio.wait_for(client.get("/slow"), 1)
+            release.set()
+            return overflow, await running, await queued
+
+    overflow, running, queued = asyncio.run(run())
+    assert overflow.status_code == 503 and int(overflow.headers["retry-after"]) >= 1
+    assert running.status_code == 200 and queued.status_code == 200
+    stats = common.admission.admission.stats()["classes"]["slow"]
+    assert stats["shed"] == 1 and stats["admitted"] == 2
+
+def test_rate_limit_returns_429_with_retry_after(monkeypatch):
+    app, release = limited_app(Limits(client_rate=0.5, client_burst=1), monkeypatch)
+    release.set()
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [await client.get("/slow") for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first.status_code == 200
+    assert second.status_code == 429 and second.headers["retry-after"] == "2"
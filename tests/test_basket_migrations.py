@@ -0,0 +1,31 @@
+"""Миграции basket.db: items старых заказов переносятся в order_lines"""
+import json
+import sqlite3
+from Basket.migrations import MIGRATIONS, migrate
+
+def test_split_items_moves_json_and_free_text(tmp_path):
+    path = str(tmp_path / "basket.db")
+    conn = sqlite3.connect(path)
+    #Схема до миграций: один заказ на клиента, позиции строкой
+    conn.execute("CREATE TABLE orders (id INTEGER NOT NULL PRIMARY KEY, client VARCHAR NOT NULL UNIQUE, "
+                 "price INTEGER NOT NULL, items VARCHAR NOT NULL)")
+    conn.executemany("INSERT INTO orders (id, client, price, items) VALUES (?, ?, ?, ?)", [
+        (1, "json@example.com", 50, json.dumps([{"comic_id": 7, "title": "X-Men", "qty": 2, "price": 10},
+                                                {"title": "Hulk", "price": 30}])),
+        (2, "text@example.com", 15, "X-Men, Hulk"),
+        (3, "object@example.com", 5, json.dumps({"title": "Batman"}))])
+    conn.commit()
+    conn.close()
+
+    assert migrate(path) == [migration.version for migration in MIGRATIONS]
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT order_id, line_no, comic_id, title, qty, price FROM order_lines "
+                        "ORDER BY order_id, line_no").fetchall() == [
+        (1, 0, 7, "X-Men", 2, 10), (1, 1, None, "Hulk", 1, 30),
+        (2, 0, None, "X-Men, Hulk", 1, 15),
+        (3, 0, None, '{"title": "Batman"}', 1, 5)]
+    assert "items" not in [row[1] for row in conn.execute("PRAGMA table_info(orders)")]
+    #UNIQUE(client) снят: у клиента может быть второй заказ
+    conn.execute("INSERT INTO orders (client, price, created_at) VALUES ('json@example.com', 1, 1.0)")
+    conn.close()
+    assert migrate(path) == []
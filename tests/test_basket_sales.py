@@ -0,0 +1,14 @@
+"""Статистика продаж доступна только администраторам"""
+from support import login, run_services
+
+def test_sales_require_admin():
+    async def scenario(services):
+        basket = services.clients["basket"]
+        statuses = [(await basket.get("/sales/comics")).status_code]
+        await login(services, "buyer@example.com")
+        statuses += [(await basket.get(path)).status_code for path in ("/sales/comics", "/sales/comics/1")]
+        await login(services, "admin@example.com", "admin")
+        statuses += [(await basket.get(path)).status_code for path in ("/sales/comics", "/sales/comics/1")]
+        return statuses
+
+    assert run_services(scenario) == [401, 403, 403, 200, 200]
@@ -0,0 +1,49 @@
+"""Очереди RabbitMQ долговечны и с очередью отказов; объявления отправителя и получателя совпадают"""
+from types import SimpleNamespace
+import common.broker
+from common.broker import InMemoryBroker, PikaConsumerTransport, PikaTransport, PublisherSettings
+
+class Channel:
+    """Канал pika, записывающий объявления очередей"""
+
+    def __init__(self):
+        self.declared = {}
+
+    def queue_declare(self, queue, durable=False, exclusive=False, arguments=None, passive=False):
+        self.declared[queue] = {"durable": durable, "arguments": arguments}
+        return SimpleNamespace(method=SimpleNamespace(queue=queue))
+
+    def basic_publish(self, **kwargs):
+        pass
+
+    def basic_qos(self, **kwargs):
+        pass
+
+    def consume(self, queue, inactivity_timeout=None):
+        return iter(())
+
+def test_publisher_and_consumer_declare_the_same_queue(monkeypatch):
+    publisher = PikaTransport(PublisherSettings(queue="checkout", confirm=False))
+    publisher.conn = SimpleNamespace(is_closed=False)
+    publisher.channel = Channel()
+    publisher.publish_batch([("checkout", b"{}", "m1")])
+
+    settings = SimpleNamespace(host="localhost", port=5672, prefetch=1, batch_linger=0.05,
+                               dead_letter_queue="checkout.dead")
+    consumer = PikaConsumerTransport(settings, "checkout")
+    channel = Channel()
+    monkeypatch.setattr(common.broker, "BlockingConnection", lambda params: SimpleNamespace(channel=lambda: channel))
+    consumer.connect()
+
+    expected = {"durable": True,
+                "arguments": {"x-dead-letter-exchange": "", "x-dead-letter-routing-key": "checkout.dead"}}
+    assert publisher.channel.declared["checkout"] == expected == channel.declared["checkout"]
+    assert channel.declared["checkout.dead"]["durable"]
+
+def test_memory_broker_dead_letters_rejected_messages():
+    broker = InMemoryBroker()
+    broker.publish("orders", b"1", "1")
+    [(tag, _, _)] = broker.get("orders", 1)
+    broker.nack([tag], requeue=False)
+    assert broker.size("orders") == 0
+    assert broker.get("orders.dead", 1)[0][1:] == (b"1", "1")
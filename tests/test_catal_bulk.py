@@ -0,0 +1,20 @@
+"""Массовая загрузка: NDJSON не в UTF-8 - 400, загрузка без новых комиксов не меняет версию каталога"""
+from Catal.cache import catalog_cache
+from support import add_comics, run_services
+
+def test_bulk_bad_ndjson_and_no_changes():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        await add_comics(services, [{"title": "Bulk Alpha"}])
+        etag = (await catal.get("/view/comics")).headers["etag"]
+        invalidations = catalog_cache.invalidations
+        bad = await catal.post("/create/comics/bulk", content=b'{"title": "\xff\xfe"}\n',
+                               headers={"content-type": "application/x-ndjson"})
+        duplicate = await add_comics(services, [{"title": "Bulk Alpha"}])
+        unchanged = (await catal.get("/view/comics")).headers["etag"]
+        return etag, bad, duplicate, unchanged, catalog_cache.invalidations - invalidations
+
+    etag, bad, duplicate, unchanged, invalidated = run_services(scenario)
+    assert bad.status_code == 400 and bad.json()["detail"] == "Bad NDJSON"
+    assert duplicate["created"] == 0 and duplicate["duplicate"] == 1
+    assert unchanged == etag and invalidated == 0
@@ -0,0 +1,56 @@
+"""Покупка: параллельные /buy не продают больше, чем есть, и отчёт о нехватке точен"""
+import asyncio
+from support import add_comics, login, run_services
+
+STOCK = 7
+BUYERS = 30
+
+def test_concurrent_buys_never_oversell():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        await login(services, "buyer@example.com")
+        await add_comics(services, [{"title": "Race Alpha", "amount": STOCK, "price": 5}])
+        responses = await asyncio.gather(*[catal.post("/buy", json={"items": [{"title": "Race Alpha", "qty": 1}]})
+                                           for _ in range(BUYERS)])
+        comic = (await catal.get("/view/comic", params={"title": "Race Alpha"})).json()
+        return responses, comic
+
+    responses, comic = run_services(scenario)
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == STOCK
+    assert statuses.count(409) == BUYERS - STOCK
+    assert comic["amount"] == 0
+    for response in responses:
+        if response.status_code == 409:
+            assert response.json()["detail"]["shortages"] == [
+                {"title": "Race Alpha", "requested": 1, "available": 0, "reason": "insufficient"}]
+
+def test_cart_is_all_or_nothing():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        await login(services, "cart@example.com")
+        await add_comics(services, [{"title": "Cart Alpha", "amount": 3}, {"title": "Cart Bravo", "amount": 1}])
+        response = await catal.post("/buy", json={"items": [{"title": "Cart Alpha", "qty": 2},
+                                                            {"title": "Cart Bravo", "qty": 2},
+                                                            {"title": "Cart Missing", "qty": 1}]})
+        amounts = [(await catal.get("/view/comic", params={"title": title})).json()["amount"]
+                   for title in ("Cart Alpha", "Cart Bravo")]
+        return response, amounts
+
+    response, amounts = run_services(scenario)
+    assert response.status_code == 409
+    assert sorted(response.json()["detail"]["shortages"], key=lambda line: line["title"]) == [
+        {"title": "Cart Bravo", "requested": 2, "available": 1, "reason": "insufficient"},
+        {"title": "Cart Missing", "requested": 1, "available": None, "reason": "not_found"}]
+    assert amounts == [3, 1]
+
+def test_bad_amount_is_rejected():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        bad = await catal.patch("/patch/comicamount", json={"title": "Nothing", "amount": "x"})
+        missing = await catal.patch("/patch/comicamount", json={"title": "Nothing", "amount": 1})
+        return bad, missing
+
+    bad, missing = run_services(scenario)
+    assert bad.status_code == 400
+    assert missing.status_code == 404
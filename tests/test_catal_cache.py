@@ -0,0 +1,32 @@
+"""Версия каталога и ETag: одно изменение комикса - одно увеличение версии, If-None-Match по RFC 7232"""
+from Catal.cache import etag_matches
+from support import add_comics, run_services
+
+def test_etag_matches():
+    etag = '"ab12-7"'
+    assert etag_matches('"ab12-7"', etag)
+    assert etag_matches('W/"ab12-7"', etag)
+    assert etag_matches('"other", W/"ab12-7"', etag)
+    assert etag_matches('"a,b" ,"ab12-7"', etag)
+    assert etag_matches(" * ", etag)
+    assert not etag_matches('"ab12-6", W/"ab12-8"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("ab12-7", etag)
+
+def test_comic_change_bumps_version_once():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        await add_comics(services, [{"title": "Version Alpha"}])
+        versions = [(await catal.get("/catalog/version")).json()["version"]]
+        #Справочники уже есть: меняется только comics
+        await add_comics(services, [{"title": "Version Bravo"}])
+        versions.append((await catal.get("/catalog/version")).json()["version"])
+        await catal.patch("/patch/comicamount", json={"title": "Version Bravo", "amount": 5})
+        versions.append((await catal.get("/catalog/version")).json()["version"])
+        etag = (await catal.get("/view/comics")).headers["etag"]
+        cached = await catal.get("/view/comics", headers={"if-none-match": f'"stale", W/{etag}'})
+        return versions, cached
+
+    versions, cached = run_services(scenario)
+    assert [later - earlier for earlier, later in zip(versions, versions[1:])] == [1, 1]
+    assert cached.status_code == 304
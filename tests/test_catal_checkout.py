@@ -0,0 +1,42 @@
+"""Оформление корзины из Basket: повторная доставка ничего не меняет, строки ищутся по comic_id"""
+from sqlalchemy import func, select
+from Catal.cache import catalog_cache
+from Catal.checkout import CheckoutMod, place, place_checkouts
+from Catal.database import async_session
+from Catal.models import Comic, OutboxMessage
+from support import add_comics, run_services
+
+def test_redelivered_checkout_is_ignored():
+    async def scenario(services):
+        await add_comics(services, [{"title": "Checkout Alpha", "amount": 1}])
+        async with async_session() as db:
+            comic_id = (await db.execute(select(Comic.id).where(Comic.title == "Checkout Alpha"))).scalar()
+        #Название в корзине устарело: списывается по comic_id
+        checkout = CheckoutMod(message_id="checkout-1", email="buyer@example.com",
+                               items=[{"comic_id": comic_id, "title": "Old Alpha", "qty": 1}])
+        first = await place(checkout)
+        invalidations = catalog_cache.invalidations
+        await place_checkouts([checkout])
+        async with async_session() as db:
+            amount = (await db.execute(select(Comic.amount).where(Comic.id == comic_id))).scalar()
+            rejected = (await db.execute(select(func.count()).where(OutboxMessage.body.contains("checkout_rejected")))).scalar()
+        return first, catalog_cache.invalidations - invalidations, amount, rejected
+
+    first, invalidated, amount, rejected = run_services(scenario)
+    assert first is True
+    assert invalidated == 0
+    assert amount == 0 and rejected == 0
+
+def test_rejection_reports_comic_id():
+    async def scenario(services):
+        invalidations = catalog_cache.invalidations
+        await place_checkouts([CheckoutMod(message_id="checkout-2", email="buyer@example.com",
+                                           items=[{"comic_id": 999999, "title": "Nothing", "qty": 1}])])
+        async with async_session() as db:
+            body = (await db.execute(select(OutboxMessage.body)
+                                     .where(OutboxMessage.body.contains("checkout-2")))).scalar()
+        return catalog_cache.invalidations - invalidations, body
+
+    invalidated, body = run_services(scenario)
+    assert invalidated == 0
+    assert '"comic_id": 999999' in body and '"reason": "not_found"' in body
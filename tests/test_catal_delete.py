@@ -0,0 +1,20 @@
+"""Удаление издательства: комиксы уходят вместе с ним, неизвестное имя - 404"""
+from support import add_comics, run_services
+
+def test_delete_publisher():
+    async def scenario(services):
+        catal = services.clients["catal"]
+        await add_comics(services, [{"title": "Gone Alpha", "publisher": "Pub Gone"},
+                                    {"title": "Kept Alpha", "publisher": "Pub Kept"}])
+        etag = (await catal.get("/view/comics")).headers["etag"]
+        missing = await catal.request("DELETE", "/delete/publisher", json={"name": "Pub Nobody"})
+        unchanged = (await catal.get("/view/comics")).headers["etag"]
+        deleted = await catal.request("DELETE", "/delete/publisher", json={"name": " pub gone "})
+        titles = [comic["title"] for comic in (await catal.get("/view/comics")).json()["items"]]
+        return etag, missing, unchanged, deleted, titles
+
+    etag, missing, unchanged, deleted, titles = run_services(scenario)
+    assert missing.status_code == 404 and missing.json()["detail"] == "Name not found"
+    assert unchanged == etag
+    assert deleted.status_code == 200
+    assert "Gone Alpha" not in titles and "Kept Alpha" in titles
@@ -0,0 +1,56 @@
+"""Миграции catal.db: слияние дублей и планы горячих запросов по индексам"""
+import sqlite3
+import pytest
+from common.migrations import connect, query_plan
+from Catal.migrations import MIGRATIONS, migrate
+
+#Схема до миграций: без уникальных нормализованных имён и индексов внешних ключей
+BASELINE = [
+    "CREATE TABLE publishers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL)",
+    "CREATE TABLE writers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL)",
+    "CREATE TABLE artists (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL)",
+    "CREATE TABLE comics (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL UNIQUE, amount INTEGER NOT NULL, "
+    "price INTEGER NOT NULL, publisher_id INTEGER REFERENCES publishers (id), "
+    "writer_id INTEGER REFERENCES writers (id), artist_id INTEGER REFERENCES artists (id))",
+]
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "catal.db")
+    conn = sqlite3.connect(path)
+    for statement in BASELINE:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO publishers (id, name) VALUES (?, ?)", [(1, "Marvel"), (2, " marvel "), (3, "DC")])
+    conn.executemany("INSERT INTO writers (id, name) VALUES (?, ?)", [(1, "Stan Lee"), (2, "STAN LEE")])
+    conn.execute("INSERT INTO artists (id, name) VALUES (1, 'Jack Kirby')")
+    conn.executemany("INSERT INTO comics (title, amount, price, publisher_id, writer_id, artist_id) VALUES (?, ?, ?, ?, ?, ?)",
+                     [("X-Men", 1, 10, 1, 1, 1), ("Hulk", 2, 20, 2, 2, 1), ("Batman", 3, 30, 3, 1, 1)])
+    conn.commit()
+    conn.close()
+    return path
+
+def test_migrate_merges_duplicate_names(database):
+    assert migrate(database) == [migration.version for migration in MIGRATIONS]
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT id, name FROM publishers ORDER BY id").fetchall() == [(1, "Marvel"), (3, "DC")]
+    assert conn.execute("SELECT id FROM writers").fetchall() == [(1,)]
+    assert conn.execute("SELECT title, publisher_id, writer_id FROM comics ORDER BY id").fetchall() == [
+        ("X-Men", 1, 1), ("Hulk", 1, 1), ("Batman", 3, 1)]
+    conn.close()
+
+def test_migrate_twice_changes_nothing(database):
+    migrate(database)
+    assert migrate(database) == []
+
+@pytest.mark.parametrize("migration", MIGRATIONS, ids=lambda migration: str(migration.version))
+def test_hot_queries_use_indexes(database, migration):
+    migrate(database)
+    conn = connect(database)
+    try:
+        for sql, params, indexes in migration.checks:
+            plan = query_plan(conn, sql, params)
+            for index in indexes:
+                assert any(f"INDEX {index}" in line for line in plan), (sql, plan)
+            assert not any(line.startswith("SCAN comics") for line in plan), (sql, plan)
+    finally:
+        conn.close()
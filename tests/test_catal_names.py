@@ -0,0 +1,27 @@
+"""Нормализация имён: Python и SQLite должны давать один и тот же ключ"""
+import sqlite3
+import pytest
+from Catal.models import name_key
+
+NAMES = ["Marvel", "  DC Comics ", "Éditions Dupuis", "ÉDITIONS DUPUIS", " éditions dupuis",
+         "Straße", "ǅemal", "\tTabbed\t", "ДАРКХОРС", "İstanbul Comics", "KELVIN K"]
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    yield conn
+    conn.close()
+
+@pytest.mark.parametrize("name", NAMES)
+def test_name_key_matches_sqlite(conn, name):
+    assert name_key(name) == conn.execute("SELECT lower(trim(?))", (name,)).fetchone()[0]
+
+def test_lookup_by_non_ascii_name(conn):
+    conn.execute("CREATE TABLE publishers (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE UNIQUE INDEX uq_publishers_name_norm ON publishers (lower(trim(name)))")
+    conn.execute("INSERT INTO publishers (name) VALUES ('Éditions Dupuis')")
+    for spelling in ("Éditions Dupuis", " Éditions DUPUIS "):
+        row = conn.execute("SELECT id FROM publishers WHERE lower(trim(name)) = ?", (name_key(spelling),)).fetchone()
+        assert row == (1,)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO publishers (name) VALUES ('ÉDITIONS dupuis ')")
@@ -0,0 +1,51 @@
+"""Поиск: префиксы слов, фильтр по виду, подсчёт по видам и веса bm25 в индексе"""
+import sqlite3
+from Catal.main import engine
+from Catal.search import RANK
+from support import add_comics, run_services
+
+def test_prefix_search_and_facets():
+    async def scenario(services):
+        await add_comics(services, [
+            {"title": "Spider Tales", "publisher": "Spiral Press", "writer": "Ann Spielberg"},
+            {"title": "Spider Nights", "publisher": "Spiral Press"},
+            {"title": "Moon Knight", "publisher": "Lunar House", "artist": "Emile Spade"}])
+        catal = services.clients["catal"]
+        found = {}
+        for q, params in (("spi", {"facets": True}), ("Spider ta", {}), ("spi", {"kind": "publisher"}),
+                          ("spad", {}), ("spi", {"limit": 2, "offset": 2}), ("zzz", {"facets": True}),
+                          ("s", {})):
+            response = await catal.get("/search", params={"q": q, **params})
+            assert response.status_code == 200, response.text
+            found[(q, tuple(params))] = response.json()
+        return found
+
+    found = run_services(scenario)
+    everything = found[("spi", ("facets",))]
+    assert everything["facets"] == {"comic": 2, "publisher": 1, "writer": 1}
+    #Совпадение в названии весит больше, чем в именах
+    assert [item["kind"] for item in everything["items"][:2]] == ["comic", "comic"]
+    assert [item["name"] for item in found[("Spider ta", ())]["items"]] == ["Spider Tales"]
+    assert [item["name"] for item in found[("spi", ("kind",))]["items"]] == ["Spiral Press"]
+    #Комикс находится и по имени художника
+    assert {(item["kind"], item["name"]) for item in found[("spad", ())]["items"]} == {
+        ("comic", "Moon Knight"), ("artist", "Emile Spade")}
+    assert found[("spi", ("limit", "offset"))]["items"] == everything["items"][2:4]
+    assert found[("zzz", ("facets",))] == {"items": [], "facets": {}}
+    #Одна буква не ранжируется: совпадения по порядку id
+    single = found[("s", ())]["items"]
+    assert {item["score"] for item in single} == {None}
+    assert [item["name"] for item in single if item["kind"] == "comic"] == [
+        "Spider Tales", "Spider Nights", "Moon Knight"]
+
+def test_rank_is_stored_by_migration():
+    async def scenario(services):
+        return engine.url.database
+
+    path = run_services(scenario)
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT v FROM search_index_config WHERE k = 'rank'").fetchone() == (RANK,)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] >= 7
+    finally:
+        conn.close()
@@ -0,0 +1,63 @@
+"""Снимок каталога: частичная выгрузка совпадает с полной, повреждённый снимок реплика не принимает"""
+import pytest
+from Catal.export import export, settings as snapshot_settings
+from Catal.main import exporter
+from Catal.replica import Replica, ReplicaSettings
+from Catal.snapshot import Columns, Snapshot, SnapshotError, build, write
+from support import add_comics, login, run_services
+
+def comics(path: str):
+    """Все комиксы снимка со справочниками"""
+    snapshot = Snapshot(path, verify=True)
+    return [snapshot.comic(row, embed=True) for row in range(snapshot.count)]
+
+def test_incremental_export_matches_full(tmp_path):
+    full_path = str(tmp_path / "full.snap")
+
+    async def scenario(services):
+        catal = services.clients["catal"]
+        denied = await catal.post("/snapshot/export")
+        await login(services, "admin@example.com", "admin")
+        await add_comics(services, [{"title": "Snap Alpha", "amount": 3}, {"title": "Snap Bravo", "amount": 4}])
+        first = await catal.post("/snapshot/export", params={"full": True})
+        await catal.patch("/patch/comicamount", json={"title": "Snap Alpha", "amount": 9})
+        await add_comics(services, [{"title": "Snap Charlie", "publisher": "Pub Snap"}])
+        second = await catal.post("/snapshot/export")
+        export(exporter.database, full_path, snapshot_settings, full=True)
+        return denied, first.json(), second.json()
+
+    denied, first, second = run_services(scenario)
+    assert denied.status_code == 401
+    assert first["incremental"] is False
+    assert second["incremental"] is True and second["changed"] == 2
+    merged = comics(exporter.path)
+    assert merged == comics(full_path)
+    assert {comic["title"]: comic["amount"] for comic in merged if comic["title"].startswith("Snap")} == {
+        "Snap Alpha": 9, "Snap Bravo": 4, "Snap Charlie": 1}
+
+def snapshot_file(path: str, title: str):
+    """Снимок из одного комикса"""
+    columns = Columns()
+    for dimension in ("publisher", "writer", "artist"):
+        columns.add_name(dimension, 1, f"{dimension} one")
+    columns.add_comics([(1, title, 1, 10, 1, 1, 1)])
+    write(path, build(columns, "epoch", 1, 0))
+
+def test_replica_rejects_checksum_mismatch(tmp_path):
+    path = str(tmp_path / "catal.snap")
+    snapshot_file(path, "Good Alpha")
+    replica = Replica(ReplicaSettings(), path)
+    replica.load()
+    replica.check()
+    assert replica.verified
+    snapshot_file(path, "Bad Alpha")
+    data = bytearray(open(path, "rb").read())
+    data[-9] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    with pytest.raises(SnapshotError):
+        Snapshot(path, verify=True)
+    replica.load()
+    assert replica.current().comic(0)["title"] == "Bad Alpha"
+    replica.check()
+    assert replica.errors == 1
+    assert replica.current().comic(0)["title"] == "Good Alpha"
@@ -0,0 +1,82 @@
+"""Получатель пачек: не сохранившиеся сообщения уходят в очередь отказов, остальные сохраняются"""
+import asyncio
+from types import SimpleNamespace
+from sqlalchemy.exc import IntegrityError
+from common.broker import InMemoryBroker, MemoryConsumerTransport
+from common.consumer import BatchConsumer
+
+SETTINGS = SimpleNamespace(concurrency=1, batch_size=10, poll_timeout=0.1, batch_linger=0.01, lag_interval=5.0,
+                           reconnect_delay=0.01, reconnect_max_delay=0.1, dead_letter_queue="orders.dead")
+
+def test_integrity_error_goes_to_dead_letter_queue():
+    broker = InMemoryBroker()
+    for body in (b"1", b"bad", b"2"):
+        broker.publish("orders", body, body.decode())
+    saved = []
+
+    async def persist(messages):
+        if "bad" in messages:
+            raise IntegrityError("INSERT", {}, Exception("UNIQUE constraint failed"))
+        saved.extend(messages)
+
+    transport = MemoryConsumerTransport(SETTINGS, "orders", broker)
+    consumer = BatchConsumer(SETTINGS, lambda body, message_id: body.decode(), persist, lambda: transport)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        await consumer.handle(loop, None, transport, transport.fetch(10, 0.1))
+
+    asyncio.run(run())
+    assert saved == ["1", "2"]
+    assert broker.get("orders.dead", 10)[0][1:] == (b"bad", "bad")
+    assert broker.size("orders") == 0
+    assert consumer.dead_lettered == 1 and consumer.persisted == 2
+
+def test_undecodable_message_goes_to_dead_letter_queue():
+    broker = InMemoryBroker()
+    for body in (b"1", b"not json"):
+        broker.publish("orders", body, body.decode())
+    saved = []
+
+    async def persist(messages):
+        saved.extend(messages)
+
+    def decode(body, message_id):
+        return int(body)
+
+    transport = MemoryConsumerTransport(SETTINGS, "orders", broker)
+    consumer = BatchConsumer(SETTINGS, decode, persist, lambda: transport)
+
+    async def run():
+        await consumer.handle(asyncio.get_running_loop(), None, transport, transport.fetch(10, 0.1))
+
+    asyncio.run(run())
+    assert saved == [1]
+    assert broker.get("orders.dead", 10)[0][1:] == (b"not json", "not json")
+    assert consumer.dead_lettered == 1 and consumer.rejected == 1
+
+def test_consumer_survives_handler_error():
+    broker = InMemoryBroker()
+    broker.publish("orders", b"1", "1")
+    calls = []
+
+    async def persist(messages):
+        calls.append(messages)
+        if len(calls) == 1:
+            raise KeyError("bug in handler")
+
+    consumer = BatchConsumer(SETTINGS, lambda body, message_id: body.decode(), persist,
+                             lambda: MemoryConsumerTransport(SETTINGS, "orders", broker))
+
+    async def run():
+        await consumer.start()
+        for _ in range(100):
+            if consumer.persisted:
+                break
+            await asyncio.sleep(0.02)
+        await consumer.stop()
+
+    asyncio.run(run())
+    assert calls == [["1"], ["1"]]
+    assert consumer.persisted == 1 and consumer.requeued == 1
+    assert broker.size("orders") == 0 and not broker.unacked
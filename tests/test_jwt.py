@@ -0,0 +1,65 @@
+"""Проверка токенов: отзыв из clients.db, ложные срабатывания фильтра Блума и кэш"""
+import asyncio
+import sqlite3
+import time
+import jwt
+import pytest
+from fastapi import HTTPException
+from common.jwt import JWTSettings, TokenVerifier
+
+def token(jti: str, subject: str = "user@example.com"):
+    """Подписанный access-токен (PyJWT 1.x возвращает bytes)"""
+    encoded = jwt.encode({"sub": subject, "jti": jti, "type": "access", "exp": int(time.time()) + 600}, "secret",
+                         algorithm="HS256")
+    return encoded.decode() if isinstance(encoded, bytes) else encoded
+
+def revocations(tmp_path):
+    """clients.db с таблицей revoked_tokens, как у Auth"""
+    path = tmp_path / "clients.db"
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE revoked_tokens (id INTEGER PRIMARY KEY, jti TEXT, expires_at REAL)")
+    return path
+
+def revoke(path, jti: str):
+    """Отзыв, как его записывает Auth при выходе"""
+    with sqlite3.connect(path) as db:
+        db.execute("INSERT INTO revoked_tokens (jti, expires_at) VALUES (?, ?)", (jti, time.time() + 600))
+
+def test_revoked_token_is_rejected_after_sync(tmp_path):
+    path = revocations(tmp_path)
+    verifier = TokenVerifier(JWTSettings(revocation_db=str(path)))
+    access = token("jti-revoked")
+    assert verifier.verify(access).subject == "user@example.com"
+    revoke(path, "jti-revoked")
+    assert asyncio.run(verifier.sync()) == 1
+    with pytest.raises(HTTPException) as error:
+        verifier.verify(access)
+    assert error.value.status_code == 401 and error.value.detail == "Token has been revoked"
+    verifier.close()
+
+def test_bloom_false_positive_does_not_reject(tmp_path):
+    path = revocations(tmp_path)
+    #Один бит на все ключи: любой jti "возможно отозван"
+    verifier = TokenVerifier(JWTSettings(revocation_db=str(path), bloom_bits=1, bloom_hashes=1))
+    revoke(path, "jti-other")
+    asyncio.run(verifier.sync())
+    assert "jti-valid" in verifier.bloom
+    assert verifier.verify(token("jti-valid")).jti == "jti-valid"
+    verifier.close()
+
+def test_cached_tokens_do_not_outlive_revocation(tmp_path):
+    path = revocations(tmp_path)
+    verifier = TokenVerifier(JWTSettings(revocation_db=str(path), cache_size=2))
+    tokens = [token("jti-shared"), token("jti-shared", "other@example.com"), token("jti-kept")]
+    for access in tokens:
+        verifier.verify(access)
+    verifier.verify(tokens[2])
+    assert verifier.hits == 1 and len(verifier.cache) == 2
+    revoke(path, "jti-shared")
+    asyncio.run(verifier.sync())
+    assert "jti-shared" not in verifier.by_jti and len(verifier.cache) == 1
+    for access in tokens[:2]:
+        with pytest.raises(HTTPException):
+            verifier.verify(access)
+    assert verifier.verify(tokens[2]).jti == "jti-kept"
+    verifier.close()
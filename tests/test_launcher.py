@@ -0,0 +1,34 @@
+"""Мастер pre-fork: перезапуск упавших рабочих с задержкой и выход при частых падениях"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from launcher import RestartPolicy
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def test_restart_delay_grows_and_resets():
+    policy = RestartPolicy(0.5, 2.0, 5, 10.0)
+    assert [policy.failed(now) for now in (0, 1, 2, 3)] == [0.5, 1.0, 2.0, 2.0]
+    #Падения старше окна забываются: задержка снова начальная
+    assert policy.failed(100) == 0.5
+
+def test_too_many_failures_stop_master():
+    policy = RestartPolicy(0.1, 1.0, 3, 60.0)
+    assert policy.failed(0) == 0.1 and policy.failed(1) == 0.2
+    assert policy.failed(2) is None
+
+def test_master_exits_when_workers_keep_crashing(tmp_path):
+    #Приложение, у которого не проходит запуск (lifespan): рабочий сразу завершается
+    (tmp_path / "crashing.py").write_text(
+        "async def app(scope, receive, send):\n"
+        "    if scope['type'] == 'lifespan':\n"
+        "        await receive()\n"
+        "        raise RuntimeError('broken startup')\n")
+    result = subprocess.run(
+        [sys.executable, str(ROOT / "launcher.py"), "--app", "crashing:app", "--port", "0", "--workers", "1",
+         "--log-level", "critical", "--restart-delay", "0.01", "--max-failures", "3"],
+        env={**os.environ, "PYTHONPATH": str(tmp_path)}, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert result.stdout.count("restarting in") == 2
+    assert "3 failures within 60 s, stopping" in result.stdout
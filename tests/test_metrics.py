@@ -0,0 +1,21 @@
+"""Метрики: у каждого сервиса свой реестр, серии помечены service"""
+from common.metrics import Registry
+
+def test_service_label_on_every_series():
+    registry = Registry("catal")
+    registry.counter("requests_total", "Requests", ("route",)).inc(("/a b{",))
+    registry.callback("queue_depth", "Queue", lambda: 3)
+    registry.histogram("latency_seconds", "Latency").observe(0.01)
+    lines = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert 'requests_total{service="catal",route="/a b{"} 1' in lines
+    assert 'queue_depth{service="catal"} 3' in lines
+    assert 'latency_seconds_count{service="catal"} 1' in lines
+    assert all('service="catal"' in line for line in lines)
+
+def test_registries_do_not_share_series():
+    auth, basket = Registry("auth"), Registry("basket")
+    auth.counter("requests_total", "Requests").inc()
+    basket.counter("requests_total", "Requests").inc(amount=2)
+    assert 'requests_total{service="auth"} 1' in auth.render()
+    assert 'requests_total{service="basket"} 2' in basket.render()
+    assert "basket" not in auth.render()
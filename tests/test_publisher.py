@@ -0,0 +1,33 @@
+"""Издатель: ошибка транспорта вне AMQP завершает ожидание отправителя, а поток продолжает работу"""
+import asyncio
+import pytest
+from common.broker import BrokerUnavailable, InMemoryBroker, MemoryTransport, Publisher, PublisherSettings
+
+class BrokenOnce(MemoryTransport):
+    """Первая пачка падает с ошибкой, не относящейся к AMQP"""
+
+    def __init__(self, broker):
+        super().__init__(broker)
+        self.failures = 1
+
+    def publish_batch(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise ValueError("cannot encode")
+        super().publish_batch(messages)
+
+def test_worker_survives_unexpected_error():
+    broker = InMemoryBroker()
+    publisher = Publisher(PublisherSettings(backend="memory", queue="q"), broker)
+    publisher.transport = lambda: BrokenOnce(broker)
+
+    async def run():
+        await publisher.start()
+        with pytest.raises(BrokerUnavailable):
+            await asyncio.wait_for(publisher.publish(b"1"), 1)
+        await asyncio.wait_for(publisher.publish(b"2"), 1)
+        await asyncio.wait_for(publisher.stop(), 1)
+
+    asyncio.run(run())
+    assert broker.size("q") == 1
+    assert publisher.failed == 1 and publisher.published == 1